@@ -0,0 +1,116 @@
+"""Cost estimates and priorities of queued requests, and the backpressure they drive."""
+
+import logging
+from typing import Dict, Any, Optional, List, Union
+
+from streaming import STOP_REASONS
+
+logger = logging.getLogger(__name__)
+
+PRIORITY_CLASSES = ("high", "normal", "low")
+SCHEDULING_POLICIES = ("sjf", "fifo")
+
+# Rough length of a token in text that has not been tokenized yet
+CHARS_PER_TOKEN = 4
+
+
+def resolve_priority(value: Any, default: str = "normal") -> str:
+    """A known priority class, or ``default`` for anything else."""
+    return value if value in PRIORITY_CLASSES else default
+
+
+def estimate_tokens(prompt: Union[str, List[int]]) -> int:
+    """Token count of a prompt; text is estimated rather than tokenized a second time."""
+    if isinstance(prompt, list):
+        return len(prompt)
+    return max(len(prompt) // CHARS_PER_TOKEN, 1)
+
+
+def priority_score(cost_seconds: float, priority: str, waited_seconds: float, step_seconds: float, aging: float) -> float:
+    """Rank of a queued request; the lowest score runs first.
+
+    Shorter expected jobs go first, every priority class above ``normal`` is
+    worth ``step_seconds`` of expected run time and every second spent
+    waiting ``aging`` seconds, so long and low priority jobs still get their
+    turn.
+    """
+    offset = (PRIORITY_CLASSES.index(priority) - 1) * step_seconds
+    return cost_seconds + offset - aging * waited_seconds
+
+
+def concurrency_target(max_concurrency: int, in_flight: int, backlog_seconds: float, slo_seconds: float) -> int:
+    """Jobs RunPod should hand to the worker, given how long queued work will take.
+
+    Past the latency SLO the worker keeps the jobs it has but takes no new
+    ones, which leaves them to other workers or queued at the endpoint.
+    """
+    if not slo_seconds or backlog_seconds <= slo_seconds:
+        return max_concurrency
+    return max(min(in_flight, max_concurrency), 1)
+
+
+class CostModel:
+    """Expected model time of a request from its prompt tokens and ``max_tokens``.
+
+    The prefill and decode rates start from configured values and then
+    follow the rates measured on finished requests as moving averages, as
+    does the share of ``max_tokens`` that requests actually generate. Decode
+    rates measured inside the continuous batch are per sequence, so they
+    already include the cost of sharing the model.
+    """
+
+    def __init__(self, prefill_tokens_per_second: float, decode_tokens_per_second: float, smoothing: float = 0.2):
+        self.prefill_tokens_per_second = prefill_tokens_per_second
+        self.decode_tokens_per_second = decode_tokens_per_second
+        # Pessimistic until measured: every request uses all of its max_tokens
+        self.completion_ratio = 1.0
+        self.smoothing = smoothing
+        self.observations = 0
+
+    def estimate(self, prompt_tokens: int, max_tokens: int) -> float:
+        """Expected seconds of model time."""
+        return (
+            prompt_tokens / self.prefill_tokens_per_second
+            + max_tokens * self.completion_ratio / self.decode_tokens_per_second
+        )
+
+    def remaining(self, prompt_tokens_left: int, max_tokens: int, generated: int) -> float:
+        """Expected seconds a running request still needs."""
+        return (
+            prompt_tokens_left / self.prefill_tokens_per_second
+            + max(max_tokens * self.completion_ratio - generated, 0) / self.decode_tokens_per_second
+        )
+
+    def observe(self, final_chunk: Dict[str, Any], max_tokens: Optional[int] = None):
+        """Refine the rates from the usage and timings of a finished request."""
+        usage = final_chunk.get("usage") or {}
+        timings = final_chunk.get("timings") or {}
+        prompt_tokens = usage.get("prompt_tokens", 0)
+        completion_tokens = usage.get("completion_tokens", 0)
+
+        prefill_ms = timings.get("prefill_ms")
+        if prefill_ms and prompt_tokens:
+            self.prefill_tokens_per_second = self._smooth(self.prefill_tokens_per_second, prompt_tokens / (prefill_ms / 1000))
+
+        decode_time_ms = timings.get("decode_time_ms")
+        if decode_time_ms and completion_tokens > 1:
+            self.decode_tokens_per_second = self._smooth(
+                self.decode_tokens_per_second, (completion_tokens - 1) / (decode_time_ms / 1000)
+            )
+
+        # A stopped request says nothing about how much it would have generated
+        if max_tokens and final_chunk.get("finish_reason") not in STOP_REASONS:
+            self.completion_ratio = self._smooth(self.completion_ratio, min(completion_tokens / max_tokens, 1.0))
+
+        self.observations += 1
+
+    def _smooth(self, current: float, measured: float) -> float:
+        return current + self.smoothing * (measured - current)
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "prefill_tokens_per_second": round(self.prefill_tokens_per_second, 3),
+            "decode_tokens_per_second": round(self.decode_tokens_per_second, 3),
+            "completion_ratio": round(self.completion_ratio, 4),
+            "observations": self.observations
+        }
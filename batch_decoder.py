@@ -0,0 +1,207 @@
+"""Multi-sequence decoding on top of the low-level llama.cpp batch API."""
+
+import codecs
+import logging
+from dataclasses import dataclass
+from typing import List, Optional
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class KVCacheFullError(RuntimeError):
+    """Raised when llama.cpp cannot find a KV cache slot for a batch."""
+
+
+@dataclass
+class BatchEntry:
+    """One token placed into a llama.cpp batch."""
+    token: int
+    pos: int
+    seq_id: int
+    logits: bool = False
+
+
+class LlamaBatchBackend:
+    """Decodes tokens for several llama.cpp sequences in a single batch.
+
+    The backend shares the context of an already loaded ``Llama`` instance.
+    Each request gets its own sequence id inside the unified KV cache, so the
+    high-level ``Llama`` state is reset whenever batched decoding starts.
+    """
+
+    def __init__(self, model, max_batch_tokens: Optional[int] = None):
+        # Import here to avoid issues if llama-cpp-python is not installed
+        import llama_cpp
+
+        self._llama_cpp = llama_cpp
+        self.model = model
+        self.ctx = model._ctx.ctx
+        self.n_vocab = model.n_vocab()
+        self.n_ctx = model.n_ctx()
+        self.n_batch = max_batch_tokens or model.n_batch
+        self._batch = llama_cpp.llama_batch_init(self.n_batch, 0, 1)
+
+    def close(self):
+        """Release the native batch buffer."""
+        if self._batch is not None:
+            self._llama_cpp.llama_batch_free(self._batch)
+            self._batch = None
+
+    def clear(self):
+        """Drop every sequence from the KV cache and reset the high-level model state."""
+        self._llama_cpp.llama_kv_cache_clear(self.ctx)
+        self.model.reset()
+
+    def decode(self, entries: List[BatchEntry]) -> List[np.ndarray]:
+        """Evaluate a batch and return the logits rows of entries that asked for them."""
+        batch = self._batch
+        logits_indices = []
+
+        for i, entry in enumerate(entries):
+            batch.token[i] = entry.token
+            batch.pos[i] = entry.pos
+            batch.n_seq_id[i] = 1
+            batch.seq_id[i][0] = entry.seq_id
+            batch.logits[i] = entry.logits
+            if entry.logits:
+                logits_indices.append(i)
+
+        batch.n_tokens = len(entries)
+
+        result = self._llama_cpp.llama_decode(self.ctx, batch)
+        if result == 1:
+            raise KVCacheFullError("No KV cache slot available for batch")
+        if result != 0:
+            raise RuntimeError(f"llama_decode failed with code {result}")
+
+        rows = []
+        for i in logits_indices:
+            pointer = self._llama_cpp.llama_get_logits_ith(self.ctx, i)
+            rows.append(np.ctypeslib.as_array(pointer, shape=(self.n_vocab,)).copy())
+
+        return rows
+
+    def defragment(self):
+        """Ask llama.cpp to compact the KV cache."""
+        self._llama_cpp.llama_kv_cache_defrag(self.ctx)
+        self._llama_cpp.llama_kv_cache_update(self.ctx)
+
+    def copy_sequence(self, source_seq_id: int, target_seq_id: int, length: int):
+        """Let a sequence share the KV cells of another sequence's first ``length`` positions."""
+        self._llama_cpp.llama_kv_cache_seq_cp(self.ctx, source_seq_id, target_seq_id, 0, length)
+
+    def remove_sequence(self, seq_id: int):
+        """Free every KV cell held by a sequence."""
+        self._llama_cpp.llama_kv_cache_seq_rm(self.ctx, seq_id, -1, -1)
+
+    def tokenize(self, text: str) -> List[int]:
+        """Tokenize a prompt the same way the high-level completion API does."""
+        return self.model.tokenize(text.encode("utf-8"), special=True)
+
+    def detokenize(self, tokens: List[int], prev_tokens: Optional[List[int]] = None) -> bytes:
+        """Convert tokens to bytes, using previous tokens for correct spacing."""
+        return self.model.detokenize(tokens, prev_tokens=prev_tokens)
+
+    def is_eog(self, token: int) -> bool:
+        """Check whether a token ends generation (EOS, EOT, ...)."""
+        return bool(self._llama_cpp.llama_token_is_eog(self.model._model.model, token))
+
+
+class TokenSampler:
+    """NumPy implementation of the llama.cpp top-k / top-p / temperature sampler chain."""
+
+    def __init__(
+        self,
+        temperature: float = 0.7,
+        top_k: int = 40,
+        top_p: float = 0.9,
+        repeat_penalty: float = 1.1,
+        seed: Optional[int] = None,
+        penalty_last_n: int = 64
+    ):
+        self.temperature = temperature
+        self.top_k = top_k
+        self.top_p = top_p
+        self.repeat_penalty = repeat_penalty
+        self.penalty_last_n = penalty_last_n
+        self.rng = np.random.default_rng(seed)
+
+    def sample(self, logits: np.ndarray, history: List[int]) -> int:
+        """Pick the next token from a logits row."""
+        if self.repeat_penalty != 1.0 and history:
+            recent = np.unique(np.asarray(history[-self.penalty_last_n:], dtype=np.intp))
+            values = logits[recent]
+            logits[recent] = np.where(values > 0, values / self.repeat_penalty, values * self.repeat_penalty)
+
+        if self.temperature <= 0.0:
+            return int(np.argmax(logits))
+
+        k = min(self.top_k, logits.shape[0]) if self.top_k > 0 else logits.shape[0]
+        candidates = np.argpartition(logits, -k)[-k:]
+        scores = logits[candidates] / self.temperature
+
+        order = np.argsort(scores)[::-1]
+        candidates = candidates[order]
+        scores = scores[order]
+
+        probs = np.exp(scores - scores[0])
+        probs /= probs.sum()
+
+        if self.top_p < 1.0:
+            cutoff = int(np.searchsorted(np.cumsum(probs), self.top_p)) + 1
+            candidates = candidates[:cutoff]
+            probs = probs[:cutoff] / probs[:cutoff].sum()
+
+        return int(self.rng.choice(candidates, p=probs))
+
+
+def log_softmax(logits: np.ndarray) -> np.ndarray:
+    """Log-probabilities of every token for a logits row."""
+    shifted = logits - logits.max()
+    return shifted - np.log(np.exp(shifted).sum())
+
+
+class LogprobTracker:
+    """llama-cpp-python logits processor that sums the log-probabilities of sampled tokens.
+
+    Passed as ``logits_processor`` it sees every logits row before sampling,
+    but not the token sampled from it; that token appears in ``input_ids``
+    once it has been evaluated. The last token of a completion that ran to
+    ``max_tokens`` is never evaluated and therefore not counted.
+    """
+
+    def __init__(self):
+        self.total = 0.0
+        self.tokens = 0
+        # Position of the next token and the log-probabilities it was sampled from
+        self._pending = None
+
+    def __call__(self, input_ids, scores: np.ndarray) -> np.ndarray:
+        if self._pending is not None:
+            position, logprobs = self._pending
+            if len(input_ids) > position:
+                self.total += float(logprobs[input_ids[position]])
+                self.tokens += 1
+        self._pending = (len(input_ids), log_softmax(scores))
+        return scores
+
+
+class IncrementalDetokenizer:
+    """Turns a token stream into text without splitting multi-byte characters."""
+
+    def __init__(self, backend: LlamaBatchBackend, prompt_tokens: List[int]):
+        self.backend = backend
+        self._context = list(prompt_tokens[-8:])
+        self._decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+
+    def add(self, token: int) -> str:
+        """Decode one more token and return whatever complete text it produced."""
+        piece = self.backend.detokenize([token], prev_tokens=self._context)
+        self._context = self._context[-7:] + [token]
+        return self._decoder.decode(piece)
+
+    def flush(self) -> str:
+        """Return any bytes still waiting for the rest of a character."""
+        return self._decoder.decode(b"", final=True)
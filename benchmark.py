@@ -0,0 +1,548 @@
+"""Offline benchmark and load generator for the worker.
+
+Runs a synthetic workload through ``handler.handler`` (the full job path:
+validation, scheduling, response assembly) or straight through
+``InferenceEngine`` and reports throughput, latency percentiles and the
+per-request time spent outside the model. Without ``--model-path`` a
+deterministic stub model decodes at a fixed rate, so the worker's own
+overhead can be measured on any machine; with it, a real (tiny) GGUF file is
+loaded through llama-cpp-python.
+
+    python benchmark.py --requests 200 --concurrency 8 --prompt-tokens 64-512 --max-tokens 32-128
+    python benchmark.py --model-path tiny.gguf --target engine --stream
+    python benchmark.py --save-baseline baseline.json
+    python benchmark.py --baseline baseline.json --tolerance 0.1
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import random
+import re
+import sys
+import time
+from dataclasses import dataclass, replace
+from typing import Dict, Any, Optional, List, Tuple
+
+import numpy as np
+
+from config import config
+
+logger = logging.getLogger(__name__)
+
+# Control tokens of the stub model; every other token is one byte
+SPECIAL_TOKENS = {"<s>": 1, "</s>": 2, "<|im_start|>": 3, "<|im_end|>": 4}
+SPECIAL_PATTERN = re.compile(b"(" + b"|".join(re.escape(token.encode("utf-8")) for token in SPECIAL_TOKENS) + b")")
+BYTE_OFFSET = 16
+
+WORDS = (
+    "the model reads a prompt and writes an answer one token at a time while the worker "
+    "queues jobs schedules requests renders chat templates and streams chunks back to clients "
+    "latency depends on prompt length output length batch size and how busy the GPU is"
+).split()
+
+# Report fields compared against a baseline: (path, True if higher is better)
+COMPARED_FIELDS = (
+    ("throughput.requests_per_second", True),
+    ("throughput.completion_tokens_per_second", True),
+    ("latency_ms.p50", False),
+    ("latency_ms.p95", False),
+    ("latency_ms.p99", False),
+    ("ttft_ms.p50", False),
+    ("overhead_ms.p50", False),
+    ("overhead_ms.p95", False)
+)
+
+
+class FakeLlama:
+    """Deterministic stand-in for ``llama_cpp.Llama`` that decodes at a fixed rate.
+
+    Tokens are single bytes plus a few ChatML control tokens, so an ASCII
+    prompt of N characters is N tokens long. A call sleeps for the prompt's
+    prefill time and then emits one token every ``1 / tokens_per_second``
+    seconds, always ``max_tokens`` of them. The output only depends on the
+    prompt, and the time a request spends in the model is known exactly
+    (``model_seconds``). Like llama.cpp, the context (``_input_ids``) holds
+    the last prompt and every emitted token but the final one, which was
+    sampled and never evaluated.
+    """
+
+    def __init__(self, tokens_per_second: float = 50.0, prefill_tokens_per_second: float = 2000.0, n_ctx: int = 4096):
+        self.tokens_per_second = tokens_per_second
+        self.prefill_tokens_per_second = prefill_tokens_per_second
+        self._n_ctx = n_ctx
+        self.metadata = {"general.architecture": "fake", "general.name": "fake-llama"}
+        self.draft_model = None
+        self.cache = None
+        self.calls = 0
+        self._input_ids = np.zeros(0, dtype=np.intc)
+
+    def n_ctx(self) -> int:
+        return self._n_ctx
+
+    def n_vocab(self) -> int:
+        return 256 + BYTE_OFFSET
+
+    def token_bos(self) -> int:
+        return SPECIAL_TOKENS["<s>"]
+
+    def token_eos(self) -> int:
+        return SPECIAL_TOKENS["</s>"]
+
+    def set_cache(self, cache):
+        self.cache = cache
+
+    def close(self):
+        pass
+
+    def tokenize(self, text: bytes, add_bos: bool = True, special: bool = False) -> List[int]:
+        tokens = [self.token_bos()] if add_bos else []
+        if not special or b"<" not in text:
+            tokens.extend(byte + BYTE_OFFSET for byte in text)
+            return tokens
+
+        for index, piece in enumerate(SPECIAL_PATTERN.split(text)):
+            if index % 2:
+                tokens.append(SPECIAL_TOKENS[piece.decode("utf-8")])
+            else:
+                tokens.extend(byte + BYTE_OFFSET for byte in piece)
+        return tokens
+
+    def detokenize(self, tokens: List[int], prev_tokens: Optional[List[int]] = None, special: bool = False) -> bytes:
+        names = {token_id: name.encode("utf-8") for name, token_id in SPECIAL_TOKENS.items()}
+        return b"".join(
+            bytes((token - BYTE_OFFSET,)) if token >= BYTE_OFFSET else (names.get(token, b"") if special else b"")
+            for token in tokens
+        )
+
+    def model_seconds(self, prompt_tokens: int, completion_tokens: int) -> float:
+        """Time a request of this size spends in the stub model."""
+        return prompt_tokens / self.prefill_tokens_per_second + completion_tokens / self.tokens_per_second
+
+    def __call__(self, prompt, max_tokens: int = 16, stream: bool = False, stopping_criteria=None, **kwargs):
+        self.calls += 1
+        prompt_tokens = prompt if isinstance(prompt, list) else self.tokenize(prompt.encode("utf-8"))
+        if len(prompt_tokens) >= self._n_ctx:
+            raise ValueError(f"Requested tokens ({len(prompt_tokens)}) exceed context window of {self._n_ctx}")
+
+        if max_tokens is None or max_tokens <= 0:
+            max_tokens = self._n_ctx - len(prompt_tokens)
+        max_tokens = min(max_tokens, self._n_ctx - len(prompt_tokens))
+
+        # The completion cycles through the word list from a point chosen by the prompt
+        text = " ".join(WORDS[(sum(prompt_tokens) + index) % len(WORDS)] for index in range(max_tokens))
+        completion = [byte + BYTE_OFFSET for byte in text.encode("utf-8")[:max_tokens]]
+
+        tokens = self.generate(prompt_tokens, completion, stopping_criteria)
+        if stream:
+            return self._stream(tokens)
+
+        generated = list(tokens)
+        return {
+            "choices": [{
+                "text": self.detokenize(generated).decode("utf-8"),
+                "finish_reason": "length" if len(generated) == max_tokens else "stop"
+            }],
+            "usage": {
+                "prompt_tokens": len(prompt_tokens),
+                "completion_tokens": len(generated),
+                "total_tokens": len(prompt_tokens) + len(generated)
+            }
+        }
+
+    def generate(self, prompt_tokens: List[int], completion: List[int], stopping_criteria):
+        """Emit the completion at the configured rate, sleeping to absolute deadlines.
+
+        Like ``Llama.generate``, this is the token loop a call iterates, so
+        wrappers the engine puts around it see the same tokens.
+        """
+        deadline = time.perf_counter() + len(prompt_tokens) / self.prefill_tokens_per_second
+        interval = 1.0 / self.tokens_per_second
+
+        self._input_ids = np.asarray(prompt_tokens, dtype=np.intc)
+        for index, token in enumerate(completion):
+            deadline += interval
+            delay = deadline - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+
+            if index:
+                self._input_ids = np.append(self._input_ids, np.intc(completion[index - 1]))
+            yield token
+            if stopping_criteria is not None and stopping_criteria(range(len(prompt_tokens) + index + 1), None):
+                return
+
+    def _stream(self, tokens):
+        for token in tokens:
+            yield {"choices": [{"text": self.detokenize([token]).decode("utf-8"), "finish_reason": None}]}
+        yield {"choices": [{"text": "", "finish_reason": "length"}]}
+
+
+@dataclass
+class LengthDistribution:
+    """Token counts drawn per request: ``128``, ``64-512`` (uniform) or ``32,64,256`` (choice)."""
+    low: int
+    high: int
+    choices: Optional[Tuple[int, ...]] = None
+
+    @classmethod
+    def parse(cls, spec: str) -> "LengthDistribution":
+        spec = str(spec).strip()
+        if "," in spec:
+            choices = tuple(int(value) for value in spec.split(","))
+            return cls(min(choices), max(choices), choices)
+        if "-" in spec:
+            low, high = (int(value) for value in spec.split("-", 1))
+            return cls(min(low, high), max(low, high))
+        return cls(int(spec), int(spec))
+
+    def sample(self, rng: random.Random) -> int:
+        if self.choices:
+            return rng.choice(self.choices)
+        return rng.randint(self.low, self.high)
+
+
+@dataclass
+class RequestResult:
+    """Measurements of one benchmark request."""
+    status: str
+    latency_ms: float
+    ttft_ms: Optional[float] = None
+    queue_wait_ms: Optional[float] = None
+    model_ms: Optional[float] = None
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    error: Optional[str] = None
+
+    @property
+    def overhead_ms(self) -> Optional[float]:
+        """Time the request spent in the worker but neither queued nor in the model."""
+        if self.model_ms is None:
+            return None
+        return max(self.latency_ms - (self.queue_wait_ms or 0.0) - self.model_ms, 0.0)
+
+
+def make_prompt(model, rng: random.Random, n_tokens: int) -> str:
+    """Text that tokenizes to roughly ``n_tokens`` tokens with the given model."""
+    text = " ".join(rng.choice(WORDS) for _ in range(n_tokens))
+    tokens = model.tokenize(text.encode("utf-8"), add_bos=False, special=False)[:n_tokens]
+    return model.detokenize(tokens).decode("utf-8", errors="ignore")
+
+
+def make_workload(model, args, count: int, seed: int) -> List[Dict[str, Any]]:
+    """Job inputs with prompt and output lengths drawn from the configured distributions."""
+    rng = random.Random(seed)
+    prompt_lengths = LengthDistribution.parse(args.prompt_tokens)
+    output_lengths = LengthDistribution.parse(args.max_tokens)
+
+    workload = []
+    for _ in range(count):
+        text = make_prompt(model, rng, prompt_lengths.sample(rng))
+        job_input = {
+            "max_tokens": output_lengths.sample(rng),
+            "temperature": args.temperature,
+            "stream": args.stream
+        }
+        if args.chat:
+            job_input["messages"] = [
+                {"role": "system", "content": "You are a helpful assistant."},
+                {"role": "user", "content": text}
+            ]
+        else:
+            job_input["prompt"] = text
+        workload.append(job_input)
+    return workload
+
+
+def _result_from_final(model, final: Dict[str, Any], latency_ms: float, ttft_ms: Optional[float]) -> RequestResult:
+    """Build a result from a response or final stream chunk."""
+    if final.get("status") == "error" or final.get("finish_reason") == "error":
+        return RequestResult(status="error", latency_ms=latency_ms, error=final.get("error"))
+
+    usage = final.get("usage", {})
+    timings = final.get("timings", {})
+    prompt_tokens = usage.get("prompt_tokens", 0)
+    completion_tokens = usage.get("completion_tokens", 0)
+
+    # The stub knows its own cost; a real model's is taken from the reported timings
+    if isinstance(model, FakeLlama):
+        model_ms = model.model_seconds(prompt_tokens, completion_tokens) * 1000
+    elif timings.get("prefill_ms") is not None:
+        model_ms = timings["prefill_ms"] + (timings.get("decode_time_ms") or 0.0)
+    else:
+        model_ms = None
+
+    return RequestResult(
+        status="cached" if final.get("cached") else "success",
+        latency_ms=latency_ms,
+        ttft_ms=ttft_ms,
+        queue_wait_ms=timings.get("queue_wait_ms"),
+        model_ms=model_ms,
+        prompt_tokens=prompt_tokens,
+        completion_tokens=completion_tokens
+    )
+
+
+async def run_handler_workload(handler_module, model, workload: List[Dict[str, Any]], concurrency: int) -> List[RequestResult]:
+    """Send the jobs through ``handler.handler`` with at most ``concurrency`` in flight."""
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def run_one(index: int, job_input: Dict[str, Any]) -> RequestResult:
+        async with semaphore:
+            start = time.perf_counter()
+            first_text = None
+            final = {}
+            async for item in handler_module.handler({"id": f"bench-{index}", "input": job_input}):
+                if first_text is None and (item.get("text") or item.get("generated_text")):
+                    first_text = time.perf_counter()
+                final = item
+            end = time.perf_counter()
+
+        ttft_ms = (first_text - start) * 1000 if first_text is not None and job_input.get("stream") else None
+        return _result_from_final(model, final, (end - start) * 1000, ttft_ms)
+
+    return await asyncio.gather(*(run_one(index, job_input) for index, job_input in enumerate(workload)))
+
+
+def run_engine_workload(engine, model, workload: List[Dict[str, Any]]) -> List[RequestResult]:
+    """Run the jobs one after another directly on ``InferenceEngine``."""
+    results = []
+    for job_input in workload:
+        start = time.perf_counter()
+        first_text = None
+        final = {}
+        try:
+            params = engine.validate_params(job_input)
+            if job_input.get("messages"):
+                prompt, _ = engine.encode_chat(job_input["messages"], params)
+            else:
+                prompt = engine.build_prompt(prompt=job_input["prompt"])
+
+            for chunk in engine.run_request(prompt, params):
+                if first_text is None and chunk["text"]:
+                    first_text = time.perf_counter()
+                final = chunk
+        except Exception as e:
+            final = {"status": "error", "error": str(e)}
+        end = time.perf_counter()
+
+        ttft_ms = (first_text - start) * 1000 if first_text is not None and job_input.get("stream") else None
+        results.append(_result_from_final(model, final, (end - start) * 1000, ttft_ms))
+    return results
+
+
+def _summary(values: List[float]) -> Dict[str, Any]:
+    # Import here so the stub model works without the rest of the worker
+    from metrics import RollingHistogram
+
+    histogram = RollingHistogram(max(len(values), 1))
+    for value in values:
+        histogram.observe(value)
+    summary = histogram.summary()
+    summary["max"] = round(max(values), 3) if values else None
+    return summary
+
+
+def build_report(results: List[RequestResult], wall_seconds: float, args, phases: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """Aggregate request results into the benchmark report."""
+    succeeded = [result for result in results if result.status != "error"]
+    completion_tokens = sum(result.completion_tokens for result in succeeded)
+    prompt_tokens = sum(result.prompt_tokens for result in succeeded)
+
+    report = {
+        "settings": {
+            "model": args.model_path or "fake",
+            "target": args.target,
+            "requests": args.requests,
+            "concurrency": args.concurrency if args.target == "handler" else 1,
+            "prompt_tokens": args.prompt_tokens,
+            "max_tokens": args.max_tokens,
+            "stream": args.stream,
+            "chat": args.chat,
+            "parallel_sequences": args.parallel_sequences
+        },
+        "requests": len(results),
+        "errors": len(results) - len(succeeded),
+        "wall_seconds": round(wall_seconds, 3),
+        "throughput": {
+            "requests_per_second": round(len(succeeded) / wall_seconds, 3) if wall_seconds else 0.0,
+            "prompt_tokens_per_second": round(prompt_tokens / wall_seconds, 2) if wall_seconds else 0.0,
+            "completion_tokens_per_second": round(completion_tokens / wall_seconds, 2) if wall_seconds else 0.0
+        },
+        "latency_ms": _summary([result.latency_ms for result in succeeded]),
+        "ttft_ms": _summary([result.ttft_ms for result in succeeded if result.ttft_ms is not None]),
+        "queue_wait_ms": _summary([result.queue_wait_ms for result in succeeded if result.queue_wait_ms is not None]),
+        "overhead_ms": _summary([result.overhead_ms for result in succeeded if result.overhead_ms is not None])
+    }
+
+    errors = sorted({result.error for result in results if result.error})
+    if errors:
+        report["error_messages"] = errors[:10]
+    if phases is not None:
+        report["phases"] = phases
+    return report
+
+
+def _lookup(report: Dict[str, Any], path: str) -> Optional[float]:
+    value = report
+    for key in path.split("."):
+        if not isinstance(value, dict):
+            return None
+        value = value.get(key)
+    return value if isinstance(value, (int, float)) else None
+
+
+def compare_reports(report: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> Tuple[List[Dict[str, Any]], bool]:
+    """Compare a report with a saved baseline; returns the rows and whether anything regressed."""
+    rows = []
+    regressed = False
+    for path, higher_is_better in COMPARED_FIELDS:
+        current = _lookup(report, path)
+        previous = _lookup(baseline, path)
+        if current is None or previous is None:
+            continue
+
+        change = (current - previous) / previous if previous else 0.0
+        worse = -change if higher_is_better else change
+        row_regressed = worse > tolerance
+        regressed = regressed or row_regressed
+        rows.append({
+            "metric": path,
+            "baseline": previous,
+            "current": current,
+            "change": round(change, 4),
+            "regressed": row_regressed
+        })
+    return rows, regressed
+
+
+def print_report(report: Dict[str, Any], comparison: Optional[List[Dict[str, Any]]] = None):
+    """Print a short human-readable summary."""
+    settings = report["settings"]
+    print(
+        f"{settings['target']} on {settings['model']}: {report['requests']} requests "
+        f"({report['errors']} errors), concurrency {settings['concurrency']}, {report['wall_seconds']}s"
+    )
+    throughput = report["throughput"]
+    print(
+        f"  throughput   {throughput['requests_per_second']} req/s, "
+        f"{throughput['completion_tokens_per_second']} completion tok/s, "
+        f"{throughput['prompt_tokens_per_second']} prompt tok/s"
+    )
+    for key in ("latency_ms", "ttft_ms", "queue_wait_ms", "overhead_ms"):
+        summary = report[key]
+        if summary["count"]:
+            print(f"  {key:<12} p50 {summary['p50']}  p95 {summary['p95']}  p99 {summary['p99']}  max {summary['max']}")
+
+    for row in comparison or []:
+        marker = "REGRESSED" if row["regressed"] else ""
+        print(f"  {row['metric']:<40} {row['baseline']:>12} -> {row['current']:>12} ({row['change']:+.1%}) {marker}")
+
+
+def load_model(args):
+    """The stub model, or the GGUF file at ``--model-path``."""
+    if not args.model_path:
+        return FakeLlama(
+            tokens_per_second=args.fake_tokens_per_second,
+            prefill_tokens_per_second=args.fake_prefill_tokens_per_second,
+            n_ctx=config.model.n_ctx
+        )
+
+    from model_manager import ModelManager
+    return ModelManager(config.model).load_model(args.model_path)
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Offline benchmark for the LLM worker")
+    parser.add_argument("--target", choices=("handler", "engine"), default="handler",
+                        help="Drive the full job handler or the inference engine directly")
+    parser.add_argument("--model-path", help="GGUF file to load instead of the stub model")
+    parser.add_argument("--requests", type=int, default=100, help="Measured requests")
+    parser.add_argument("--warmup", type=int, default=2, help="Requests run before measuring")
+    parser.add_argument("--concurrency", type=int, default=4, help="Jobs in flight at once (handler target)")
+    parser.add_argument("--parallel-sequences", type=int, default=None,
+                        help="Override PARALLEL_SEQUENCES (the stub model always runs one request at a time)")
+    parser.add_argument("--prompt-tokens", default="64-512", help="Prompt length: 128, 64-512 or 32,64,256")
+    parser.add_argument("--max-tokens", default="32-128", help="Output length: 128, 32-128 or 16,64,256")
+    parser.add_argument("--temperature", type=float, default=0.7)
+    parser.add_argument("--stream", action="store_true", help="Request streamed responses")
+    parser.add_argument("--chat", action="store_true", help="Send chat messages instead of raw prompts")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the workload generator")
+    parser.add_argument("--fake-tokens-per-second", type=float, default=50.0, help="Decode rate of the stub model")
+    parser.add_argument("--fake-prefill-tokens-per-second", type=float, default=2000.0,
+                        help="Prompt evaluation rate of the stub model")
+    parser.add_argument("--output", help="Write the report as JSON")
+    parser.add_argument("--save-baseline", help="Write the report as the baseline for later runs")
+    parser.add_argument("--baseline", help="Compare against a saved baseline and exit with 1 on regressions")
+    parser.add_argument("--tolerance", type=float, default=0.10, help="Relative change counted as a regression")
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = parse_args(argv)
+
+    # Import here so that configuration from the environment is already final
+    import handler as handler_module
+    from metrics import metrics
+    from model_pool import ModelPool
+
+    model = load_model(args)
+
+    scheduler_config = config.scheduler
+    if isinstance(model, FakeLlama):
+        # Continuous batching needs llama.cpp's low-level API
+        scheduler_config = replace(scheduler_config, parallel_sequences=1)
+    elif args.parallel_sequences is not None:
+        scheduler_config = replace(scheduler_config, parallel_sequences=args.parallel_sequences)
+    args.parallel_sequences = scheduler_config.parallel_sequences
+
+    pool = ModelPool()
+    entry = pool.adopt(config.model_name, model, args.model_path or "", scheduler_config)
+    handler_module.model_pool = pool
+    handler_module.model_loaded = True
+
+    workload = make_workload(model, args, args.warmup + args.requests, args.seed)
+    warmup, measured = workload[:args.warmup], workload[args.warmup:]
+
+    try:
+        if args.target == "handler":
+            asyncio.run(run_handler_workload(handler_module, model, warmup, args.concurrency))
+            metrics.reset()
+            start = time.perf_counter()
+            results = asyncio.run(run_handler_workload(handler_module, model, measured, args.concurrency))
+            wall_seconds = time.perf_counter() - start
+            phases = metrics.snapshot().get(config.model_name)
+        else:
+            run_engine_workload(entry.engine, model, warmup)
+            start = time.perf_counter()
+            results = run_engine_workload(entry.engine, model, measured)
+            wall_seconds = time.perf_counter() - start
+            phases = None
+    finally:
+        entry.scheduler.stop()
+        entry.engine.close()
+
+    report = build_report(results, wall_seconds, args, phases)
+
+    comparison, regressed = None, False
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline.get("settings") != report["settings"]:
+            logger.warning(f"Baseline was recorded with different settings: {baseline.get('settings')}")
+        comparison, regressed = compare_reports(report, baseline, args.tolerance)
+        report["comparison"] = comparison
+
+    print_report(report, comparison)
+
+    for path in (args.output, args.save_baseline):
+        if path:
+            with open(path, "w") as f:
+                json.dump(report, f, indent=2)
+
+    return 1 if regressed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
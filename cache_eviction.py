@@ -0,0 +1,430 @@
+"""Size-budgeted LRU eviction for the model cache on the shared network volume."""
+
+import json
+import logging
+import os
+import socket
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Any, Optional, List, Iterable, Set
+
+from config import config
+from cache_manager import MANIFEST_SUFFIX
+
+logger = logging.getLogger(__name__)
+
+INDEX_FILENAME = ".cache_index.json"
+INDEX_LOCK_FILENAME = ".cache_index.lock"
+LEASE_DIRNAME = ".in_use"
+
+# Sidecars and downloads in progress are never eviction candidates
+AUXILIARY_SUFFIXES = (MANIFEST_SUFFIX, ".part", ".part.json", ".tmp")
+
+
+def default_worker_id() -> str:
+    """Identify this worker among all workers sharing the volume."""
+    pod_id = os.getenv("RUNPOD_POD_ID")
+    return f"{pod_id or socket.gethostname()}-{os.getpid()}"
+
+
+class CacheEvictor:
+    """Keeps the model files on the volume within a byte budget.
+
+    Endpoints serving different models may share a volume, so files are not
+    removed for belonging to another model but for being used least
+    recently. An index on the volume records the size, last use and pin state
+    of every model file. Workers hold a lease (a file under ``.in_use``
+    whose mtime they refresh) on every model they have loaded; files with a
+    fresh lease from any worker, and pinned files, are never removed.
+
+    Passes run on a background thread, first a while after startup and then
+    every ``interval_seconds`` or when a download finishes. A pass reads the
+    directory once, stats only files the index does not know yet, and
+    removes at most ``max_evictions_per_pass`` files. Index updates are
+    merged into the latest copy under an advisory lock, and the lease is
+    checked again right before a file is deleted.
+
+    The same thread reconciles the index every ``refresh_seconds`` without
+    evicting. Every index update (a refresh, a download, an eviction) leaves
+    an in-memory snapshot of the cache behind, so status reads never touch
+    the volume.
+    """
+
+    def __init__(
+        self,
+        cache_dir: str,
+        max_bytes: int = 0,
+        pinned: Iterable[str] = (),
+        lease_seconds: int = 600,
+        interval_seconds: int = 300,
+        max_evictions_per_pass: int = 1,
+        refresh_seconds: int = 60,
+        worker_id: Optional[str] = None
+    ):
+        self.cache_dir = Path(cache_dir)
+        self.max_bytes = max_bytes
+        self.pinned = set(pinned)
+        self.lease_seconds = lease_seconds
+        self.interval_seconds = interval_seconds
+        self.max_evictions_per_pass = max_evictions_per_pass
+        self.refresh_seconds = refresh_seconds
+        self.worker_id = worker_id or default_worker_id()
+
+        self.index_path = self.cache_dir / INDEX_FILENAME
+        self.lock_path = self.cache_dir / INDEX_LOCK_FILENAME
+        self.lease_dir = self.cache_dir / LEASE_DIRNAME
+
+        self._held: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+        self._running = False
+        self._files: Dict[str, Dict[str, Any]] = {}
+        self._snapshot_at: Optional[float] = None
+
+        self.stats = {
+            "passes": 0,
+            "evicted_files": 0,
+            "evicted_bytes": 0,
+            "skipped_in_use": 0,
+            "last_pass_at": None
+        }
+
+    def start(self):
+        """Start the background thread that refreshes leases and runs passes."""
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._running = True
+            self._thread = threading.Thread(target=self._run, name="cache-evictor", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """Stop the background thread and drop this worker's leases."""
+        with self._lock:
+            self._running = False
+            thread, self._thread = self._thread, None
+            held = list(self._held)
+            self._held.clear()
+        self._wake.set()
+
+        if thread is not None:
+            thread.join()
+        for filename in held:
+            self._lease_path(filename).unlink(missing_ok=True)
+
+    def trigger(self):
+        """Ask for a pass soon, without waiting for it."""
+        self._wake.set()
+
+    def acquire(self, filename: str):
+        """Mark a model file as in use by this worker and record the use."""
+        with self._lock:
+            self._held[filename] = self._held.get(filename, 0) + 1
+        self._refresh_lease(filename)
+        self.touch(filename)
+
+    def release(self, filename: str):
+        """Drop this worker's use of a model file."""
+        with self._lock:
+            count = self._held.get(filename, 0) - 1
+            if count > 0:
+                self._held[filename] = count
+                return
+            self._held.pop(filename, None)
+        self._lease_path(filename).unlink(missing_ok=True)
+
+    def touch(self, filename: str):
+        """Record that a model file was used now."""
+        path = self.cache_dir / filename
+        try:
+            size = path.stat().st_size
+        except FileNotFoundError:
+            return
+
+        now = time.time()
+
+        def update(files: Dict[str, Dict[str, Any]]):
+            entry = files.setdefault(filename, {"size": size, "last_used": now})
+            entry["size"] = size
+            entry["last_used"] = max(entry.get("last_used", 0), now)
+            if filename in self.pinned:
+                entry["pinned"] = True
+
+        self._update_index(update)
+
+    def is_in_use(self, filename: str) -> bool:
+        """Check whether any worker holds a fresh lease on a file."""
+        with self._lock:
+            if filename in self._held:
+                return True
+
+        directory = self.lease_dir / filename
+        try:
+            leases = list(os.scandir(directory))
+        except FileNotFoundError:
+            return False
+
+        cutoff = time.time() - self.lease_seconds
+        for lease in leases:
+            try:
+                if lease.stat().st_mtime >= cutoff:
+                    return True
+                os.unlink(lease.path)  # Left behind by a worker that died
+            except FileNotFoundError:
+                continue
+        return False
+
+    def refresh(self) -> Dict[str, Dict[str, Any]]:
+        """Reconcile the index with the directory and return the model files."""
+        present = self._list_model_files()
+
+        def reconcile(files: Dict[str, Dict[str, Any]]):
+            for filename in list(files):
+                if filename not in present:
+                    del files[filename]
+            for filename in present:
+                if filename not in files:
+                    try:
+                        stat = (self.cache_dir / filename).stat()
+                    except FileNotFoundError:
+                        continue
+                    # Unknown files were last used no later than they were written
+                    files[filename] = {"size": stat.st_size, "last_used": stat.st_mtime}
+                if filename in self.pinned:
+                    files[filename]["pinned"] = True
+
+        return self._update_index(reconcile)
+
+    def run_pass(self) -> List[str]:
+        """Refresh the index and evict over-budget files.
+
+        Returns the names of the files removed.
+        """
+        files = self.refresh()
+        total_bytes = sum(entry["size"] for entry in files.values())
+        evicted: List[str] = []
+
+        if self.max_bytes > 0 and total_bytes > self.max_bytes:
+            candidates = sorted(
+                (entry.get("last_used", 0), filename)
+                for filename, entry in files.items()
+                if not entry.get("pinned") and filename not in self.pinned
+            )
+            for _, filename in candidates:
+                if total_bytes <= self.max_bytes or len(evicted) >= self.max_evictions_per_pass:
+                    break
+                if self.is_in_use(filename):
+                    self.stats["skipped_in_use"] += 1
+                    continue
+
+                size = files[filename]["size"]
+                if self._remove(filename):
+                    evicted.append(filename)
+                    total_bytes -= size
+                    self.stats["evicted_files"] += 1
+                    self.stats["evicted_bytes"] += size
+
+            if evicted:
+                def forget(latest: Dict[str, Dict[str, Any]]):
+                    for filename in evicted:
+                        latest.pop(filename, None)
+
+                self._update_index(forget)
+
+            if total_bytes > self.max_bytes and len(evicted) < self.max_evictions_per_pass:
+                logger.warning(
+                    f"Model cache uses {total_bytes / 1024**3:.2f} GB of a {self.max_bytes / 1024**3:.2f} GB budget, "
+                    f"but the remaining files are pinned or in use"
+                )
+
+        self.stats["passes"] += 1
+        self.stats["last_pass_at"] = time.time()
+        return evicted
+
+    def get_file_info(self, filename: str) -> Optional[Dict[str, Any]]:
+        """Size and last use of a model file as of the latest snapshot."""
+        entry = self._files.get(filename)
+        return dict(entry) if entry is not None else None
+
+    def get_cache_info(self) -> Dict[str, Any]:
+        """Totals of the model cache from the latest snapshot, with its age."""
+        files, snapshot_at = self._files, self._snapshot_at
+        total_size = sum(entry["size"] for entry in files.values())
+        return {
+            "cache_dir": str(self.cache_dir),
+            "total_files": len(files) if snapshot_at is not None else None,
+            "total_size_bytes": total_size if snapshot_at is not None else None,
+            "total_size_gb": round(total_size / (1024**3), 2) if snapshot_at is not None else None,
+            "updated_at": snapshot_at,
+            "age_seconds": round(time.time() - snapshot_at, 1) if snapshot_at is not None else None
+        }
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get eviction counters and the budget."""
+        with self._lock:
+            held = sorted(self._held)
+        return {
+            **self.stats,
+            **self.get_cache_info(),
+            "max_bytes": self.max_bytes,
+            "pinned": sorted(self.pinned),
+            "in_use": held,
+            "worker_id": self.worker_id
+        }
+
+    def _run(self):
+        """Refresh leases often enough to keep them fresh and run passes in between."""
+        heartbeat = max(self.lease_seconds / 3, 1)
+        # The first pass waits, so it never competes with loading the model;
+        # a refresh is a directory read and runs right away
+        next_pass = time.time() + min(self.interval_seconds, 60)
+        next_refresh = time.time()
+
+        while True:
+            timeout = max(min(heartbeat, next_pass - time.time(), next_refresh - time.time()), 0)
+            triggered = self._wake.wait(timeout)
+            self._wake.clear()
+
+            with self._lock:
+                if not self._running:
+                    return
+                held = list(self._held)
+
+            for filename in held:
+                self._refresh_lease(filename)
+
+            if triggered or time.time() >= next_pass:
+                try:
+                    evicted = self.run_pass()
+                    if evicted:
+                        logger.info(f"Evicted from the model cache: {', '.join(evicted)}")
+                except Exception as e:
+                    logger.error(f"Error during cache eviction: {e}")
+                next_pass = time.time() + self.interval_seconds
+                next_refresh = time.time() + self.refresh_seconds
+            elif time.time() >= next_refresh:
+                try:
+                    self.refresh()
+                except Exception as e:
+                    logger.error(f"Error refreshing the cache index: {e}")
+                next_refresh = time.time() + self.refresh_seconds
+
+    def _list_model_files(self) -> Set[str]:
+        """Names of the model files in the cache directory (one directory read)."""
+        try:
+            entries = list(os.scandir(self.cache_dir))
+        except FileNotFoundError:
+            return set()
+
+        return {
+            entry.name for entry in entries
+            if not entry.name.startswith(".")
+            and not entry.name.endswith(AUXILIARY_SUFFIXES)
+            and entry.is_file()
+        }
+
+    def _lease_path(self, filename: str) -> Path:
+        return self.lease_dir / filename / self.worker_id
+
+    def _refresh_lease(self, filename: str):
+        path = self._lease_path(filename)
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.touch()
+        except OSError as e:
+            logger.warning(f"Could not refresh the cache lease on {filename}: {e}")
+
+    def _remove(self, filename: str) -> bool:
+        """Delete a model file with its manifest and stale leases."""
+        try:
+            (self.cache_dir / filename).unlink(missing_ok=True)
+            (self.cache_dir / f"{filename}{MANIFEST_SUFFIX}").unlink(missing_ok=True)
+        except OSError as e:
+            logger.error(f"Error evicting {filename}: {e}")
+            return False
+
+        lease_directory = self.lease_dir / filename
+        for lease in lease_directory.glob("*"):
+            lease.unlink(missing_ok=True)
+        try:
+            lease_directory.rmdir()
+        except OSError:
+            pass
+        return True
+
+    @contextmanager
+    def _index_lock(self):
+        """Advisory lock around index updates; best effort on volumes without flock."""
+        try:
+            import fcntl
+            handle = open(self.lock_path, "a")
+        except (ImportError, OSError):
+            yield
+            return
+
+        try:
+            try:
+                fcntl.flock(handle, fcntl.LOCK_EX)
+            except OSError:
+                pass
+            yield
+        finally:
+            handle.close()
+
+    def _read_index(self) -> Dict[str, Dict[str, Any]]:
+        try:
+            with open(self.index_path, "r") as f:
+                return json.load(f).get("files", {})
+        except FileNotFoundError:
+            return {}
+        except Exception as e:
+            logger.warning(f"Ignoring unreadable cache index: {e}")
+            return {}
+
+    def _update_index(self, update) -> Dict[str, Dict[str, Any]]:
+        """Apply ``update`` to the latest index, write it back atomically if it changed and keep a snapshot."""
+        with self._index_lock():
+            files = self._read_index()
+            before = json.dumps(files, sort_keys=True)
+            update(files)
+
+            self._files = {filename: dict(entry) for filename, entry in files.items()}
+            self._snapshot_at = time.time()
+            if json.dumps(files, sort_keys=True) == before:
+                return files
+
+            temp_path = self.index_path.with_name(f"{INDEX_FILENAME}.{self.worker_id}.tmp")
+            try:
+                with open(temp_path, "w") as f:
+                    json.dump({"version": 1, "files": files}, f)
+                os.replace(temp_path, self.index_path)
+            except OSError as e:
+                logger.warning(f"Could not write the cache index: {e}")
+        return files
+
+
+_evictor: Optional[CacheEvictor] = None
+_evictor_lock = threading.Lock()
+
+
+def get_cache_evictor() -> CacheEvictor:
+    """The process-wide evictor for the configured cache directory."""
+    global _evictor
+
+    with _evictor_lock:
+        if _evictor is None:
+            cache_dir = Path(config.model.cache_dir) / "models"
+            cache_dir.mkdir(parents=True, exist_ok=True)
+            _evictor = CacheEvictor(
+                str(cache_dir),
+                max_bytes=int(config.cache.max_gb * 1024**3),
+                pinned=config.cache.pinned_files,
+                lease_seconds=config.cache.lease_seconds,
+                interval_seconds=config.cache.eviction_interval_seconds,
+                max_evictions_per_pass=config.cache.max_evictions_per_pass,
+                refresh_seconds=config.cache.status_refresh_seconds
+            )
+        return _evictor
@@ -1,15 +1,126 @@
 """Cache management for model files."""
 
 import os
+import json
+import mmap
 import hashlib
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import Optional
+from typing import Optional, Dict, Any, List, Tuple
 import logging
 
 from config import config
+from gguf_reader import read_gguf_info, summarize_gguf
 
 logger = logging.getLogger(__name__)
 
+MANIFEST_SUFFIX = ".manifest.json"
+HASH_CHUNK_SIZE = 16 * 1024 * 1024
+
+
+def hash_file_mmap(path: str, workers: int = 4, chunk_size: int = HASH_CHUNK_SIZE) -> str:
+    """SHA-256 of a file, hashed from a memory map while threads read ahead.
+
+    SHA-256 itself is sequential, so the parallelism goes into I/O: worker
+    threads pull the next ``workers * 2`` chunks into the page cache with
+    ``preadv`` (network volumes only deliver their bandwidth to several
+    outstanding reads) while the main thread hashes the mapped pages. Both the
+    reads and ``hashlib`` release the GIL.
+    """
+    hasher = hashlib.sha256()
+    window = max(workers, 1) * 2
+
+    with open(path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        if size == 0:
+            return hasher.hexdigest()
+
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            if hasattr(mapped, "madvise"):
+                mapped.madvise(mmap.MADV_SEQUENTIAL)
+
+            def prefetch(offset: int):
+                length = min(chunk_size, size - offset)
+                if hasattr(os, "preadv"):
+                    os.preadv(f.fileno(), [bytearray(length)], offset)
+                elif hasattr(mapped, "madvise"):
+                    mapped.madvise(mmap.MADV_WILLNEED, offset, length)
+
+            offsets = list(range(0, size, chunk_size))
+            view = memoryview(mapped)
+            try:
+                with ThreadPoolExecutor(max_workers=max(workers, 1), thread_name_prefix="hash") as pool:
+                    pending = {}
+                    for index, offset in enumerate(offsets):
+                        for ahead in offsets[index:index + window]:
+                            if ahead not in pending:
+                                pending[ahead] = pool.submit(prefetch, ahead)
+                        pending.pop(offset).result()
+                        hasher.update(view[offset:offset + chunk_size])
+            finally:
+                view.release()
+
+    return hasher.hexdigest()
+
+
+def available_memory_bytes() -> Optional[int]:
+    """MemAvailable from /proc/meminfo, or None where it cannot be read."""
+    try:
+        with open("/proc/meminfo", "r") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError):
+        pass
+    return None
+
+
+def warm_page_cache(
+    path: str,
+    workers: int = 4,
+    chunk_size: int = HASH_CHUNK_SIZE,
+    ranges: Optional[List[Tuple[int, int]]] = None
+) -> int:
+    """Pull a file, or the given (offset, length) ranges of it, into the page cache.
+    
+    Meant to run next to model construction: llama.cpp faults the mmap in one
+    page at a time, which is slow on a network volume, while these reads keep
+    several large requests in flight. Ranges are read in the order given.
+    Data that would not fit in available memory is skipped, since it would
+    only evict itself. Returns the number of bytes read.
+    """
+    size = os.path.getsize(path)
+    if ranges is None:
+        ranges = [(0, size)]
+    
+    total = sum(length for _, length in ranges)
+    available = available_memory_bytes()
+    if available is not None and total > available * 0.8:
+        logger.info(f"Not warming page cache for {path}: {total} bytes exceed available memory")
+        return 0
+    
+    pieces = [
+        (offset, min(chunk_size, start + length - offset))
+        for start, length in ranges
+        for offset in range(start, start + length, chunk_size)
+    ]
+    
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        if hasattr(os, "posix_fadvise"):
+            os.posix_fadvise(fd, 0, size, os.POSIX_FADV_SEQUENTIAL)
+        
+        def read(piece: Tuple[int, int]) -> int:
+            offset, length = piece
+            return os.preadv(fd, [bytearray(length)], offset)
+        
+        with ThreadPoolExecutor(max_workers=max(workers, 1), thread_name_prefix="prefetch") as pool:
+            return sum(pool.map(read, pieces))
+    finally:
+        os.close(fd)
+
 
 class CacheManager:
     """Manages model file caching on network volume."""
@@ -22,6 +133,10 @@ class CacheManager:
         """Get the cache path for a model file."""
         return self.cache_dir / filename
     
+    def get_manifest_path(self, filename: str) -> Path:
+        """Get the path of the manifest sidecar for a model file."""
+        return self.cache_dir / f"{filename}{MANIFEST_SUFFIX}"
+    
     def is_cached(self, filename: str) -> bool:
         """Check if a model file is cached."""
         cache_path = self.get_cache_path(filename)
@@ -61,7 +176,7 @@ class CacheManager:
             logger.error(f"Error validating cached file {filename}: {e}")
             return False
     
-    def calculate_file_hash(self, filename: str, algorithm: str = "sha256") -> Optional[str]:
+    def calculate_file_hash(self, filename: str, algorithm: str = "sha256", workers: int = 4) -> Optional[str]:
         """Calculate hash of a cached file."""
         if not self.is_cached(filename):
             return None
@@ -69,6 +184,9 @@ class CacheManager:
         cache_path = self.get_cache_path(filename)
         
         try:
+            if algorithm == "sha256":
+                return hash_file_mmap(str(cache_path), workers=workers)
+            
             hash_obj = hashlib.new(algorithm)
             with open(cache_path, 'rb') as f:
                 for chunk in iter(lambda: f.read(8192), b""):
@@ -78,8 +196,84 @@ class CacheManager:
             logger.error(f"Error calculating hash for {filename}: {e}")
             return None
     
+    def load_manifest(self, filename: str) -> Optional[Dict[str, Any]]:
+        """Read the manifest of a cached file, or None if there is none."""
+        try:
+            with open(self.get_manifest_path(filename), "r") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.warning(f"Ignoring unreadable manifest for {filename}: {e}")
+            return None
+    
+    def write_manifest(
+        self,
+        filename: str,
+        sha256: str,
+        revision: Optional[str] = None,
+        repository_id: Optional[str] = None,
+        source_path: Optional[str] = None
+    ) -> Dict[str, Any]:
+        """Record the verified state of a cached file next to it.
+        
+        Parsing the GGUF header here doubles as a format check: a file that is
+        not a readable GGUF raises instead of getting a manifest. A download
+        passes its ``source_path`` before renaming it into place; the rename
+        keeps size and mtime, so the manifest matches the published file.
+        """
+        cache_path = Path(source_path) if source_path else self.get_cache_path(filename)
+        stat = cache_path.stat()
+        
+        manifest = {
+            "filename": filename,
+            "repository_id": repository_id,
+            "revision": revision,
+            "size": stat.st_size,
+            "mtime_ns": stat.st_mtime_ns,
+            "sha256": sha256,
+            "gguf": summarize_gguf(read_gguf_info(str(cache_path))),
+            "verified_at": time.time()
+        }
+        
+        # Workers sharing the volume may verify the same file at once, so each writes its own temporary file
+        manifest_path = self.get_manifest_path(filename)
+        temp_path = manifest_path.with_name(f"{manifest_path.name}.{uuid.uuid4().hex}.tmp")
+        with open(temp_path, "w") as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(temp_path, manifest_path)
+        
+        return manifest
+    
+    def check_manifest(self, filename: str, repository_id: Optional[str] = None) -> str:
+        """Compare a cached file against its manifest with a single stat.
+        
+        Returns "valid" when size and mtime match the recorded ones, "stale"
+        when a manifest exists but no longer describes the file, and "missing"
+        when the file or its manifest is absent.
+        """
+        manifest = self.load_manifest(filename)
+        if manifest is None:
+            return "missing"
+        
+        try:
+            stat = self.get_cache_path(filename).stat()
+        except FileNotFoundError:
+            return "missing"
+        
+        if (
+            stat.st_size != manifest.get("size")
+            or stat.st_mtime_ns != manifest.get("mtime_ns")
+            or (repository_id and manifest.get("repository_id") not in (None, repository_id))
+        ):
+            return "stale"
+        
+        return "valid"
+    
     def remove_cached_file(self, filename: str) -> bool:
-        """Remove a cached file."""
+        """Remove a cached file and its manifest."""
+        self.get_manifest_path(filename).unlink(missing_ok=True)
+        
         if not self.is_cached(filename):
             return True
         
@@ -94,7 +288,11 @@ class CacheManager:
             return False
     
     def get_cache_info(self) -> dict:
-        """Get information about the cache directory."""
+        """Scan the cache directory for its totals.
+        
+        This stats every file on the volume; status reports use the cache
+        evictor's snapshot instead.
+        """
         try:
             total_size = 0
             file_count = 0
@@ -114,23 +312,18 @@ class CacheManager:
             logger.error(f"Error getting cache info: {e}")
             return {}
     
-    def cleanup_cache(self, keep_current_model: bool = True) -> int:
-        """Clean up old cached files."""
-        removed_count = 0
-        current_filename = config.model.filename
+    def cleanup_cache(self) -> int:
+        """Evict least recently used model files until the cache fits ``CACHE_MAX_GB``.
+        
+        Files pinned with ``CACHE_PINNED_FILES`` or in use by any worker on
+        the volume are kept. The background evictor does this on its own;
+        calling it runs a pass right away. Returns the number of files removed.
+        """
+        # Import here to avoid a circular import
+        from cache_eviction import get_cache_evictor
         
         try:
-            for file_path in self.cache_dir.iterdir():
-                if file_path.is_file():
-                    if keep_current_model and file_path.name == current_filename:
-                        continue
-                    
-                    # Remove files that are not the current model
-                    file_path.unlink()
-                    removed_count += 1
-                    logger.info(f"Cleaned up cached file: {file_path.name}")
-                    
+            return len(get_cache_evictor().run_pass())
         except Exception as e:
             logger.error(f"Error during cache cleanup: {e}")
-        
-        return removed_count
+            return 0
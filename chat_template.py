@@ -0,0 +1,297 @@
+"""Chat templates from GGUF metadata, rendered straight to token ids."""
+
+import hashlib
+import logging
+import re
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Dict, Any, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Used when the model does not embed a template
+CHATML_TEMPLATE = (
+    "{% for message in messages %}"
+    "{{ '<|im_start|>' + message['role'] + '\n' + message['content'] + '<|im_end|>' + '\n' }}"
+    "{% endfor %}"
+    "{% if add_generation_prompt %}{{ '<|im_start|>assistant\n' }}{% endif %}"
+)
+
+# Markup that may be a control token, e.g. <|eot_id|>, </s>, <start_of_turn> or [INST]
+SPECIAL_CANDIDATE = re.compile(r"<[^<>\s]{1,48}>|\[/?[A-Z_]{2,24}\]")
+
+# Conversations used to check that segment-wise tokenization is exact
+PROBE_CONVERSATIONS = (
+    [
+        {"role": "system", "content": "You are a helpful assistant."},
+        {"role": "user", "content": "Hello there!"},
+        {"role": "assistant", "content": "Hi. How can I help?"},
+        {"role": "user", "content": "Tell me a joke."}
+    ],
+    [
+        {"role": "user", "content": "Hello there!"},
+        {"role": "assistant", "content": "Hi. How can I help?"},
+        {"role": "user", "content": "Tell me a joke."}
+    ]
+)
+
+
+class ChatTemplateError(ValueError):
+    """Raised when a template rejects a conversation (e.g. roles that do not alternate)."""
+
+
+def _raise_exception(message: str):
+    raise ChatTemplateError(message)
+
+
+@dataclass
+class ChatEncoding:
+    """A conversation rendered to token ids."""
+    token_ids: List[int]
+    # Tokens attributed to each message: the markup before its content and the content itself
+    message_tokens: List[int]
+
+
+class ChatTemplate:
+    """Compiled chat template of a loaded model.
+
+    The Jinja template from ``tokenizer.chat_template`` is compiled once when
+    the model is loaded. Rendered prompts are cut at control tokens such as
+    ``<|eot_id|>`` and every piece is tokenized through an LRU cache, so role
+    headers and messages that were already seen (earlier turns of the same
+    conversation, shared system prompts) skip the tokenizer. Cutting is only
+    enabled when it reproduces the tokenization of the whole prompt exactly.
+    """
+
+    def __init__(self, model, source: str = "auto", max_cached_segments: int = 8192):
+        self.model = model
+        self.max_cached_segments = max_cached_segments
+
+        self._segments: "OrderedDict[bytes, Tuple[int, ...]]" = OrderedDict()
+        self._special: Dict[str, bool] = {}
+        self._lock = threading.Lock()
+
+        self.stats = {
+            "renders": 0,
+            "segment_hits": 0,
+            "segment_misses": 0
+        }
+
+        self.bos_id = model.token_bos()
+        self.eos_id = model.token_eos()
+        self.bos_token = self._token_text(self.bos_id)
+        self.eos_token = self._token_text(self.eos_id)
+        # Models that want a BOS get one when tokenizing even an empty string
+        self.add_bos = bool(model.tokenize(b"", add_bos=True, special=True))
+
+        template_source, self.origin = self._select_source(source)
+        try:
+            self._template = self._compile(template_source)
+        except Exception as e:
+            logger.warning(f"Could not compile the {self.origin} chat template, falling back to ChatML: {e}")
+            self._template, self.origin = self._compile(CHATML_TEMPLATE), "chatml"
+
+        self.segmented = self._check_segmentation()
+        self.stop_sequences = self._find_stop_sequences()
+
+        logger.info(
+            f"Using {self.origin} chat template "
+            f"({'segment' if self.segmented else 'whole prompt'} tokenization, stops: {self.stop_sequences})"
+        )
+
+    def _select_source(self, source: str) -> Tuple[str, str]:
+        """Pick the template source and describe where it came from."""
+        if source == "chatml":
+            return CHATML_TEMPLATE, "chatml"
+
+        if source and source != "auto":
+            return source, "custom"
+
+        embedded = (getattr(self.model, "metadata", None) or {}).get("tokenizer.chat_template")
+        if embedded:
+            return embedded, "gguf"
+
+        return CHATML_TEMPLATE, "chatml"
+
+    @staticmethod
+    def _compile(source: str):
+        # Import here; jinja2 is installed with llama-cpp-python
+        from jinja2.sandbox import ImmutableSandboxedEnvironment
+
+        environment = ImmutableSandboxedEnvironment(trim_blocks=True, lstrip_blocks=True)
+        environment.globals["raise_exception"] = _raise_exception
+        environment.globals["strftime_now"] = lambda fmt: datetime.now().strftime(fmt)
+        return environment.from_string(source)
+
+    def _token_text(self, token_id: int) -> str:
+        if token_id is None or token_id < 0:
+            return ""
+        return self.model.detokenize([token_id], special=True).decode("utf-8", errors="ignore")
+
+    def render(self, messages: List[Dict[str, Any]], add_generation_prompt: bool = True) -> str:
+        """Render a conversation to prompt text."""
+        return self._template.render(
+            messages=messages,
+            bos_token=self.bos_token,
+            eos_token=self.eos_token,
+            add_generation_prompt=add_generation_prompt,
+            tools=None
+        )
+
+    def encode(self, messages: List[Dict[str, Any]], add_generation_prompt: bool = True) -> ChatEncoding:
+        """Render a conversation and tokenize it, reusing cached segments."""
+        messages = [
+            {**message, "role": message.get("role") or "user", "content": str(message.get("content") or "")}
+            for message in messages
+        ]
+        text = self.render(messages, add_generation_prompt)
+        content_ends = self._content_ends(text, messages)
+
+        if self.segmented:
+            pieces = [(start, self._tokenize_segment(piece)) for start, piece in self._cut(text, self._special_cuts(text))]
+            token_ids = [token for _, ids in pieces for token in ids]
+        else:
+            # Count per message for trimming, but tokenize the prompt as a whole
+            token_ids = list(self._tokenize_segment(text))
+            pieces = [(start, self._tokenize_segment(piece)) for start, piece in self._cut(text, content_ends)]
+
+        if self.add_bos and (not token_ids or token_ids[0] != self.bos_id):
+            token_ids.insert(0, self.bos_id)
+
+        # Markup goes to the message whose content follows it; what comes after the last one is overhead
+        message_tokens = [0] * len(messages)
+        index = 0
+        for start, ids in pieces:
+            while index < len(messages) and start >= content_ends[index]:
+                index += 1
+            if index < len(messages):
+                message_tokens[index] += len(ids)
+
+        with self._lock:
+            self.stats["renders"] += 1
+
+        return ChatEncoding(token_ids=token_ids, message_tokens=message_tokens)
+
+    @staticmethod
+    def _content_ends(text: str, messages: List[Dict[str, Any]]) -> List[int]:
+        """Offset in the rendered text where each message's content ends."""
+        ends = []
+        cursor = 0
+        for message in messages:
+            content = message["content"]
+            position = -1
+            for candidate in (content, content.strip()):
+                if candidate:
+                    position = text.find(candidate, cursor)
+                    if position >= 0:
+                        cursor = position + len(candidate)
+                        break
+            # Content the template rewrote is attributed to the next message
+            ends.append(cursor)
+        return ends
+
+    @staticmethod
+    def _cut(text: str, offsets: List[int]) -> List[Tuple[int, str]]:
+        """Split text at the given offsets, dropping empty pieces."""
+        pieces = []
+        start = 0
+        for offset in sorted(set(offsets)) + [len(text)]:
+            if offset > start:
+                pieces.append((start, text[start:offset]))
+                start = offset
+        return pieces
+
+    def _special_cuts(self, text: str) -> List[int]:
+        """Offsets before and after every control token in the text."""
+        cuts = []
+        for match in SPECIAL_CANDIDATE.finditer(text):
+            if self._is_special(match.group()):
+                cuts.extend((match.start(), match.end()))
+        return cuts
+
+    def _is_special(self, candidate: str) -> bool:
+        """Check whether markup is a single control token of this model's vocabulary."""
+        special = self._special.get(candidate)
+        if special is None:
+            encoded = candidate.encode("utf-8")
+            ids = self.model.tokenize(encoded, add_bos=False, special=True)
+            # Control tokens are only recognized with special=True
+            special = len(ids) == 1 and ids != self.model.tokenize(encoded, add_bos=False, special=False)
+            self._special[candidate] = special
+        return special
+
+    def _tokenize_segment(self, segment: str) -> Tuple[int, ...]:
+        """Tokenize a piece of prompt text through the segment cache."""
+        encoded = segment.encode("utf-8")
+        key = hashlib.sha1(encoded).digest()
+
+        with self._lock:
+            ids = self._segments.get(key)
+            if ids is not None:
+                self._segments.move_to_end(key)
+                self.stats["segment_hits"] += 1
+                return ids
+
+        ids = tuple(self.model.tokenize(encoded, add_bos=False, special=True))
+
+        with self._lock:
+            self.stats["segment_misses"] += 1
+            self._segments[key] = ids
+            while len(self._segments) > self.max_cached_segments:
+                self._segments.popitem(last=False)
+
+        return ids
+
+    def _render_probe(self) -> Optional[Tuple[str, List[Dict[str, Any]]]]:
+        """Render the first probe conversation the template accepts."""
+        for messages in PROBE_CONVERSATIONS:
+            try:
+                return self.render(messages, add_generation_prompt=True), messages
+            except Exception:
+                continue  # e.g. templates without system role support
+        return None
+
+    def _check_segmentation(self) -> bool:
+        """Cutting at control tokens is exact for most tokenizers, but not all."""
+        probe = self._render_probe()
+        if probe is None:
+            return False
+
+        text, _ = probe
+        whole = self.model.tokenize(text.encode("utf-8"), add_bos=False, special=True)
+        pieces = []
+        for _, piece in self._cut(text, self._special_cuts(text)):
+            pieces.extend(self.model.tokenize(piece.encode("utf-8"), add_bos=False, special=True))
+        return list(whole) == pieces
+
+    def _find_stop_sequences(self) -> List[str]:
+        """The EOS token and the control token that closes an assistant turn."""
+        stops = [self.eos_token] if self.eos_token else []
+
+        probe = self._render_probe()
+        if probe is not None:
+            text, messages = probe
+            ends = self._content_ends(text, messages)
+            for message, end in zip(messages, ends):
+                if message["role"] != "assistant":
+                    continue
+                match = SPECIAL_CANDIDATE.match(text, end)
+                if match and self._is_special(match.group()) and match.group() not in stops:
+                    stops.append(match.group())
+
+        return stops
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get template and segment cache counters."""
+        with self._lock:
+            lookups = self.stats["segment_hits"] + self.stats["segment_misses"]
+            return {
+                **self.stats,
+                "origin": self.origin,
+                "segmented": self.segmented,
+                "stop_sequences": self.stop_sequences,
+                "cached_segments": len(self._segments),
+                "segment_hit_rate": round(self.stats["segment_hits"] / lookups, 4) if lookups else 0.0
+            }
@@ -1,8 +1,17 @@
 """Configuration management for the LLM worker."""
 
 import os
-from dataclasses import dataclass
-from typing import Optional
+import json
+from dataclasses import dataclass, field, replace
+from typing import Optional, Dict, List
+
+
+def _env_bool(name: str, default: bool) -> bool:
+    """Read a boolean flag from the environment."""
+    value = os.getenv(name)
+    if value is None:
+        return default
+    return value.strip().lower() in ("1", "true", "yes", "on")
 
 
 @dataclass
@@ -14,6 +23,57 @@ class ModelConfig:
     n_gpu_layers: int = -1  # Use all GPU layers
     n_ctx: int = 4096  # Context window size
     n_batch: int = 512  # Batch size for processing
+    n_threads: Optional[int] = None  # CPU threads (None = llama.cpp default)
+    auto_tune: bool = False  # Pick n_gpu_layers, n_ctx, n_batch and n_threads from the GGUF and the hardware
+    download_url: Optional[str] = None  # Fetch from this URL instead of the Hub (mirrors, local stand-ins)
+    sha256: Optional[str] = None  # Expected SHA-256 when not provided by the Hub
+    download_workers: int = 8  # Parallel range requests
+    download_chunk_mb: int = 32  # Size of each range request
+    prefetch_weights: bool = True  # Warm the page cache with parallel reads while the model loads
+    use_mmap: bool = True  # Map the weights instead of reading them into memory
+    use_mlock: bool = False  # Lock the weights in RAM so they are never paged out
+    staging_dir: Optional[str] = None  # Local disk to copy the model to (None = load from the volume)
+    staging_wait: bool = False  # Wait for the local copy instead of loading from the volume meanwhile
+    chat_template: str = "auto"  # "auto" (from the GGUF, else ChatML), "chatml" or a Jinja template
+    draft_repository_id: Optional[str] = None  # Repository of the draft model (None = same as the model)
+    draft_filename: Optional[str] = None  # Small GGUF with the same vocabulary for speculative decoding
+    draft_download_url: Optional[str] = None
+    draft_n_gpu_layers: int = -1
+
+
+@dataclass
+class ModelPoolConfig:
+    """Limits for keeping several models loaded at once."""
+    max_models: int = 1  # Models resident at the same time
+    vram_budget_mb: int = 0  # Estimated VRAM the resident models may use (0 = unlimited)
+    ram_budget_mb: int = 0  # Estimated host RAM the resident models may use (0 = unlimited)
+
+
+def _load_model_registry(default_name: str, default_model: ModelConfig) -> Dict[str, ModelConfig]:
+    """Build the model registry from MODEL_REGISTRY.
+    
+    MODEL_REGISTRY is a JSON object (or the path of a JSON file) mapping model
+    names to ModelConfig overrides, e.g.
+    ``{"small": {"repository_id": "...", "filename": "...", "n_ctx": 8192}}``.
+    Fields that are not given are taken from the default model. The default
+    model is always registered under ``default_name``.
+    """
+    registry = {default_name: default_model}
+    
+    raw = os.getenv("MODEL_REGISTRY", "").strip()
+    if not raw:
+        return registry
+    
+    if not raw.startswith("{"):
+        with open(raw, "r") as f:
+            raw = f.read()
+    
+    for name, overrides in json.loads(raw).items():
+        # Each model has its own file, so the hash of the default model never applies
+        overrides = {"sha256": None, "download_url": None, **overrides}
+        registry[name] = replace(default_model, **overrides)
+    
+    return registry
 
 
 @dataclass
@@ -25,17 +85,155 @@ class InferenceConfig:
     top_k: int = 40
     repeat_penalty: float = 1.1
     stop_sequences: list = None
+    timeout_ms: int = 0  # Per-request deadline, counted from when the job arrives; 0 disables it
+    max_samples: int = 16  # Largest 'n' / 'best_of' of one job
     
     def __post_init__(self):
         if self.stop_sequences is None:
             self.stop_sequences = ["</s>", "<|im_end|>"]
 
 
+@dataclass
+class StreamingConfig:
+    """Streaming output configuration."""
+    chunk_tokens: int = 1  # Coalesce this many tokens into one streamed chunk
+    chunk_interval_ms: int = 0  # Flush a partial chunk after this many milliseconds (0 = disabled)
+
+
+@dataclass
+class SchedulerConfig:
+    """Request scheduling and batching configuration."""
+    max_concurrency: int = 1  # Jobs RunPod may hand to this worker at once
+    parallel_sequences: int = 1  # llama.cpp sequences decoded together (1 = no batching)
+    idle_wait_ms: int = 50  # How long the scheduler sleeps when there is no work
+    max_batch_inputs: int = 256  # Items accepted in one 'inputs' job
+    min_shared_prefix: int = 16  # Prompt tokens batch items must share to reuse each other's KV cells
+    policy: str = "sjf"  # Order of queued requests: sjf (shortest expected job first, with aging) or fifo
+    default_priority: str = "normal"  # Priority class of jobs that do not name one: high, normal or low
+    priority_step_seconds: float = 30.0  # Expected run time a priority class is worth over the next one
+    aging: float = 1.0  # Seconds of expected run time forgiven per second a request waits
+    prefill_tokens_per_second: float = 1000.0  # Cost model starting point, refined from finished requests
+    decode_tokens_per_second: float = 30.0  # Cost model starting point, refined from finished requests
+    latency_slo_ms: int = 0  # Stop taking jobs while the queued work would wait longer (0 = no limit)
+
+
+@dataclass
+class PrefixCacheConfig:
+    """Shared-prefix KV cache configuration.
+
+    Saving a state copies the whole KV cache and llama.cpp's logits buffer
+    after every completion that uses the cache, so the cache is opt-in and
+    only prompts of ``min_save_tokens`` or more use it.
+    """
+    enabled: bool = False
+    max_mb: int = 2048  # Host memory budget for saved KV states
+    min_prefix_tokens: int = 32  # Shorter matches are cheaper to recompute than to restore
+    min_save_tokens: int = 256  # Shorter prompts neither save nor look up states
+
+
+@dataclass
+class SessionConfig:
+    """Stateful chat session configuration."""
+    enabled: bool = True
+    ttl_seconds: int = 3600  # Sessions idle for longer are discarded
+    max_ram_mb: int = 1024  # RAM tier budget for session KV snapshots
+    max_disk_mb: int = 10240  # Network volume budget for session KV snapshots
+    persist: bool = True  # Write snapshots to the network volume
+
+
+@dataclass
+class ResponseCacheConfig:
+    """Memoization of deterministic responses."""
+    enabled: bool = True
+    max_entries: int = 1024
+    max_mb: int = 64
+    ttl_seconds: int = 3600
+    disk_enabled: bool = False  # Also keep results on the network volume
+    max_disk_entries: int = 100000
+
+
+@dataclass
+class ContextConfig:
+    """Fitting chat histories into the context window."""
+    policy: str = "keep_system"  # keep_system, drop_oldest, sliding_window or none
+    window_messages: int = 32  # Most recent turns kept by the sliding_window policy
+    max_cached_segments: int = 8192  # Tokenized chat template segments kept in memory
+
+
+@dataclass
+class SpeculativeConfig:
+    """Speculative decoding configuration."""
+    mode: str = "off"  # Default for requests: off, prompt_lookup or draft
+    num_pred_tokens: int = 10  # Tokens drafted per step by prompt lookup
+    max_ngram_size: int = 2  # Longest n-gram matched against the prompt
+    draft_pred_tokens: int = 4  # Tokens drafted per step by the draft model
+
+
+@dataclass
+class GrammarConfig:
+    """Constrained generation with JSON schemas or GBNF grammars."""
+    max_entries: int = 64  # Compiled grammars kept in memory
+
+
+@dataclass
+class EmbeddingConfig:
+    """Defaults of ``embed`` jobs."""
+    pooling: str = "mean"  # mean, last or cls (ignored by models that pool on their own)
+    normalize: bool = True  # Scale vectors to unit length
+    encoding: str = "float32"  # Base64 buffer type: float32 or float16
+    max_inputs: int = 1024  # Texts accepted in one job
+
+
+@dataclass
+class CacheConfig:
+    """Eviction of model files from the shared network volume."""
+    max_gb: float = 0.0  # Budget for model files on the volume (0 = unlimited)
+    pinned_files: List[str] = field(default_factory=list)  # Never evicted
+    lease_seconds: int = 600  # In-use leases older than this are considered abandoned
+    eviction_interval_seconds: int = 300
+    max_evictions_per_pass: int = 1
+    status_refresh_seconds: int = 60  # Background re-read of the cache directory for status reports
+    download_lease_seconds: int = 60  # A download lease not refreshed for this long is taken over
+    download_poll_seconds: float = 2.0  # How often waiting workers check on another worker's download
+
+
+@dataclass
+class TuningConfig:
+    """Limits of the automatic runtime tuning of models with ``auto_tune``."""
+    vram_reserve_mb: int = 1024  # Left free for the CUDA context and estimation error
+    ram_reserve_mb: int = 2048  # Left free for the worker process and page cache
+    max_ctx: int = 32768  # Largest context chosen, even when the model was trained on more
+    min_ctx: int = 2048  # Smallest context; below it layers are left on the CPU instead
+
+
+@dataclass
+class MetricsConfig:
+    """Per-phase latency and throughput metrics."""
+    enabled: bool = True
+    window: int = 1024  # Recent jobs per model kept for the percentiles
+    port: int = 0  # Serve Prometheus text on this port (0 disables the HTTP endpoint)
+
+
 @dataclass
 class Config:
     """Main configuration class."""
     model: ModelConfig
     inference: InferenceConfig
+    model_name: str = "default"  # Registry name of the default model
+    models: Dict[str, ModelConfig] = field(default_factory=dict)
+    pool: ModelPoolConfig = field(default_factory=ModelPoolConfig)
+    streaming: StreamingConfig = field(default_factory=StreamingConfig)
+    scheduler: SchedulerConfig = field(default_factory=SchedulerConfig)
+    prefix_cache: PrefixCacheConfig = field(default_factory=PrefixCacheConfig)
+    session: SessionConfig = field(default_factory=SessionConfig)
+    response_cache: ResponseCacheConfig = field(default_factory=ResponseCacheConfig)
+    context: ContextConfig = field(default_factory=ContextConfig)
+    speculative: SpeculativeConfig = field(default_factory=SpeculativeConfig)
+    metrics: MetricsConfig = field(default_factory=MetricsConfig)
+    cache: CacheConfig = field(default_factory=CacheConfig)
+    grammar: GrammarConfig = field(default_factory=GrammarConfig)
+    embedding: EmbeddingConfig = field(default_factory=EmbeddingConfig)
+    tuning: TuningConfig = field(default_factory=TuningConfig)
     
     # Environment variables
     hf_token: Optional[str] = None
@@ -50,7 +248,32 @@ class Config:
             cache_dir=os.getenv("MODEL_CACHE_DIR", ModelConfig.cache_dir),
             n_gpu_layers=int(os.getenv("N_GPU_LAYERS", ModelConfig.n_gpu_layers)),
             n_ctx=int(os.getenv("N_CTX", ModelConfig.n_ctx)),
-            n_batch=int(os.getenv("N_BATCH", ModelConfig.n_batch))
+            n_batch=int(os.getenv("N_BATCH", ModelConfig.n_batch)),
+            n_threads=int(os.environ["N_THREADS"]) if os.getenv("N_THREADS") else ModelConfig.n_threads,
+            auto_tune=_env_bool("AUTO_TUNE", ModelConfig.auto_tune),
+            download_url=os.getenv("MODEL_DOWNLOAD_URL", ModelConfig.download_url),
+            sha256=os.getenv("MODEL_SHA256", ModelConfig.sha256),
+            download_workers=int(os.getenv("DOWNLOAD_WORKERS", ModelConfig.download_workers)),
+            download_chunk_mb=int(os.getenv("DOWNLOAD_CHUNK_MB", ModelConfig.download_chunk_mb)),
+            prefetch_weights=_env_bool("MODEL_PREFETCH", ModelConfig.prefetch_weights),
+            use_mmap=_env_bool("MODEL_USE_MMAP", ModelConfig.use_mmap),
+            use_mlock=_env_bool("MODEL_USE_MLOCK", ModelConfig.use_mlock),
+            staging_dir=os.getenv("MODEL_STAGING_DIR") or ModelConfig.staging_dir,
+            staging_wait=_env_bool("MODEL_STAGING_WAIT", ModelConfig.staging_wait),
+            chat_template=os.getenv("MODEL_CHAT_TEMPLATE", ModelConfig.chat_template),
+            draft_repository_id=os.getenv("DRAFT_MODEL_REPOSITORY_ID") or ModelConfig.draft_repository_id,
+            draft_filename=os.getenv("DRAFT_MODEL_FILENAME") or ModelConfig.draft_filename,
+            draft_download_url=os.getenv("DRAFT_MODEL_DOWNLOAD_URL") or ModelConfig.draft_download_url,
+            draft_n_gpu_layers=int(os.getenv("DRAFT_N_GPU_LAYERS", ModelConfig.draft_n_gpu_layers))
+        )
+        
+        model_name = os.getenv("MODEL_NAME", "default")
+        models = _load_model_registry(model_name, model_config)
+        
+        pool_config = ModelPoolConfig(
+            max_models=int(os.getenv("MODEL_POOL_MAX_MODELS", ModelPoolConfig.max_models)),
+            vram_budget_mb=int(os.getenv("MODEL_POOL_VRAM_MB", ModelPoolConfig.vram_budget_mb)),
+            ram_budget_mb=int(os.getenv("MODEL_POOL_RAM_MB", ModelPoolConfig.ram_budget_mb))
         )
         
         inference_config = InferenceConfig(
@@ -58,12 +281,121 @@ class Config:
             temperature=float(os.getenv("TEMPERATURE", InferenceConfig.temperature)),
             top_p=float(os.getenv("TOP_P", InferenceConfig.top_p)),
             top_k=int(os.getenv("TOP_K", InferenceConfig.top_k)),
-            repeat_penalty=float(os.getenv("REPEAT_PENALTY", InferenceConfig.repeat_penalty))
+            repeat_penalty=float(os.getenv("REPEAT_PENALTY", InferenceConfig.repeat_penalty)),
+            timeout_ms=int(os.getenv("REQUEST_TIMEOUT_MS", InferenceConfig.timeout_ms)),
+            max_samples=int(os.getenv("MAX_SAMPLES", InferenceConfig.max_samples))
+        )
+        
+        streaming_config = StreamingConfig(
+            chunk_tokens=int(os.getenv("STREAM_CHUNK_TOKENS", StreamingConfig.chunk_tokens)),
+            chunk_interval_ms=int(os.getenv("STREAM_CHUNK_INTERVAL_MS", StreamingConfig.chunk_interval_ms))
+        )
+        
+        scheduler_config = SchedulerConfig(
+            max_concurrency=int(os.getenv("MAX_CONCURRENCY", SchedulerConfig.max_concurrency)),
+            parallel_sequences=int(os.getenv("PARALLEL_SEQUENCES", SchedulerConfig.parallel_sequences)),
+            idle_wait_ms=int(os.getenv("SCHEDULER_IDLE_WAIT_MS", SchedulerConfig.idle_wait_ms)),
+            max_batch_inputs=int(os.getenv("MAX_BATCH_INPUTS", SchedulerConfig.max_batch_inputs)),
+            min_shared_prefix=int(os.getenv("SCHEDULER_MIN_SHARED_PREFIX", SchedulerConfig.min_shared_prefix)),
+            policy=os.getenv("SCHEDULER_POLICY", SchedulerConfig.policy),
+            default_priority=os.getenv("SCHEDULER_DEFAULT_PRIORITY", SchedulerConfig.default_priority),
+            priority_step_seconds=float(os.getenv("SCHEDULER_PRIORITY_STEP_SECONDS", SchedulerConfig.priority_step_seconds)),
+            aging=float(os.getenv("SCHEDULER_AGING", SchedulerConfig.aging)),
+            prefill_tokens_per_second=float(os.getenv("SCHEDULER_PREFILL_TPS", SchedulerConfig.prefill_tokens_per_second)),
+            decode_tokens_per_second=float(os.getenv("SCHEDULER_DECODE_TPS", SchedulerConfig.decode_tokens_per_second)),
+            latency_slo_ms=int(os.getenv("SCHEDULER_LATENCY_SLO_MS", SchedulerConfig.latency_slo_ms))
+        )
+        
+        prefix_cache_config = PrefixCacheConfig(
+            enabled=_env_bool("PREFIX_CACHE_ENABLED", PrefixCacheConfig.enabled),
+            max_mb=int(os.getenv("PREFIX_CACHE_MAX_MB", PrefixCacheConfig.max_mb)),
+            min_prefix_tokens=int(os.getenv("PREFIX_CACHE_MIN_TOKENS", PrefixCacheConfig.min_prefix_tokens)),
+            min_save_tokens=int(os.getenv("PREFIX_CACHE_MIN_SAVE_TOKENS", PrefixCacheConfig.min_save_tokens))
+        )
+        
+        session_config = SessionConfig(
+            enabled=_env_bool("SESSIONS_ENABLED", SessionConfig.enabled),
+            ttl_seconds=int(os.getenv("SESSION_TTL_SECONDS", SessionConfig.ttl_seconds)),
+            max_ram_mb=int(os.getenv("SESSION_MAX_RAM_MB", SessionConfig.max_ram_mb)),
+            max_disk_mb=int(os.getenv("SESSION_MAX_DISK_MB", SessionConfig.max_disk_mb)),
+            persist=_env_bool("SESSION_PERSIST", SessionConfig.persist)
+        )
+        
+        response_cache_config = ResponseCacheConfig(
+            enabled=_env_bool("RESPONSE_CACHE_ENABLED", ResponseCacheConfig.enabled),
+            max_entries=int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", ResponseCacheConfig.max_entries)),
+            max_mb=int(os.getenv("RESPONSE_CACHE_MAX_MB", ResponseCacheConfig.max_mb)),
+            ttl_seconds=int(os.getenv("RESPONSE_CACHE_TTL_SECONDS", ResponseCacheConfig.ttl_seconds)),
+            disk_enabled=_env_bool("RESPONSE_CACHE_DISK", ResponseCacheConfig.disk_enabled),
+            max_disk_entries=int(os.getenv("RESPONSE_CACHE_MAX_DISK_ENTRIES", ResponseCacheConfig.max_disk_entries))
+        )
+        
+        context_config = ContextConfig(
+            policy=os.getenv("CONTEXT_POLICY", ContextConfig.policy),
+            window_messages=int(os.getenv("CONTEXT_WINDOW_MESSAGES", ContextConfig.window_messages)),
+            max_cached_segments=int(os.getenv("CONTEXT_MAX_CACHED_SEGMENTS", ContextConfig.max_cached_segments))
+        )
+        
+        speculative_config = SpeculativeConfig(
+            mode=os.getenv("SPECULATIVE_MODE", SpeculativeConfig.mode),
+            num_pred_tokens=int(os.getenv("SPECULATIVE_PRED_TOKENS", SpeculativeConfig.num_pred_tokens)),
+            max_ngram_size=int(os.getenv("SPECULATIVE_MAX_NGRAM", SpeculativeConfig.max_ngram_size)),
+            draft_pred_tokens=int(os.getenv("SPECULATIVE_DRAFT_PRED_TOKENS", SpeculativeConfig.draft_pred_tokens))
+        )
+        
+        cache_config = CacheConfig(
+            max_gb=float(os.getenv("CACHE_MAX_GB", CacheConfig.max_gb)),
+            pinned_files=[name.strip() for name in os.getenv("CACHE_PINNED_FILES", "").split(",") if name.strip()],
+            lease_seconds=int(os.getenv("CACHE_LEASE_SECONDS", CacheConfig.lease_seconds)),
+            eviction_interval_seconds=int(os.getenv("CACHE_EVICTION_INTERVAL_SECONDS", CacheConfig.eviction_interval_seconds)),
+            max_evictions_per_pass=int(os.getenv("CACHE_MAX_EVICTIONS_PER_PASS", CacheConfig.max_evictions_per_pass)),
+            status_refresh_seconds=int(os.getenv("CACHE_STATUS_REFRESH_SECONDS", CacheConfig.status_refresh_seconds)),
+            download_lease_seconds=int(os.getenv("CACHE_DOWNLOAD_LEASE_SECONDS", CacheConfig.download_lease_seconds)),
+            download_poll_seconds=float(os.getenv("CACHE_DOWNLOAD_POLL_SECONDS", CacheConfig.download_poll_seconds))
+        )
+        
+        grammar_config = GrammarConfig(
+            max_entries=int(os.getenv("GRAMMAR_CACHE_MAX_ENTRIES", GrammarConfig.max_entries))
+        )
+        
+        embedding_config = EmbeddingConfig(
+            pooling=os.getenv("EMBEDDING_POOLING", EmbeddingConfig.pooling),
+            normalize=_env_bool("EMBEDDING_NORMALIZE", EmbeddingConfig.normalize),
+            encoding=os.getenv("EMBEDDING_ENCODING", EmbeddingConfig.encoding),
+            max_inputs=int(os.getenv("EMBEDDING_MAX_INPUTS", EmbeddingConfig.max_inputs))
+        )
+        
+        tuning_config = TuningConfig(
+            vram_reserve_mb=int(os.getenv("AUTO_TUNE_VRAM_RESERVE_MB", TuningConfig.vram_reserve_mb)),
+            ram_reserve_mb=int(os.getenv("AUTO_TUNE_RAM_RESERVE_MB", TuningConfig.ram_reserve_mb)),
+            max_ctx=int(os.getenv("AUTO_TUNE_MAX_CTX", TuningConfig.max_ctx)),
+            min_ctx=int(os.getenv("AUTO_TUNE_MIN_CTX", TuningConfig.min_ctx))
+        )
+        
+        metrics_config = MetricsConfig(
+            enabled=_env_bool("METRICS_ENABLED", MetricsConfig.enabled),
+            window=int(os.getenv("METRICS_WINDOW", MetricsConfig.window)),
+            port=int(os.getenv("METRICS_PORT", MetricsConfig.port))
         )
         
         return cls(
             model=model_config,
             inference=inference_config,
+            model_name=model_name,
+            models=models,
+            pool=pool_config,
+            streaming=streaming_config,
+            scheduler=scheduler_config,
+            prefix_cache=prefix_cache_config,
+            session=session_config,
+            response_cache=response_cache_config,
+            context=context_config,
+            speculative=speculative_config,
+            metrics=metrics_config,
+            cache=cache_config,
+            grammar=grammar_config,
+            embedding=embedding_config,
+            tuning=tuning_config,
             hf_token=os.getenv("HF_TOKEN"),
             log_level=os.getenv("LOG_LEVEL", "INFO")
         )
@@ -75,6 +407,16 @@ class Config:
         
         if self.model.n_ctx <= 0 or self.model.n_batch <= 0:
             return False
+        
+        if self.model.download_workers <= 0 or self.model.download_chunk_mb <= 0:
+            return False
+        
+        for model in self.models.values():
+            if not model.repository_id or not model.filename or model.n_ctx <= 0 or model.n_batch <= 0:
+                return False
+        
+        if self.pool.max_models <= 0 or self.pool.vram_budget_mb < 0 or self.pool.ram_budget_mb < 0:
+            return False
             
         if self.inference.max_tokens <= 0:
             return False
@@ -84,12 +426,89 @@ class Config:
             
         if not (0.0 <= self.inference.top_p <= 1.0):
             return False
+        
+        if self.inference.timeout_ms < 0 or self.inference.max_samples <= 0:
+            return False
+        
+        if self.streaming.chunk_tokens <= 0 or self.streaming.chunk_interval_ms < 0:
+            return False
+        
+        if self.scheduler.max_concurrency <= 0 or self.scheduler.parallel_sequences <= 0:
+            return False
+        
+        if self.scheduler.max_batch_inputs <= 0 or self.scheduler.min_shared_prefix < 1:
+            return False
+        
+        if self.scheduler.policy not in ("sjf", "fifo") or self.scheduler.default_priority not in ("high", "normal", "low"):
+            return False
+        
+        if self.scheduler.priority_step_seconds < 0 or self.scheduler.aging < 0 or self.scheduler.latency_slo_ms < 0:
+            return False
+        
+        if self.scheduler.prefill_tokens_per_second <= 0 or self.scheduler.decode_tokens_per_second <= 0:
+            return False
+        
+        if self.prefix_cache.max_mb <= 0 or self.prefix_cache.min_prefix_tokens < 0 or self.prefix_cache.min_save_tokens < 0:
+            return False
+        
+        if self.session.ttl_seconds <= 0 or self.session.max_ram_mb < 0 or self.session.max_disk_mb < 0:
+            return False
+        
+        if self.response_cache.max_entries <= 0 or self.response_cache.ttl_seconds <= 0:
+            return False
+        
+        if self.context.policy not in ("keep_system", "drop_oldest", "sliding_window", "none"):
+            return False
+        
+        if self.context.window_messages <= 0 or self.context.max_cached_segments <= 0:
+            return False
+        
+        if self.speculative.mode not in ("off", "prompt_lookup", "draft"):
+            return False
+        
+        if self.speculative.num_pred_tokens <= 0 or self.speculative.max_ngram_size <= 0 or self.speculative.draft_pred_tokens <= 0:
+            return False
+        
+        if self.cache.max_gb < 0 or self.cache.lease_seconds <= 0:
+            return False
+        
+        if self.cache.eviction_interval_seconds <= 0 or self.cache.max_evictions_per_pass <= 0 or self.cache.status_refresh_seconds <= 0:
+            return False
+        
+        if self.cache.download_lease_seconds <= 0 or self.cache.download_poll_seconds <= 0:
+            return False
+        
+        if self.grammar.max_entries <= 0:
+            return False
+        
+        if self.embedding.pooling not in ("mean", "last", "cls") or self.embedding.encoding not in ("float32", "float16"):
+            return False
+        
+        if self.embedding.max_inputs <= 0:
+            return False
+        
+        if self.metrics.window <= 0 or not (0 <= self.metrics.port <= 65535):
+            return False
+        
+        if self.tuning.vram_reserve_mb < 0 or self.tuning.ram_reserve_mb < 0:
+            return False
+        
+        if self.tuning.min_ctx <= 0 or self.tuning.max_ctx < self.tuning.min_ctx:
+            return False
             
         return True
     
     def get_model_path(self) -> str:
         """Get the full path to the model file."""
         return os.path.join(self.model.cache_dir, "models", self.model.filename)
+    
+    def get_sessions_dir(self) -> str:
+        """Get the directory for persisted chat session snapshots."""
+        return os.path.join(self.model.cache_dir, "sessions")
+    
+    def get_response_cache_dir(self) -> str:
+        """Get the directory for memoized responses on the network volume."""
+        return os.path.join(self.model.cache_dir, "response_cache")
 
 
 # Global configuration instance
@@ -0,0 +1,131 @@
+"""Fitting chat histories into the model's context window."""
+
+import logging
+import threading
+from typing import Dict, Any, List, Callable, Tuple
+
+from chat_template import ChatEncoding
+
+logger = logging.getLogger(__name__)
+
+CONTEXT_POLICIES = ("keep_system", "drop_oldest", "sliding_window", "none")
+
+
+class ContextOverflowError(ValueError):
+    """Raised when not even the latest message fits in the context window."""
+
+
+class ChatContextManager:
+    """Trims chat histories to a token budget.
+
+    Conversations are measured with the model's chat template, which caches
+    the tokenization of every message it has seen, so a growing conversation
+    only tokenizes the turns that are new. Policies:
+
+    - ``keep_system``: keep system messages, drop the oldest other turns
+    - ``drop_oldest``: drop the oldest messages, system prompt included
+    - ``sliding_window``: keep system messages and at most ``window_messages``
+      recent turns, then drop the oldest of those while over budget
+    - ``none``: never trim
+
+    Dropping never leaves an assistant reply without the user turn before it,
+    and the last message is always kept. The trimmed conversation is rendered
+    again, so the budget holds even for templates whose markup depends on
+    which messages are present.
+    """
+
+    def __init__(self, encode: Callable[[List[Dict[str, str]]], ChatEncoding], window_messages: int = 32):
+        self.encode = encode
+        self.window_messages = window_messages
+        self._lock = threading.Lock()
+
+        self.stats = {
+            "requests": 0,
+            "requests_trimmed": 0,
+            "messages_trimmed": 0,
+            "tokens_trimmed": 0
+        }
+
+    def fit(self, messages: List[Dict[str, str]], budget: int, policy: str = "keep_system") -> Tuple[List[Dict[str, str]], List[int], Dict[str, int]]:
+        """Return the messages that fit in ``budget`` tokens, their token ids and what was trimmed."""
+        encoding = self.encode(messages)
+        full_tokens = len(encoding.token_ids)
+
+        with self._lock:
+            self.stats["requests"] += 1
+
+        keep = [True] * len(messages)
+        if policy != "none" and messages:
+            encoding = self._trim(messages, keep, encoding, budget, policy)
+
+        trimmed_messages = len(messages) - sum(keep)
+        report = {
+            "context_tokens": len(encoding.token_ids),
+            "context_trimmed_messages": trimmed_messages,
+            "context_trimmed_tokens": full_tokens - len(encoding.token_ids)
+        }
+
+        if trimmed_messages:
+            with self._lock:
+                self.stats["requests_trimmed"] += 1
+                self.stats["messages_trimmed"] += trimmed_messages
+                self.stats["tokens_trimmed"] += report["context_trimmed_tokens"]
+
+        kept = [message for message, kept in zip(messages, keep) if kept]
+        return kept, encoding.token_ids, report
+
+    def _trim(self, messages: List[Dict[str, str]], keep: List[bool], encoding: ChatEncoding, budget: int, policy: str) -> ChatEncoding:
+        """Drop messages (updating ``keep``) until the rendered conversation fits."""
+        protected = [
+            index == len(messages) - 1
+            or (policy != "drop_oldest" and messages[index].get("role") == "system")
+            for index in range(len(messages))
+        ]
+
+        if policy == "sliding_window":
+            turns = [index for index in range(len(messages)) if not protected[index]]
+            for index in turns[:max(len(turns) - max(self.window_messages - 1, 0), 0)]:
+                keep[index] = False
+
+        changed = not all(keep)
+        while True:
+            if changed:
+                self._drop_orphaned_replies(messages, keep, protected)
+                encoding = self.encode([message for message, kept in zip(messages, keep) if kept])
+
+            overshoot = len(encoding.token_ids) - budget
+            if overshoot <= 0:
+                return encoding
+
+            # The per-message counts are estimates, so re-render and check again afterwards
+            kept_indices = [index for index in range(len(messages)) if keep[index]]
+            freed = 0
+            changed = False
+            for index, count in zip(kept_indices, encoding.message_tokens):
+                if freed >= overshoot:
+                    break
+                if not protected[index]:
+                    keep[index] = False
+                    freed += count
+                    changed = True
+
+            if not changed:
+                raise ContextOverflowError(
+                    f"Messages need {len(encoding.token_ids)} tokens but only {budget} fit in the context window"
+                )
+
+    @staticmethod
+    def _drop_orphaned_replies(messages: List[Dict[str, str]], keep: List[bool], protected: List[bool]):
+        """A reply whose question was dropped only confuses the model."""
+        for index in range(len(messages)):
+            if not keep[index] or messages[index].get("role") == "system":
+                continue
+            if messages[index].get("role") == "assistant" and not protected[index]:
+                keep[index] = False
+                continue
+            break
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get trimming counters."""
+        with self._lock:
+            return dict(self.stats)
@@ -0,0 +1,165 @@
+"""Leases that let one worker download a model while the others on the volume wait."""
+
+import json
+import logging
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Optional, Callable
+
+from cache_eviction import default_worker_id
+
+logger = logging.getLogger(__name__)
+
+LEASE_DIRNAME = ".downloading"
+
+
+class DownloadLease:
+    """Exclusive right to download one file into the shared cache directory.
+
+    The lease is a file under ``.downloading`` created with ``O_EXCL``, so
+    exactly one worker wins it. The holder refreshes its mtime from a
+    heartbeat thread while it downloads into the ``.part`` file, publishes the
+    verified file with a rename and only then releases the lease. A lease
+    that has not been refreshed for ``stale_seconds`` was left by a worker
+    that died; whoever notices first moves it aside and takes over, and the
+    downloader's range map lets it resume where the previous holder stopped.
+    A holder that was only slow finds the lease taken over on its next
+    heartbeat and sets ``lost``; its download must stop writing then.
+    """
+
+    def __init__(
+        self,
+        cache_dir: str,
+        filename: str,
+        stale_seconds: int = 60,
+        worker_id: Optional[str] = None
+    ):
+        self.cache_dir = Path(cache_dir)
+        self.filename = filename
+        self.stale_seconds = stale_seconds
+        self.worker_id = worker_id or default_worker_id()
+        self.path = self.cache_dir / LEASE_DIRNAME / filename
+
+        self.held = False
+        self.lost = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def try_acquire(self) -> bool:
+        """Take the lease if nobody holds it or its holder stopped refreshing it."""
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+
+        for _ in range(2):
+            try:
+                fd = os.open(self.path, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644)
+            except FileExistsError:
+                if not self._take_over_stale():
+                    return False
+                continue
+
+            with os.fdopen(fd, "w") as f:
+                json.dump({"worker_id": self.worker_id, "acquired_at": time.time()}, f)
+
+            self.held = True
+            self.lost.clear()
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._heartbeat, name="download-lease", daemon=True)
+            self._thread.start()
+            return True
+
+        return False
+
+    def release(self):
+        """Stop refreshing the lease and remove it, unless another worker took it over."""
+        if not self.held:
+            return
+
+        self.held = False
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+        if self.holder() == self.worker_id:
+            self.path.unlink(missing_ok=True)
+
+    def holder(self) -> Optional[str]:
+        """Worker id recorded in the current lease, or None if there is none."""
+        try:
+            with open(self.path, "r") as f:
+                return json.load(f).get("worker_id")
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError):
+            return None  # Still being written by the worker that just created it
+
+    def is_stale(self, mtime: float) -> bool:
+        return time.time() - mtime > self.stale_seconds
+
+    def wait(self, poll_seconds: float, progress_callback: Optional[Callable[[], None]] = None):
+        """Block until the lease is released or goes stale."""
+        while True:
+            try:
+                mtime = self.path.stat().st_mtime
+            except FileNotFoundError:
+                return
+            if self.is_stale(mtime):
+                return
+
+            if progress_callback is not None:
+                progress_callback()
+            time.sleep(poll_seconds)
+
+    def _take_over_stale(self) -> bool:
+        """Move a stale lease aside. Returns True if acquiring should be tried again."""
+        try:
+            stat = self.path.stat()
+        except FileNotFoundError:
+            return True  # Released in the meantime
+        if not self.is_stale(stat.st_mtime):
+            return False
+
+        # Renaming is atomic, so only one of several workers noticing the same stale lease wins
+        aside = self.path.with_name(f"{self.path.name}.{self.worker_id}.stale")
+        try:
+            os.rename(self.path, aside)
+        except FileNotFoundError:
+            return True
+
+        # Between the stat and the rename another worker may have replaced the stale lease
+        if os.stat(aside).st_ino != stat.st_ino:
+            try:
+                os.link(aside, self.path)
+            except OSError:
+                pass
+            aside.unlink(missing_ok=True)
+            return False
+
+        try:
+            with open(aside, "r") as f:
+                previous = json.load(f).get("worker_id")
+        except (OSError, ValueError):
+            previous = None
+        aside.unlink(missing_ok=True)
+
+        logger.warning(
+            f"Download lease on {self.filename} held by {previous or 'an unknown worker'} "
+            f"went stale, taking over"
+        )
+        return True
+
+    def _heartbeat(self):
+        """Refresh the lease well within ``stale_seconds`` while the download runs."""
+        interval = max(self.stale_seconds / 4, 0.5)
+
+        while not self._stop.wait(interval):
+            if self.holder() != self.worker_id:
+                logger.warning(f"Lost the download lease on {self.filename} to another worker")
+                self.lost.set()
+                return
+            try:
+                os.utime(self.path)
+            except OSError as e:
+                logger.warning(f"Could not refresh the download lease on {self.filename}: {e}")
@@ -0,0 +1,387 @@
+"""Parallel, resumable HTTP range downloader that hashes while it downloads."""
+
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from typing import Dict, Optional, Callable
+
+logger = logging.getLogger(__name__)
+
+READ_SIZE = 1024 * 1024
+
+
+class DownloadError(RuntimeError):
+    """Raised when a download cannot be completed or fails verification."""
+
+
+class DownloadAborted(DownloadError):
+    """Raised when the download was stopped through its ``abort`` event."""
+
+
+class ParallelDownloader:
+    """Downloads a file as parallel byte ranges into a preallocated ``.part`` file.
+
+    Completed ranges are recorded in a ``.part.json`` range map so an
+    interrupted download resumes where it stopped. Each range is streamed
+    straight to its offset, so a worker holds one ``READ_SIZE`` buffer
+    rather than a whole chunk. The SHA-256 is computed in the same pass:
+    finished ranges are read back and hashed in file order, and downloads get
+    at most ``window`` chunks ahead of the hasher, so what it reads back is
+    still in the page cache. The file is renamed into place only after size
+    and hash have been verified. Setting ``abort`` stops the download between
+    reads, without touching the files again: another process may own them by
+    then.
+    """
+
+    def __init__(
+        self,
+        url: str,
+        dest_path: str,
+        expected_size: Optional[int] = None,
+        expected_sha256: Optional[str] = None,
+        headers: Optional[Dict[str, str]] = None,
+        workers: int = 8,
+        chunk_size: int = 32 * 1024 * 1024,
+        window: Optional[int] = None,
+        max_retries: int = 5,
+        timeout: float = 60.0,
+        abort: Optional[threading.Event] = None
+    ):
+        self.url = url
+        self.dest_path = dest_path
+        self.part_path = dest_path + ".part"
+        self.map_path = dest_path + ".part.json"
+        self.expected_size = expected_size
+        self.expected_sha256 = expected_sha256.lower() if expected_sha256 else None
+        self.headers = headers or {}
+        self.workers = max(workers, 1)
+        self.chunk_size = chunk_size
+        self.window = window or self.workers * 2
+        self.max_retries = max_retries
+        self.timeout = timeout
+        self.abort = abort
+
+        self.sha256 = None
+        self._resolved_url = None
+        self._resolve_lock = threading.Lock()
+        self._fd = None
+
+    def download(
+        self,
+        progress_callback: Optional[Callable[[int, int], None]] = None,
+        before_publish: Optional[Callable[[str, str], None]] = None
+    ) -> str:
+        """Download, verify and publish the file. Returns the destination path.
+
+        ``before_publish(part_path, sha256)`` runs on the verified file before
+        it is renamed into place, e.g. to write metadata that readers expect to
+        find next to it. If it raises, the download is discarded.
+        """
+        size, supports_ranges = self._probe()
+        if self.expected_size is not None and size != self.expected_size:
+            raise DownloadError(f"Server reports {size} bytes, expected {self.expected_size}")
+
+        if not supports_ranges:
+            logger.warning("Server does not support range requests, downloading sequentially")
+            digest = self._download_sequential(size, progress_callback)
+        else:
+            digest = self._download_ranges(size, progress_callback)
+
+        self._check_abort()
+        if self.expected_sha256 and digest != self.expected_sha256:
+            self._discard()
+            raise DownloadError(f"SHA-256 mismatch: expected {self.expected_sha256}, got {digest}")
+
+        if before_publish is not None:
+            try:
+                before_publish(self.part_path, digest)
+            except Exception:
+                self._discard()
+                raise
+
+        os.replace(self.part_path, self.dest_path)
+        if os.path.exists(self.map_path):
+            os.remove(self.map_path)
+
+        logger.info(f"Downloaded and verified {self.dest_path} (sha256 {digest})")
+        self.sha256 = digest
+        return self.dest_path
+
+    def _aborted(self) -> bool:
+        return self.abort is not None and self.abort.is_set()
+
+    def _check_abort(self):
+        if self._aborted():
+            raise DownloadAborted(f"Download of {self.dest_path} was aborted")
+
+    # HTTP helpers
+
+    def _request(self, url: str, method: str = "GET", byte_range: Optional[tuple] = None):
+        request = urllib.request.Request(url, method=method)
+        for name, value in self.headers.items():
+            # Credentials must not follow redirects to a CDN
+            request.add_unredirected_header(name, value)
+        if byte_range is not None:
+            request.add_header("Range", f"bytes={byte_range[0]}-{byte_range[1]}")
+        return urllib.request.urlopen(request, timeout=self.timeout)
+
+    def _probe(self) -> tuple:
+        """Resolve redirects and find out the file size and range support."""
+        with self._request(self.url, byte_range=(0, 0)) as response:
+            self._resolved_url = response.geturl()
+
+            if response.status == 206:
+                content_range = response.headers.get("Content-Range", "")
+                size = int(content_range.rsplit("/", 1)[-1])
+                return size, True
+
+            return int(response.headers["Content-Length"]), False
+
+    def _refresh_url(self, stale_url: str):
+        """Resolve the URL again, e.g. after a signed CDN link expired."""
+        with self._resolve_lock:
+            if self._resolved_url == stale_url:
+                self._probe()
+
+    # Range download
+
+    def _load_range_map(self, size: int) -> set:
+        """Return the chunks finished by a previous attempt, if it is compatible."""
+        if not (os.path.exists(self.map_path) and os.path.exists(self.part_path)):
+            return set()
+
+        try:
+            with open(self.map_path, "r") as f:
+                range_map = json.load(f)
+        except Exception as e:
+            logger.warning(f"Ignoring unreadable range map {self.map_path}: {e}")
+            return set()
+
+        if (
+            range_map.get("size") != size
+            or range_map.get("chunk_size") != self.chunk_size
+            or range_map.get("sha256") != self.expected_sha256
+            or os.path.getsize(self.part_path) != size
+        ):
+            logger.info("Range map does not match this download, starting over")
+            return set()
+
+        return set(range_map.get("done", []))
+
+    def _save_range_map(self, size: int, done: set):
+        """Persist finished chunks after making sure their bytes are on disk."""
+        if self._aborted():
+            return
+        os.fsync(self._fd)
+        temp_path = self.map_path + ".tmp"
+        with open(temp_path, "w") as f:
+            json.dump({
+                "url": self.url,
+                "size": size,
+                "chunk_size": self.chunk_size,
+                "sha256": self.expected_sha256,
+                "done": sorted(done),
+                "updated_at": time.time()
+            }, f)
+        os.replace(temp_path, self.map_path)
+
+    def _preallocate(self, size: int):
+        self._fd = os.open(self.part_path, os.O_RDWR | os.O_CREAT, 0o644)
+        if os.fstat(self._fd).st_size == size:
+            return
+        try:
+            os.posix_fallocate(self._fd, 0, size)
+        except (AttributeError, OSError):
+            os.ftruncate(self._fd, size)
+
+    def _fetch_chunk(self, index: int, size: int) -> int:
+        """Download one chunk into place and return its length."""
+        start = index * self.chunk_size
+        end = min(start + self.chunk_size, size) - 1
+        expected = end - start + 1
+
+        for attempt in range(self.max_retries + 1):
+            url = self._resolved_url
+            try:
+                written = 0
+                with self._request(url, byte_range=(start, end)) as response:
+                    if response.status != 206:
+                        raise DownloadError(f"Expected partial content, got HTTP {response.status}")
+                    while written < expected:
+                        self._check_abort()
+                        piece = response.read(min(READ_SIZE, expected - written))
+                        if not piece:
+                            break
+                        os.pwrite(self._fd, piece, start + written)
+                        written += len(piece)
+
+                if written != expected:
+                    raise DownloadError(f"Chunk {index} truncated: {written}/{expected} bytes")
+
+                return written
+
+            except DownloadAborted:
+                raise
+            except Exception as e:
+                if isinstance(e, urllib.error.HTTPError) and e.code in (401, 403):
+                    self._refresh_url(url)
+                if attempt == self.max_retries:
+                    raise DownloadError(f"Chunk {index} failed after {attempt + 1} attempts: {e}") from e
+                delay = min(2 ** attempt, 30)
+                logger.warning(f"Chunk {index} failed ({e}), retrying in {delay}s")
+                time.sleep(delay)
+
+    def _hash_chunk(self, hasher, index: int, size: int):
+        """Read a finished chunk back from the file into the hash."""
+        start = index * self.chunk_size
+        end = min(start + self.chunk_size, size)
+        for offset in range(start, end, READ_SIZE):
+            hasher.update(os.pread(self._fd, min(READ_SIZE, end - offset), offset))
+
+    def _download_ranges(self, size: int, progress_callback) -> str:
+        total_chunks = (size + self.chunk_size - 1) // self.chunk_size
+        done = self._load_range_map(size)
+        if done:
+            logger.info(f"Resuming download: {len(done)}/{total_chunks} chunks already present")
+
+        self._preallocate(size)
+        hasher = hashlib.sha256()
+        hash_cursor = 0
+        downloaded = sum(min(self.chunk_size, size - i * self.chunk_size) for i in done)
+        todo = [i for i in range(total_chunks) if i not in done]
+        last_map_save = time.time()
+
+        try:
+            with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="download") as pool:
+                in_flight = {}
+                next_todo = 0
+
+                while hash_cursor < total_chunks:
+                    self._check_abort()
+
+                    # Keep the workers busy without getting too far ahead of the hasher
+                    while (
+                        next_todo < len(todo)
+                        and len(in_flight) < self.workers
+                        and todo[next_todo] < hash_cursor + self.window
+                    ):
+                        index = todo[next_todo]
+                        in_flight[pool.submit(self._fetch_chunk, index, size)] = index
+                        next_todo += 1
+
+                    # Hash everything that is now contiguous with the cursor
+                    while hash_cursor < total_chunks and hash_cursor in done:
+                        self._hash_chunk(hasher, hash_cursor, size)
+                        hash_cursor += 1
+
+                    if not in_flight:
+                        continue
+
+                    finished, _ = wait(list(in_flight), return_when=FIRST_COMPLETED)
+                    for future in finished:
+                        index = in_flight.pop(future)
+                        downloaded += future.result()
+                        done.add(index)
+
+                    if progress_callback is not None:
+                        progress_callback(downloaded, size)
+
+                    if time.time() - last_map_save >= 5.0:
+                        self._save_range_map(size, done)
+                        last_map_save = time.time()
+
+        except BaseException:
+            if self._fd is not None:
+                self._save_range_map(size, done)
+            raise
+        finally:
+            if self._fd is not None:
+                if not self._aborted():
+                    os.fsync(self._fd)
+                os.close(self._fd)
+                self._fd = None
+
+        return hasher.hexdigest()
+
+    def _download_sequential(self, size: int, progress_callback) -> str:
+        """Fallback for servers without range support: one stream, hashed on the fly."""
+        hasher = hashlib.sha256()
+        downloaded = 0
+
+        with self._request(self._resolved_url) as response, open(self.part_path, "wb") as f:
+            for piece in iter(lambda: response.read(READ_SIZE), b""):
+                self._check_abort()
+                f.write(piece)
+                hasher.update(piece)
+                downloaded += len(piece)
+                if progress_callback is not None:
+                    progress_callback(downloaded, size)
+            f.flush()
+            os.fsync(f.fileno())
+
+        if downloaded != size:
+            self._discard()
+            raise DownloadError(f"Download truncated: {downloaded}/{size} bytes")
+
+        return hasher.hexdigest()
+
+    def _discard(self):
+        for path in (self.part_path, self.map_path):
+            if os.path.exists(path):
+                os.remove(path)
+
+
+def read_download_progress(dest_path: str) -> Optional[tuple]:
+    """(downloaded, total) bytes of a range download into ``dest_path`` run by another process.
+
+    Reads the range map, so it lags behind by up to the map save interval.
+    Returns None when there is no readable range map.
+    """
+    try:
+        with open(dest_path + ".part.json", "r") as f:
+            range_map = json.load(f)
+    except (OSError, ValueError):
+        return None
+
+    size = range_map.get("size")
+    chunk_size = range_map.get("chunk_size")
+    if not size or not chunk_size:
+        return None
+
+    downloaded = sum(min(chunk_size, size - index * chunk_size) for index in range_map.get("done", []))
+    return downloaded, size
+
+
+def main():
+    """Command line entry point, handy for testing against a local HTTP server."""
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Parallel resumable downloader")
+    parser.add_argument("url")
+    parser.add_argument("dest")
+    parser.add_argument("--sha256")
+    parser.add_argument("--size", type=int)
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--chunk-mb", type=int, default=32)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    downloader = ParallelDownloader(
+        url=args.url,
+        dest_path=args.dest,
+        expected_size=args.size,
+        expected_sha256=args.sha256,
+        workers=args.workers,
+        chunk_size=args.chunk_mb * 1024 * 1024
+    )
+    downloader.download()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,216 @@
+"""Batched sentence embeddings on top of the low-level llama.cpp batch API."""
+
+import base64
+import logging
+from typing import List, Iterator, Tuple
+
+import numpy as np
+
+from batch_decoder import KVCacheFullError
+
+logger = logging.getLogger(__name__)
+
+POOLING_MODES = ("mean", "last", "cls")
+ENCODINGS = ("float32", "float16")
+
+# Little-endian, whatever the machine, so clients can decode without guessing
+_DTYPES = {"float32": np.dtype("<f4"), "float16": np.dtype("<f2")}
+
+# (input index, first position, end position) of an input's tokens inside one batch
+Segment = Tuple[int, int, int]
+
+
+def normalize_rows(vectors: np.ndarray) -> np.ndarray:
+    """Scale every row to unit L2 norm, in place."""
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    vectors /= np.maximum(norms, 1e-12)
+    return vectors
+
+
+def encode_vectors(vectors: np.ndarray, encoding: str) -> List[str]:
+    """Base64 of every row's little-endian bytes."""
+    raw = np.ascontiguousarray(vectors, dtype=_DTYPES[encoding])
+    return [base64.b64encode(row.tobytes()).decode("ascii") for row in raw]
+
+
+class LlamaEmbedder:
+    """Pools the embeddings of many inputs evaluated in ``n_batch`` sized llama.cpp batches.
+
+    The embedder shares the context of an already loaded ``Llama`` instance
+    and switches it to embedding output while it runs. Inputs are laid out
+    back to back, one sequence each, and a batch is cut wherever it fills up,
+    so a single decode covers many short inputs and a long input continues
+    in the next batch on top of its KV cells.
+
+    Generative models have no pooling of their own: llama.cpp returns the
+    hidden state of every token that asks for output, and the rows are
+    pooled per input with NumPy segment reductions. Embedding models with a
+    pooling type in their GGUF are pooled by llama.cpp, which needs each
+    input within one micro-batch.
+    """
+
+    def __init__(self, model, max_batch_tokens: int = None):
+        # Import here to avoid issues if llama-cpp-python is not installed
+        import llama_cpp
+
+        self._llama_cpp = llama_cpp
+        self.model = model
+        self.ctx = model._ctx.ctx
+        self.n_embd = llama_cpp.llama_n_embd(model._model.model)
+        self.n_ctx = model.n_ctx()
+        self.native_pooling = llama_cpp.llama_pooling_type(self.ctx) != llama_cpp.LLAMA_POOLING_TYPE_NONE
+
+        n_batch = max_batch_tokens or model.n_batch
+        if self.native_pooling:
+            n_batch = min(n_batch, model.context_params.n_ubatch)
+        self.n_batch = n_batch
+        self._batch = llama_cpp.llama_batch_init(self.n_batch, 0, 1)
+
+        # NumPy views of the batch arrays, so filling them is a slice assignment
+        self._tokens = np.ctypeslib.as_array(self._batch.token, shape=(self.n_batch,))
+        self._positions = np.ctypeslib.as_array(self._batch.pos, shape=(self.n_batch,))
+        self._n_seq_ids = np.ctypeslib.as_array(self._batch.n_seq_id, shape=(self.n_batch,))
+        self._outputs = np.ctypeslib.as_array(self._batch.logits, shape=(self.n_batch,))
+
+    @property
+    def max_input_tokens(self) -> int:
+        """Longest input that can be embedded without truncation."""
+        return self.n_batch if self.native_pooling else self.n_ctx
+
+    def close(self):
+        """Release the native batch buffer."""
+        if self._batch is not None:
+            self._llama_cpp.llama_batch_free(self._batch)
+            self._batch = None
+
+    def embed(self, token_lists: List[List[int]], pooling: str = "mean") -> np.ndarray:
+        """Pooled, not yet normalized embeddings, one float32 row per token list.
+
+        Every list must hold between 1 and ``max_input_tokens`` tokens.
+        """
+        lengths = np.fromiter((len(tokens) for tokens in token_lists), dtype=np.int64, count=len(token_lists))
+        vectors = np.zeros((len(token_lists), self.n_embd), dtype=np.float32)
+
+        self._llama_cpp.llama_set_embeddings(self.ctx, True)
+        self._clear()
+        try:
+            for segments in self._pack(lengths):
+                self._decode(token_lists, segments, pooling)
+                self._collect(vectors, segments, lengths, pooling)
+                self._free(segments, lengths)
+        finally:
+            self._clear()
+            self._llama_cpp.llama_set_embeddings(self.ctx, False)
+
+        if pooling == "mean" and not self.native_pooling:
+            vectors /= lengths[:, None]
+        return vectors
+
+    def _pack(self, lengths: np.ndarray) -> Iterator[List[Segment]]:
+        """Lay the inputs out back to back and cut them into batches."""
+        segments: List[Segment] = []
+        used = 0
+        # An input continuing from the previous batch keeps its earlier KV cells
+        capacity = self.n_batch
+
+        for index, length in enumerate(lengths.tolist()):
+            if self.native_pooling and segments and used + length > capacity:
+                yield segments
+                segments, used = [], 0
+
+            start = 0
+            while start < length:
+                end = min(length, start + capacity - used)
+                segments.append((index, start, end))
+                used += end - start
+                start = end
+
+                if used == capacity:
+                    yield segments
+                    segments, used = [], 0
+                    carried = start if start < length else 0
+                    capacity = min(self.n_batch, self.n_ctx - carried)
+
+        if segments:
+            yield segments
+
+    def _decode(self, token_lists: List[List[int]], segments: List[Segment], pooling: str):
+        """Fill the batch with the segments and evaluate it."""
+        offset = 0
+        for local_id, (index, start, end) in enumerate(segments):
+            count = end - start
+            window = slice(offset, offset + count)
+            self._tokens[window] = token_lists[index][start:end]
+            self._positions[window] = np.arange(start, end)
+
+            if self.native_pooling or pooling == "mean":
+                self._outputs[window] = 1
+            else:
+                self._outputs[window] = 0
+                if pooling == "cls" and start == 0:
+                    self._outputs[offset] = 1
+                elif pooling == "last" and end == len(token_lists[index]):
+                    self._outputs[offset + count - 1] = 1
+
+            # llama.cpp pools by sequence ids that must be smaller than the batch
+            seq_id = local_id if self.native_pooling else index
+            for i in range(offset, offset + count):
+                self._batch.seq_id[i][0] = seq_id
+            offset += count
+
+        self._n_seq_ids[:offset] = 1
+        self._batch.n_tokens = offset
+
+        result = self._llama_cpp.llama_decode(self.ctx, self._batch)
+        if result == 1:
+            # Freed cells of earlier inputs can leave no contiguous slot; compact once and retry
+            self._llama_cpp.llama_kv_cache_defrag(self.ctx)
+            self._llama_cpp.llama_kv_cache_update(self.ctx)
+            result = self._llama_cpp.llama_decode(self.ctx, self._batch)
+            if result == 1:
+                raise KVCacheFullError("No KV cache slot available for embedding batch")
+        if result != 0:
+            raise RuntimeError(f"llama_decode failed with code {result}")
+
+    def _collect(self, vectors: np.ndarray, segments: List[Segment], lengths: np.ndarray, pooling: str):
+        """Add the batch's output rows to the pooled vectors of their inputs."""
+        indices = np.array([index for index, _, _ in segments], dtype=np.int64)
+        starts = np.array([start for _, start, _ in segments], dtype=np.int64)
+        ends = np.array([end for _, _, end in segments], dtype=np.int64)
+
+        if self.native_pooling:
+            vectors[indices] = np.stack([
+                np.ctypeslib.as_array(self._llama_cpp.llama_get_embeddings_seq(self.ctx, local_id), shape=(self.n_embd,))
+                for local_id in range(len(segments))
+            ])
+            return
+
+        if pooling == "mean":
+            rows = self._output_rows(int(np.sum(ends - starts)))
+            offsets = np.concatenate(([0], np.cumsum(ends - starts)[:-1]))
+            vectors[indices] += np.add.reduceat(rows, offsets, axis=0)
+            return
+
+        # One output row per input that starts (cls) or ends (last) in this batch
+        selected = starts == 0 if pooling == "cls" else ends == lengths[indices]
+        if np.any(selected):
+            vectors[indices[selected]] = self._output_rows(int(np.count_nonzero(selected)))
+
+    def _output_rows(self, n_outputs: int) -> np.ndarray:
+        pointer = self._llama_cpp.llama_get_embeddings(self.ctx)
+        return np.ctypeslib.as_array(pointer, shape=(n_outputs, self.n_embd))
+
+    def _free(self, segments: List[Segment], lengths: np.ndarray):
+        """Drop the KV cells of inputs that are complete."""
+        index, _, end = segments[-1]
+        if end == lengths[index]:
+            self._llama_cpp.llama_kv_cache_clear(self.ctx)
+            return
+
+        # Only the last input continues in the next batch
+        for local_id, (index, _, _) in enumerate(segments[:-1]):
+            self._llama_cpp.llama_kv_cache_seq_rm(self.ctx, local_id if self.native_pooling else index, -1, -1)
+
+    def _clear(self):
+        self._llama_cpp.llama_kv_cache_clear(self.ctx)
+        self.model.reset()
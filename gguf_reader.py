@@ -0,0 +1,215 @@
+"""Minimal reader for GGUF file headers (metadata and tensor directory)."""
+
+import mmap
+import struct
+from dataclasses import dataclass, field
+from typing import Dict, Any, List, Optional
+
+GGUF_MAGIC = b"GGUF"
+DEFAULT_ALIGNMENT = 32
+
+# GGUF metadata value types
+_SCALAR_FORMATS = {
+    0: "<B",   # uint8
+    1: "<b",   # int8
+    2: "<H",   # uint16
+    3: "<h",   # int16
+    4: "<I",   # uint32
+    5: "<i",   # int32
+    6: "<f",   # float32
+    7: "<?",   # bool
+    10: "<Q",  # uint64
+    11: "<q",  # int64
+    12: "<d",  # float64
+}
+_TYPE_STRING = 8
+_TYPE_ARRAY = 9
+
+# Block size and bytes per block for the ggml tensor types
+_GGML_TYPE_SIZES = {
+    0: (1, 4),      # F32
+    1: (1, 2),      # F16
+    2: (32, 18),    # Q4_0
+    3: (32, 20),    # Q4_1
+    6: (32, 22),    # Q5_0
+    7: (32, 24),    # Q5_1
+    8: (32, 34),    # Q8_0
+    9: (32, 36),    # Q8_1
+    10: (256, 84),  # Q2_K
+    11: (256, 110),  # Q3_K
+    12: (256, 144),  # Q4_K
+    13: (256, 176),  # Q5_K
+    14: (256, 210),  # Q6_K
+    15: (256, 292),  # Q8_K
+    16: (256, 66),  # IQ2_XXS
+    17: (256, 74),  # IQ2_XS
+    18: (256, 98),  # IQ3_XXS
+    19: (256, 50),  # IQ1_S
+    20: (32, 18),   # IQ4_NL
+    21: (256, 110),  # IQ3_S
+    22: (256, 82),  # IQ2_S
+    23: (256, 136),  # IQ4_XS
+    24: (1, 1),     # I8
+    25: (1, 2),     # I16
+    26: (1, 4),     # I32
+    27: (1, 8),     # I64
+    28: (1, 8),     # F64
+    29: (256, 56),  # IQ1_M
+    30: (1, 2),     # BF16
+}
+
+
+class GGUFError(ValueError):
+    """Raised for files that are not valid GGUF."""
+
+
+@dataclass
+class GGUFTensor:
+    """Entry of the GGUF tensor directory."""
+    name: str
+    shape: List[int]
+    ggml_type: int
+    offset: int  # Absolute file offset of the tensor data
+    size: int  # Bytes of tensor data
+
+
+@dataclass
+class GGUFInfo:
+    """Parsed GGUF header."""
+    version: int
+    tensor_count: int
+    kv_count: int
+    metadata: Dict[str, Any] = field(default_factory=dict)
+    tensors: List[GGUFTensor] = field(default_factory=list)
+    data_offset: int = 0
+
+    @property
+    def architecture(self) -> Optional[str]:
+        return self.metadata.get("general.architecture")
+
+    def arch_value(self, key: str, default=None):
+        """Read an architecture-scoped key such as ``<arch>.block_count``."""
+        return self.metadata.get(f"{self.architecture}.{key}", default)
+
+
+class _Cursor:
+    """Sequential reader over a memory-mapped buffer."""
+
+    def __init__(self, buffer, offset: int = 0):
+        self.buffer = buffer
+        self.offset = offset
+
+    def unpack(self, fmt: str):
+        value = struct.unpack_from(fmt, self.buffer, self.offset)[0]
+        self.offset += struct.calcsize(fmt)
+        return value
+
+    def string(self) -> str:
+        length = self.unpack("<Q")
+        value = bytes(self.buffer[self.offset:self.offset + length])
+        self.offset += length
+        return value.decode("utf-8", errors="replace")
+
+    def skip_string(self):
+        length = self.unpack("<Q")
+        self.offset += length
+
+    def value(self, value_type: int, max_array_items: int):
+        if value_type in _SCALAR_FORMATS:
+            return self.unpack(_SCALAR_FORMATS[value_type])
+        if value_type == _TYPE_STRING:
+            return self.string()
+        if value_type == _TYPE_ARRAY:
+            item_type = self.unpack("<I")
+            count = self.unpack("<Q")
+            if count <= max_array_items:
+                return [self.value(item_type, max_array_items) for _ in range(count)]
+            self.skip_array(item_type, count)
+            # Large arrays (vocabularies, merges) are summarised by their length
+            return {"array_length": count}
+        raise GGUFError(f"Unknown GGUF value type {value_type}")
+
+    def skip_array(self, item_type: int, count: int):
+        if item_type in _SCALAR_FORMATS:
+            self.offset += struct.calcsize(_SCALAR_FORMATS[item_type]) * count
+        elif item_type == _TYPE_STRING:
+            for _ in range(count):
+                self.skip_string()
+        else:
+            for _ in range(count):
+                self.value(item_type, 0)
+
+
+def _tensor_size(shape: List[int], ggml_type: int) -> int:
+    elements = 1
+    for dim in shape:
+        elements *= dim
+    block_size, type_size = _GGML_TYPE_SIZES.get(ggml_type, (1, 0))
+    return elements // block_size * type_size
+
+
+def read_gguf_info(path: str, max_array_items: int = 64, read_tensors: bool = True) -> GGUFInfo:
+    """Parse the header of a GGUF file without reading tensor data."""
+    with open(path, "rb") as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+            if buffer[:4] != GGUF_MAGIC:
+                raise GGUFError(f"{path} is not a GGUF file")
+
+            cursor = _Cursor(buffer, 4)
+            version = cursor.unpack("<I")
+            if version < 2:
+                raise GGUFError(f"Unsupported GGUF version {version}")
+
+            info = GGUFInfo(
+                version=version,
+                tensor_count=cursor.unpack("<Q"),
+                kv_count=cursor.unpack("<Q")
+            )
+
+            for _ in range(info.kv_count):
+                key = cursor.string()
+                value_type = cursor.unpack("<I")
+                info.metadata[key] = cursor.value(value_type, max_array_items)
+
+            if not read_tensors:
+                return info
+
+            raw_tensors = []
+            for _ in range(info.tensor_count):
+                name = cursor.string()
+                n_dims = cursor.unpack("<I")
+                shape = [cursor.unpack("<Q") for _ in range(n_dims)]
+                ggml_type = cursor.unpack("<I")
+                relative_offset = cursor.unpack("<Q")
+                raw_tensors.append((name, shape, ggml_type, relative_offset))
+
+            alignment = int(info.metadata.get("general.alignment", DEFAULT_ALIGNMENT))
+            info.data_offset = (cursor.offset + alignment - 1) // alignment * alignment
+
+            for name, shape, ggml_type, relative_offset in raw_tensors:
+                info.tensors.append(GGUFTensor(
+                    name=name,
+                    shape=shape,
+                    ggml_type=ggml_type,
+                    offset=info.data_offset + relative_offset,
+                    size=_tensor_size(shape, ggml_type)
+                ))
+
+            return info
+
+
+def summarize_gguf(info: GGUFInfo) -> Dict[str, Any]:
+    """Key header fields worth recording alongside a cached model."""
+    return {
+        "version": info.version,
+        "tensor_count": info.tensor_count,
+        "kv_count": info.kv_count,
+        "architecture": info.architecture,
+        "name": info.metadata.get("general.name"),
+        "file_type": info.metadata.get("general.file_type"),
+        "context_length": info.arch_value("context_length"),
+        "block_count": info.arch_value("block_count"),
+        "embedding_length": info.arch_value("embedding_length"),
+        "expert_count": info.arch_value("expert_count"),
+        "data_offset": info.data_offset
+    }
@@ -0,0 +1,129 @@
+"""Compiled grammars for constrained generation (JSON schema or GBNF)."""
+
+import hashlib
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Any, Optional, Union
+
+from config import config
+
+logger = logging.getLogger(__name__)
+
+
+def schema_text(json_schema: Union[str, Dict[str, Any]]) -> str:
+    """JSON text of a schema given as an object or a string.
+
+    Keys keep their order: the grammar generates properties in the order the
+    schema lists them.
+    """
+    if isinstance(json_schema, str):
+        return json_schema
+    return json.dumps(json_schema, separators=(",", ":"), ensure_ascii=False)
+
+
+def grammar_key(json_schema: Optional[str] = None, grammar: Optional[str] = None) -> str:
+    """Hash identifying a schema or a GBNF grammar."""
+    kind, text = ("schema", json_schema) if json_schema is not None else ("gbnf", grammar)
+    return hashlib.sha256(f"{kind}\0{text}".encode("utf-8")).hexdigest()
+
+
+class GrammarCache:
+    """LRU cache of parsed grammars keyed by the hash of their source.
+
+    Turning a JSON schema into GBNF and parsing it takes long enough to show
+    up in every request's latency, while clients tend to send the same few
+    schemas over and over. Parsed grammars do not depend on the model, so one
+    cache serves the whole pool. A ``LlamaGrammar`` holds native parser state
+    that generation resets and advances, so every caller gets its own, built
+    from the cached parse, which is cheap.
+    """
+
+    def __init__(self, max_entries: int = 64):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, Any]" = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.stats = {
+            "hits": 0,
+            "misses": 0,
+            "errors": 0,
+            "evictions": 0,
+            "compile_ms_total": 0.0,
+            "last_compile_ms": None
+        }
+
+    def get(self, json_schema: Optional[str] = None, grammar: Optional[str] = None):
+        """A new ``LlamaGrammar`` for a JSON schema text or a GBNF grammar, parsing it on a miss.
+
+        Raises ValueError when the source does not compile.
+        """
+        # Import here to avoid issues if llama-cpp-python is not installed
+        from llama_cpp import LlamaGrammar
+
+        return LlamaGrammar(self.get_parsed(json_schema, grammar))
+
+    def get_parsed(self, json_schema: Optional[str] = None, grammar: Optional[str] = None):
+        """Parsed grammar for a JSON schema text or a GBNF grammar, compiling it on a miss."""
+        key = grammar_key(json_schema, grammar)
+
+        with self._lock:
+            compiled = self._entries.get(key)
+            if compiled is not None:
+                self._entries.move_to_end(key)
+                self.stats["hits"] += 1
+                return compiled
+            self.stats["misses"] += 1
+
+        # Compiled outside the lock; two requests racing for a new schema both compile it
+        start_time = time.perf_counter()
+        try:
+            compiled = self._compile(json_schema, grammar)
+        except Exception as e:
+            with self._lock:
+                self.stats["errors"] += 1
+            kind = "JSON schema" if json_schema is not None else "grammar"
+            raise ValueError(f"Invalid {kind}: {e}") from e
+        compile_ms = (time.perf_counter() - start_time) * 1000
+
+        with self._lock:
+            self.stats["compile_ms_total"] += compile_ms
+            self.stats["last_compile_ms"] = round(compile_ms, 3)
+            self._entries[key] = compiled
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.stats["evictions"] += 1
+
+        logger.info(f"Compiled {'JSON schema' if json_schema is not None else 'grammar'} in {compile_ms:.1f}ms")
+        return compiled
+
+    def _compile(self, json_schema: Optional[str], grammar: Optional[str]):
+        # Import here to avoid issues if llama-cpp-python is not installed
+        from llama_cpp import LlamaGrammar
+        from llama_cpp.llama_grammar import json_schema_to_gbnf, parse
+
+        parse_state = parse(json_schema_to_gbnf(json_schema) if json_schema is not None else grammar)
+        # Building one checks that llama.cpp accepts the rules
+        LlamaGrammar(parse_state)
+        return parse_state
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get hit rate and compile time counters."""
+        with self._lock:
+            lookups = self.stats["hits"] + self.stats["misses"]
+            compiled = self.stats["misses"] - self.stats["errors"]
+            return {
+                **self.stats,
+                "compile_ms_total": round(self.stats["compile_ms_total"], 3),
+                "mean_compile_ms": round(self.stats["compile_ms_total"] / compiled, 3) if compiled else None,
+                "hit_rate": round(self.stats["hits"] / lookups, 4) if lookups else None,
+                "entries": len(self._entries),
+                "max_entries": self.max_entries
+            }
+
+
+# Global grammar cache
+grammar_cache = GrammarCache(max_entries=config.grammar.max_entries)
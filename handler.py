@@ -1,14 +1,30 @@
 """LLM Worker Handler for RunPod Serverless."""
 
+import argparse
+import asyncio
+import importlib
+import json
 import logging
+import sys
 import time
+from dataclasses import replace
 from typing import Dict, Any, Optional
 
-import runpod
+from startup_profiler import StartupProfiler
 
-from config import config
-from model_manager import ModelManager
-from inference_engine import InferenceEngine
+# Created first so that the report also covers configuration and imports
+startup_profiler = StartupProfiler()
+
+with startup_profiler.phase("load_config"):
+    from config import config
+
+with startup_profiler.phase("import_modules"):
+    from model_pool import ModelPool
+    from session_store import is_valid_session_id
+    from metrics import JobTimer, metrics, serve_metrics
+    from cache_eviction import get_cache_evictor
+    from grammar_cache import grammar_cache
+    from admission import PRIORITY_CLASSES, concurrency_target, estimate_tokens
 
 # Configure logging
 logging.basicConfig(
@@ -17,40 +33,33 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-# Global variables for model and inference engine
-model_manager = None
-inference_engine = None
+# Global variables for the model pool
+model_pool = None
 model_loaded = False
 
 
 def initialize_model():
-    """Initialize the model and inference engine."""
-    global model_manager, inference_engine, model_loaded
+    """Initialize the model pool and load the default model."""
+    global model_pool, model_loaded
     
     try:
         logger.info("Initializing model...")
         start_time = time.time()
         
-        # Initialize model manager
-        model_manager = ModelManager()
-        
-        # Ensure model is available (download if necessary)
-        if not model_manager.ensure_model_available():
-            raise RuntimeError("Failed to ensure model availability")
+        # Each resident model gets its own inference engine and request scheduler
+        with startup_profiler.phase("init_pool"):
+            model_pool = ModelPool()
         
-        # Load the model
-        model = model_manager.load_model()
-        
-        # Initialize inference engine
-        inference_engine = InferenceEngine(model)
+        # Load the default model (download if necessary); others load on first use
+        default_model = model_pool.load(config.model_name, profiler=startup_profiler)
         
         model_loaded = True
+        startup_profiler.finish()
         init_time = time.time() - start_time
         logger.info(f"Model initialized successfully in {init_time:.2f} seconds")
+        startup_profiler.log_report()
         
-        # Log cache status
-        cache_status = model_manager.get_cache_status()
-        logger.info(f"Cache status: {cache_status}")
+        logger.info(f"Cache status: {default_model.manager.get_cache_status()}")
         
     except Exception as e:
         logger.error(f"Failed to initialize model: {e}")
@@ -58,87 +67,645 @@ def initialize_model():
         raise
 
 
-def handler(job):
-    """Handler function that will be used to process jobs."""
-    global inference_engine, model_loaded
+def is_integer(value) -> bool:
+    """True for JSON integers; ``bool`` is a subclass of ``int`` but ``true`` is not a count."""
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+async def handler(job):
+    """Handler function that will be used to process jobs.
+    
+    This is an async generator: streaming requests yield one chunk per decoded
+    delta, everything else yields a single response. Jobs are queued on the
+    request scheduler of the model they name (``model``, default model if
+    omitted), so several of them can be in flight at once. A job with an
+    ``inputs`` list runs every item and returns all results at once. A job
+    with ``embed`` returns embeddings of its texts instead of generating. A job
+    with ``n`` or ``best_of`` above 1 returns several completions of its
+    prompt, which is evaluated only once. Queued
+    jobs are ranked by expected cost and their ``priority`` class. A job
+    with ``metrics`` returns the worker's latency metrics instead, as JSON or,
+    with ``"metrics": "prometheus"``, in the Prometheus text format.
+    """
+    global model_pool, model_loaded
     
     try:
         # Ensure model is loaded
-        if not model_loaded or inference_engine is None:
-            return {
+        if not model_loaded or model_pool is None:
+            yield {
                 "error": "Model not loaded",
                 "status": "error"
             }
+            return
         
         job_input = job["input"]
         logger.info(f"Processing job with input keys: {list(job_input.keys())}")
         
+        if job_input.get("metrics"):
+            yield metrics_response(job_input["metrics"])
+            return
+        
         # Extract input parameters
         prompt = job_input.get("prompt")
         messages = job_input.get("messages")
+        inputs = job_input.get("inputs")
+        embed = job_input.get("embed")
         
-        if not prompt and not messages:
-            return {
-                "error": "Either 'prompt' or 'messages' must be provided",
+        if not prompt and not messages and inputs is None and embed is None:
+            yield {
+                "error": "Either 'prompt', 'messages', 'inputs' or 'embed' must be provided",
                 "status": "error"
             }
+            return
         
-        # Validate and extract inference parameters
-        inference_params = inference_engine.validate_params(job_input)
+        if embed is not None:
+            texts = [embed] if isinstance(embed, str) else embed
+            if not isinstance(texts, list) or not texts or not all(isinstance(text, str) and text for text in texts):
+                yield {
+                    "error": "'embed' must be a non-empty string or a non-empty list of non-empty strings",
+                    "status": "error"
+                }
+                return
+            
+            if len(texts) > config.embedding.max_inputs:
+                yield {
+                    "error": f"'embed' may contain at most {config.embedding.max_inputs} texts",
+                    "status": "error"
+                }
+                return
         
-        # Generate response
-        start_time = time.time()
+        if inputs is not None:
+            if not isinstance(inputs, list) or not inputs:
+                yield {
+                    "error": "'inputs' must be a non-empty list",
+                    "status": "error"
+                }
+                return
+            
+            if len(inputs) > config.scheduler.max_batch_inputs:
+                yield {
+                    "error": f"'inputs' may contain at most {config.scheduler.max_batch_inputs} items",
+                    "status": "error"
+                }
+                return
+            
+            if job_input.get("session_id") is not None:
+                yield {
+                    "error": "'session_id' cannot be used with 'inputs'",
+                    "status": "error"
+                }
+                return
         
-        if messages:
-            # Chat completion mode
-            result = inference_engine.chat_completion(messages, inference_params)
-        else:
-            # Text completion mode
-            result = inference_engine.generate(prompt, inference_params)
+        session_id = job_input.get("session_id")
+        if session_id is not None and not is_valid_session_id(str(session_id)):
+            yield {
+                "error": "'session_id' may only contain letters, digits, '.', '_' and '-' (max 128 characters)",
+                "status": "error"
+            }
+            return
         
-        generation_time = time.time() - start_time
+        if job_input.get("json_schema") is not None and job_input.get("grammar") is not None:
+            yield {
+                "error": "Only one of 'json_schema' and 'grammar' may be given",
+                "status": "error"
+            }
+            return
         
-        if result["success"]:
-            response = {
-                "generated_text": result["generated_text"],
-                "usage": result["usage"],
-                "finish_reason": result.get("finish_reason", "stop"),
-                "generation_time": round(generation_time, 3),
-                "status": "success"
+        if job_input.get("priority") is not None and job_input["priority"] not in PRIORITY_CLASSES:
+            yield {
+                "error": f"'priority' must be one of: {', '.join(PRIORITY_CLASSES)}",
+                "status": "error"
             }
-            
-            logger.info(f"Generated {result['usage'].get('completion_tokens', 0)} tokens in {generation_time:.3f}s")
-            return response
-        else:
-            return {
-                "error": result["error"],
+            return
+        
+        samples = job_input.get("n", 1)
+        best_of = job_input.get("best_of", samples)
+        if not is_integer(samples) or not is_integer(best_of) or not 1 <= samples <= best_of <= config.inference.max_samples:
+            yield {
+                "error": f"'n' and 'best_of' must be integers with 1 <= n <= best_of <= {config.inference.max_samples}",
                 "status": "error"
             }
+            return
+        
+        if best_of > 1 and (inputs is not None or embed is not None or job_input.get("stream") or session_id is not None):
+            yield {
+                "error": "'n' and 'best_of' cannot be used with 'inputs', 'embed', 'stream' or 'session_id'",
+                "status": "error"
+            }
+            return
+        
+        model_name = job_input.get("model") or config.model_name
+        if not model_pool.has_model(model_name):
+            yield {
+                "error": f"Unknown model '{model_name}'. Available models: {', '.join(sorted(config.models))}",
+                "status": "error"
+            }
+            return
+        
+        # Waits only if the model has to be loaded first
+        pooled_model = await model_pool.acquire(model_name)
+        try:
+            if embed is not None:
+                yield await run_embed_job(pooled_model.engine, pooled_model.scheduler, job_input, texts, model_name)
+            elif inputs is not None:
+                yield await run_batch_job(pooled_model.engine, pooled_model.scheduler, job_input, inputs, model_name)
+            elif best_of > 1:
+                yield await run_samples_job(
+                    pooled_model.engine, pooled_model.scheduler, job_input, prompt, messages, samples, best_of, model_name
+                )
+            else:
+                async for response in run_job(pooled_model.engine, pooled_model.scheduler, job_input, prompt, messages, model_name):
+                    yield response
+        finally:
+            model_pool.release(pooled_model)
             
     except Exception as e:
         logger.error(f"Error in handler: {e}")
-        return {
+        yield {
             "error": str(e),
             "status": "error"
         }
 
 
+async def run_job(inference_engine, request_scheduler, job_input: Dict[str, Any], prompt, messages, model_name: str):
+    """Run a validated job on one model of the pool."""
+    job_timer = metrics.start_job(model_name)
+    
+    # Validate and extract inference parameters
+    inference_params = inference_engine.validate_params(job_input)
+    
+    # Generate response
+    start_time = time.time()
+    
+    # Chat histories are rendered to tokens, dropping what does not fit in the context window
+    context_usage = {}
+    if messages:
+        formatted_prompt, context_usage = inference_engine.encode_chat(messages, inference_params)
+    else:
+        formatted_prompt = inference_engine.build_prompt(prompt=prompt)
+    
+    # Deterministic requests may already have a memoized result
+    cache_key = inference_engine.response_cache_key(formatted_prompt, inference_params)
+    cached_result = inference_engine.get_cached_response(cache_key)
+    if cached_result is not None:
+        response = cached_response(cached_result, inference_params, start_time)
+        response["usage"] = {**response["usage"], **context_usage}
+        job_timer.cached()
+        yield response
+        return
+    
+    request_handle = request_scheduler.submit(
+        inference_params,
+        prompt=formatted_prompt,
+        loop=asyncio.get_running_loop()
+    )
+    job_timer.mark_submitted()
+    
+    try:
+        if inference_params.stream:
+            async for chunk in stream_response(inference_engine, request_handle, start_time, cache_key, job_timer):
+                if chunk.get("finish_reason") is not None:
+                    # The cached copy shares this usage dict, so replace rather than update it
+                    chunk["usage"] = {**chunk["usage"], **context_usage}
+                    if inference_params.session_id:
+                        chunk["session_id"] = inference_params.session_id
+                yield chunk
+        else:
+            response = await collect_response(inference_engine, request_handle, start_time, cache_key, job_timer)
+            if response["status"] == "success":
+                response["usage"] = {**response["usage"], **context_usage}
+                if inference_params.session_id:
+                    response["session_id"] = inference_params.session_id
+            yield response
+    except asyncio.CancelledError:
+        # The model stops at its next decode step; the partial result is only recorded
+        request_handle.cancel(on_final=job_timer.settle)
+        raise
+
+
+def prepare_batch_item(inference_engine, shared_params: Dict[str, Any], item):
+    """Validate one item of an ``inputs`` job and build its parameters and prompt."""
+    if isinstance(item, str):
+        item = {"prompt": item}
+    
+    if not isinstance(item, dict) or not (item.get("prompt") or item.get("messages")):
+        raise ValueError("Each input must be a prompt string or an object with 'prompt' or 'messages'")
+    
+    if item.get("session_id") is not None:
+        raise ValueError("'session_id' cannot be used with 'inputs'")
+    
+    # Item fields override the job-level parameters; results are always returned whole
+    overrides = {key: value for key, value in item.items() if key not in ("prompt", "messages")}
+    inference_params = inference_engine.validate_params({**shared_params, **overrides, "stream": False})
+    
+    if item.get("messages"):
+        formatted_prompt, context_usage = inference_engine.encode_chat(item["messages"], inference_params)
+    else:
+        formatted_prompt, context_usage = inference_engine.build_prompt(prompt=item["prompt"]), {}
+    
+    return inference_params, formatted_prompt, context_usage
+
+
+async def run_batch_job(inference_engine, request_scheduler, job_input: Dict[str, Any], inputs, model_name: str) -> Dict[str, Any]:
+    """Run every item of an ``inputs`` job and return the results in their original order.
+    
+    The items are queued on the scheduler together, so they decode side by
+    side and items with a common prompt prefix reuse each other's KV cells.
+    An item that fails does not fail the job; its result carries the error.
+    """
+    start_time = time.time()
+    # Every item is timed from the start of the job
+    batch_start = time.perf_counter()
+    shared_params = {key: value for key, value in job_input.items() if key not in ("inputs", "model", "prompt", "messages")}
+    
+    results = [None] * len(inputs)
+    submitted = []
+    
+    for index, item in enumerate(inputs):
+        try:
+            inference_params, formatted_prompt, context_usage = prepare_batch_item(inference_engine, shared_params, item)
+        except Exception as e:
+            results[index] = {"error": str(e), "status": "error"}
+            continue
+        
+        cache_key = inference_engine.response_cache_key(formatted_prompt, inference_params)
+        cached_result = inference_engine.get_cached_response(cache_key)
+        if cached_result is not None:
+            response = cached_response(cached_result, inference_params, start_time)
+            response["usage"] = {**response["usage"], **context_usage}
+            results[index] = response
+            metrics.start_job(model_name, batch_start).cached()
+            continue
+        
+        submitted.append((index, inference_params, formatted_prompt, cache_key, context_usage))
+    
+    handles = request_scheduler.submit_batch(
+        [(inference_params, formatted_prompt) for _, inference_params, formatted_prompt, _, _ in submitted],
+        loop=asyncio.get_running_loop()
+    )
+    submitted_time = time.perf_counter()
+    
+    job_timers = []
+    for _ in submitted:
+        job_timer = metrics.start_job(model_name, batch_start)
+        job_timer.mark_submitted(submitted_time)
+        job_timers.append(job_timer)
+    
+    try:
+        responses = await asyncio.gather(*(
+            collect_response(inference_engine, handle, start_time, cache_key, job_timer)
+            for handle, (_, _, _, cache_key, _), job_timer in zip(handles, submitted, job_timers)
+        ))
+    except asyncio.CancelledError:
+        for handle, job_timer in zip(handles, job_timers):
+            handle.cancel(on_final=job_timer.settle)
+        raise
+    
+    for (index, _, _, _, context_usage), response in zip(submitted, responses):
+        if response["status"] == "success":
+            response["usage"] = {**response["usage"], **context_usage}
+        results[index] = response
+    
+    usage = {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0}
+    for result in results:
+        if result["status"] == "success":
+            for key in usage:
+                usage[key] += result["usage"].get(key, 0)
+    
+    failed = sum(1 for result in results if result["status"] != "success")
+    generation_time = time.time() - start_time
+    logger.info(
+        f"Batch job: {len(inputs)} items ({failed} failed), "
+        f"{usage['completion_tokens']} tokens in {generation_time:.3f}s"
+    )
+    
+    return {
+        "results": [{"index": index, **result} for index, result in enumerate(results)],
+        "usage": usage,
+        "succeeded": len(results) - failed,
+        "failed": failed,
+        "generation_time": round(generation_time, 3),
+        "status": "success"
+    }
+
+
+async def run_samples_job(
+    inference_engine,
+    request_scheduler,
+    job_input: Dict[str, Any],
+    prompt,
+    messages,
+    samples: int,
+    best_of: int,
+    model_name: str
+) -> Dict[str, Any]:
+    """Generate ``best_of`` completions of one prompt and return ``samples`` of them.
+    
+    The prompt is evaluated once; the other completions start from its KV
+    cells and differ only in their seeds. With ``best_of`` above ``samples``
+    the completions with the highest cumulative logprob are returned.
+    """
+    start_time = time.time()
+    # Every sample is timed from the start of the job
+    job_start = time.perf_counter()
+    
+    inference_params = inference_engine.validate_params({**job_input, "stream": False})
+    if best_of > samples:
+        inference_params = replace(inference_params, logprobs=True)
+    
+    context_usage = {}
+    if messages:
+        formatted_prompt, context_usage = inference_engine.encode_chat(messages, inference_params)
+    else:
+        formatted_prompt = inference_engine.build_prompt(prompt=prompt)
+    
+    # A given seed is shifted per sample, so the completions stay reproducible but differ
+    sample_params = [
+        replace(inference_params, seed=inference_params.seed + index if inference_params.seed is not None else None)
+        for index in range(best_of)
+    ]
+    handles = request_scheduler.submit_samples(sample_params, formatted_prompt, loop=asyncio.get_running_loop())
+    submitted_time = time.perf_counter()
+    
+    job_timers = []
+    for _ in handles:
+        job_timer = metrics.start_job(model_name, job_start)
+        job_timer.mark_submitted(submitted_time)
+        job_timers.append(job_timer)
+    
+    try:
+        responses = await asyncio.gather(*(
+            collect_response(inference_engine, handle, start_time, None, job_timer)
+            for handle, job_timer in zip(handles, job_timers)
+        ))
+    except asyncio.CancelledError:
+        for handle, job_timer in zip(handles, job_timers):
+            handle.cancel(on_final=job_timer.settle)
+        raise
+    
+    succeeded = [response for response in responses if response["status"] == "success"]
+    if not succeeded:
+        return responses[0]
+    
+    usage = {
+        "prompt_tokens": succeeded[0]["usage"].get("prompt_tokens", 0),
+        "completion_tokens": sum(response["usage"].get("completion_tokens", 0) for response in succeeded),
+        "prefill_tokens_saved": sum(response["usage"].get("prefill_tokens_saved", 0) for response in succeeded)
+    }
+    usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+    usage.update(context_usage)
+    
+    if best_of > samples:
+        succeeded.sort(key=lambda response: response.get("cumulative_logprob", float("-inf")), reverse=True)
+    
+    choices = []
+    for index, response in enumerate(succeeded[:samples]):
+        choice = {
+            "index": index,
+            "generated_text": response["generated_text"],
+            "finish_reason": response["finish_reason"],
+            "completion_tokens": response["usage"].get("completion_tokens", 0)
+        }
+        if "cumulative_logprob" in response:
+            choice["cumulative_logprob"] = response["cumulative_logprob"]
+        choices.append(choice)
+    
+    generation_time = time.time() - start_time
+    logger.info(
+        f"Sampled {len(succeeded)}/{best_of} completions ({usage['completion_tokens']} tokens, "
+        f"{usage['prefill_tokens_saved']} prefill tokens saved) in {generation_time:.3f}s"
+    )
+    
+    return {
+        "choices": choices,
+        "usage": usage,
+        "best_of": best_of,
+        "failed": best_of - len(succeeded),
+        "generation_time": round(generation_time, 3),
+        "status": "success"
+    }
+
+
+async def run_embed_job(inference_engine, request_scheduler, job_input: Dict[str, Any], texts, model_name: str) -> Dict[str, Any]:
+    """Embed the texts of an ``embed`` job; the model runs it exclusively, in packed batches."""
+    job_timer = metrics.start_job(model_name)
+    start_time = time.time()
+    options = {key: job_input.get(key) for key in ("pooling", "normalize", "encoding")}
+    
+    request_handle = request_scheduler.submit_exclusive(
+        lambda: inference_engine.run_embedding(texts, **options),
+        loop=asyncio.get_running_loop(),
+        prompt_tokens=sum(estimate_tokens(text) for text in texts),
+        priority=job_input.get("priority")
+    )
+    job_timer.mark_submitted()
+    
+    final_chunk = None
+    try:
+        async for chunk in request_handle:
+            final_chunk = chunk
+    except asyncio.CancelledError:
+        # The model stops at its next decode step; the partial result is only recorded
+        request_handle.cancel(on_final=job_timer.settle)
+        raise
+    received_time = time.perf_counter()
+    
+    if final_chunk is None or final_chunk["finish_reason"] == "error":
+        job_timer.fail()
+        return {
+            "error": final_chunk.get("error", "Embedding failed") if final_chunk else "Embedding produced no result",
+            "status": "error"
+        }
+    
+    generation_time = time.time() - start_time
+    logger.info(
+        f"Embedded {len(texts)} texts ({final_chunk['usage']['prompt_tokens']} tokens) in {generation_time:.3f}s"
+    )
+    job_timer.finish(final_chunk, received_time)
+    
+    response = {key: value for key, value in final_chunk.items() if key not in ("text", "token_ids", "finish_reason")}
+    response["generation_time"] = round(generation_time, 3)
+    response["status"] = "success"
+    return response
+
+
+def cached_response(result: Dict[str, Any], inference_params, start_time: float) -> Dict[str, Any]:
+    """Build the response for a memoized result."""
+    generation_time = time.time() - start_time
+    logger.info(f"Served memoized response in {generation_time * 1e6:.0f}us")
+    
+    if inference_params.stream:
+        return {
+            "text": result["generated_text"],
+            "token_ids": [],
+            "finish_reason": result["finish_reason"],
+            "usage": result["usage"],
+            "generation_time": round(generation_time, 6),
+            "cached": True,
+            "status": "success"
+        }
+    
+    return {
+        "generated_text": result["generated_text"],
+        "usage": result["usage"],
+        "finish_reason": result["finish_reason"],
+        "generation_time": round(generation_time, 6),
+        "cached": True,
+        "status": "success"
+    }
+
+
+async def stream_response(inference_engine, request_handle, start_time: float, cache_key: Optional[str] = None, job_timer: Optional[JobTimer] = None):
+    """Yield streamed chunks for a job, ending with a chunk that carries usage and timings."""
+    text_parts = []
+    
+    async for chunk in request_handle:
+        text_parts.append(chunk["text"])
+        if chunk["finish_reason"] is None:
+            yield chunk
+            continue
+        
+        received_time = time.perf_counter()
+        if chunk["finish_reason"] == "error":
+            if job_timer is not None:
+                job_timer.fail()
+            yield {
+                "error": chunk.get("error", "Generation failed"),
+                "status": "error"
+            }
+            continue
+        
+        generation_time = time.time() - start_time
+        chunk["generation_time"] = round(generation_time, 3)
+        chunk["cached"] = False
+        chunk["status"] = "success"
+        
+        inference_engine.store_cached_response(cache_key, {
+            "generated_text": "".join(text_parts),
+            "usage": chunk["usage"],
+            "finish_reason": chunk["finish_reason"]
+        })
+        
+        logger.info(
+            f"Streamed {chunk['usage'].get('completion_tokens', 0)} tokens in {generation_time:.3f}s "
+            f"(ttft {chunk.get('timings', {}).get('ttft_ms')} ms)"
+        )
+        if job_timer is not None:
+            job_timer.finish(chunk, received_time)
+        yield chunk
+
+
+async def collect_response(
+    inference_engine,
+    request_handle,
+    start_time: float,
+    cache_key: Optional[str] = None,
+    job_timer: Optional[JobTimer] = None
+) -> Dict[str, Any]:
+    """Aggregate the chunks of a job into a single response."""
+    text_parts = []
+    final_chunk = None
+    received_time = None
+    
+    async for chunk in request_handle:
+        text_parts.append(chunk["text"])
+        if chunk["finish_reason"] is not None:
+            final_chunk = chunk
+            received_time = time.perf_counter()
+    
+    if final_chunk is None or final_chunk["finish_reason"] == "error":
+        if job_timer is not None:
+            job_timer.fail()
+        return {
+            "error": final_chunk.get("error", "Generation failed") if final_chunk else "Generation produced no result",
+            "status": "error"
+        }
+    
+    generation_time = time.time() - start_time
+    response = {
+        "generated_text": "".join(text_parts),
+        "usage": final_chunk.get("usage", {}),
+        "finish_reason": final_chunk["finish_reason"],
+        "generation_time": round(generation_time, 3),
+        "timings": final_chunk.get("timings", {}),
+        "cached": False,
+        "status": "success"
+    }
+    if "cumulative_logprob" in final_chunk:
+        response["cumulative_logprob"] = final_chunk["cumulative_logprob"]
+    
+    inference_engine.store_cached_response(cache_key, {
+        "generated_text": response["generated_text"],
+        "usage": response["usage"],
+        "finish_reason": response["finish_reason"]
+    })
+    
+    logger.info(f"Generated {response['usage'].get('completion_tokens', 0)} tokens in {generation_time:.3f}s")
+    if job_timer is not None:
+        job_timer.finish(final_chunk, received_time)
+    return response
+
+
+def metrics_response(output_format) -> Dict[str, Any]:
+    """Latency metrics of every model, as JSON or as Prometheus text."""
+    if output_format == "prometheus":
+        return {
+            "metrics": metrics.prometheus_text(),
+            "content_type": "text/plain; version=0.0.4",
+            "status": "success"
+        }
+    
+    return {
+        "metrics": metrics.snapshot(),
+        "status": "success"
+    }
+
+
+def concurrency_modifier(current_concurrency: int) -> int:
+    """Tell RunPod how many jobs this worker may run at once.
+    
+    With a latency SLO set, the worker takes no new jobs while the work
+    queued on its busiest model is expected to wait longer than the SLO.
+    """
+    if model_pool is None or not config.scheduler.latency_slo_ms:
+        return config.scheduler.max_concurrency
+    
+    in_flight, expected_wait = model_pool.get_load()
+    return concurrency_target(
+        config.scheduler.max_concurrency, in_flight, expected_wait, config.scheduler.latency_slo_ms / 1000
+    )
+
+
 def health_check():
     """Health check endpoint."""
-    global model_loaded, model_manager, inference_engine
+    global model_loaded, model_pool
     
     try:
         status = {
             "status": "healthy" if model_loaded else "unhealthy",
             "model_loaded": model_loaded,
-            "timestamp": time.time()
+            "timestamp": time.time(),
+            "startup": startup_profiler.report()
         }
         
-        if model_manager:
-            status["cache_status"] = model_manager.get_cache_status()
-        
-        if inference_engine:
-            status["model_info"] = inference_engine.get_model_info()
+        if model_pool:
+            status["model_pool"] = model_pool.get_stats()
+            
+            # Detailed status of the default model, which is not unloaded while it is read
+            with model_pool.borrow(config.model_name) as default_model:
+                if default_model:
+                    status["cache_status"] = default_model.manager.get_cache_status()
+                    status["model_info"] = default_model.engine.get_model_info()
+                    status["prefix_cache"] = default_model.engine.get_prefix_cache_stats()
+                    status["sessions"] = default_model.engine.get_session_stats()
+                    status["response_cache"] = default_model.engine.get_response_cache_stats()
+                    status["context"] = default_model.engine.get_context_stats()
+                    status["speculative"] = default_model.engine.get_speculative_stats()
+                    status["scheduler"] = default_model.scheduler.get_stats()
+            
+            status["cache_eviction"] = get_cache_evictor().get_stats()
+            status["grammar_cache"] = grammar_cache.get_stats()
+            status["metrics"] = metrics.snapshot()
         
         return status
         
@@ -150,16 +717,48 @@ def health_check():
         }
 
 
-# Initialize model on startup
-try:
-    initialize_model()
-except Exception as e:
-    logger.error(f"Failed to initialize on startup: {e}")
-    # Continue anyway, handler will return error
+def main():
+    """Initialize the model and start the serverless worker."""
+    parser = argparse.ArgumentParser(description="LLM worker for RunPod Serverless")
+    parser.add_argument(
+        "--profile-startup",
+        action="store_true",
+        help="Initialize, print the startup timing breakdown as JSON and exit"
+    )
+    # RunPod parses its own flags (e.g. --rp_serve_api) from the same command line
+    args, _ = parser.parse_known_args()
+    
+    if args.profile_startup:
+        try:
+            initialize_model()
+        except Exception:
+            pass  # Already logged, the report shows the failed phase
+        startup_profiler.wait_for_background()
+        print(json.dumps(startup_profiler.report(), indent=2))
+        sys.exit(0 if model_loaded else 1)
+    
+    # The RunPod SDK is slow to import and not needed until the model is ready
+    runpod_import = startup_profiler.background("import_runpod", importlib.import_module, "runpod")
+    
+    # Scrapable while the model is still loading
+    if config.metrics.port:
+        serve_metrics(config.metrics.port)
+    
+    # Initialize model on startup
+    try:
+        initialize_model()
+    except Exception as e:
+        logger.error(f"Failed to initialize on startup: {e}")
+        # Continue anyway, handler will return error
+    
+    # Start the serverless worker
+    runpod = startup_profiler.wait(runpod_import)
+    runpod.serverless.start({
+        "handler": handler,
+        "concurrency_modifier": concurrency_modifier,
+        "return_aggregate_stream": True
+    })
 
 
-# Start the serverless worker
-runpod.serverless.start({
-    "handler": handler,
-    "return_aggregate_stream": True
-})
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,21 @@
 """Inference engine for LLM text generation."""
 
 import logging
-from typing import Dict, Any, Optional, List
+import time
+from contextlib import contextmanager
+from typing import Dict, Any, Optional, List, Iterator, Tuple, Union
 from dataclasses import dataclass
 
-from config import config
+from config import config, ModelConfig
+from streaming import ChunkCoalescer, StreamTimer, TokenClock, StopGuard, TokenRecorder, combine_criteria
+from prefix_cache import PrefixKVCache, longest_common_prefix
+from session_store import SessionStore
+from response_cache import ResponseCache, is_deterministic, make_cache_key
+from chat_template import ChatTemplate
+from context_manager import ChatContextManager, ContextOverflowError, CONTEXT_POLICIES
+from speculative import DraftModelDecoding, SpeculationTracker, SpeculativeStats, SPECULATIVE_MODES
+from grammar_cache import grammar_cache, schema_text
+from admission import resolve_priority, estimate_tokens, PRIORITY_CLASSES
 
 logger = logging.getLogger(__name__)
 
@@ -19,53 +30,167 @@ class InferenceParams:
     repeat_penalty: float = 1.1
     stop_sequences: List[str] = None
     stream: bool = False
+    stream_chunk_tokens: int = 1
+    stream_chunk_interval_ms: int = 0
+    session_id: Optional[str] = None
+    seed: Optional[int] = None
+    context_policy: Optional[str] = None
+    speculative: str = "off"
+    json_schema: Optional[str] = None  # JSON text of a schema the output must match
+    grammar: Optional[str] = None  # GBNF grammar the output must match
+    deadline: Optional[float] = None  # time.perf_counter() value after which generation stops
+    priority: str = "normal"  # Priority class the scheduler ranks the request by
+    logprobs: bool = False  # Sum the log-probabilities of sampled tokens (set for best_of ranking)
     
     def __post_init__(self):
         if self.stop_sequences is None:
             self.stop_sequences = ["</s>", "<|im_end|>"]
 
 
+def _int_param(params: Dict[str, Any], name: str, default: Optional[int]) -> int:
+    """An integer request field; JSON booleans and non-integral numbers are rejected."""
+    value = params.get(name, default)
+    if isinstance(value, bool) or isinstance(value, float) and not value.is_integer():
+        raise ValueError(f"'{name}' must be an integer")
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"'{name}' must be an integer") from None
+
+
+def _float_param(params: Dict[str, Any], name: str, default: float) -> float:
+    """A numeric request field; JSON booleans are rejected."""
+    value = params.get(name, default)
+    if isinstance(value, bool):
+        raise ValueError(f"'{name}' must be a number")
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"'{name}' must be a number") from None
+
+
 class InferenceEngine:
     """Handles LLM inference operations."""
     
-    def __init__(self, model):
-        """Initialize with a loaded model."""
+    def __init__(self, model, model_config: Optional[ModelConfig] = None, draft_model=None, tuning: Optional[Dict[str, Any]] = None):
+        """Initialize with a loaded model, the configuration it was loaded with and an optional draft model."""
         self.model = model
+        self.model_config = model_config or config.model
+        # Settings the runtime tuner picked for this model, if it ran
+        self.tuning = tuning
+        
+        # Drafts are only useful when both models tokenize the same way
+        self.draft_model = draft_model
+        if draft_model is not None and draft_model.n_vocab() != model.n_vocab():
+            logger.warning("Draft model vocabulary does not match the model, draft speculation disabled")
+            draft_model.close()
+            self.draft_model = None
+        self.speculative_stats = SpeculativeStats()
+        # Drafts are verified against the logits of every drafted position, which only logits_all keeps
+        self.supports_speculation = bool(getattr(getattr(model, "context_params", None), "logits_all", False))
+        self._warned_speculation = False
+        
+        # Compiled once per model; chat prompts are rendered straight to token ids
+        self.chat_template = ChatTemplate(
+            model,
+            source=self.model_config.chat_template,
+            max_cached_segments=config.context.max_cached_segments
+        )
+        
         self.default_params = InferenceParams(
             max_tokens=config.inference.max_tokens,
             temperature=config.inference.temperature,
             top_p=config.inference.top_p,
             top_k=config.inference.top_k,
             repeat_penalty=config.inference.repeat_penalty,
-            stop_sequences=config.inference.stop_sequences
+            # Also stop at the end-of-turn marker of the model's own template
+            stop_sequences=list(dict.fromkeys(config.inference.stop_sequences + self.chat_template.stop_sequences)),
+            stream_chunk_tokens=config.streaming.chunk_tokens,
+            stream_chunk_interval_ms=config.streaming.chunk_interval_ms,
+            speculative=self._resolve_speculative(config.speculative.mode)
         )
         
-    def generate(self, prompt: str, params: Optional[InferenceParams] = None) -> Dict[str, Any]:
-        """Generate text from a prompt."""
+        # Let llama.cpp restore saved KV state for the longest cached prompt prefix;
+        # attached per request, to prompts long enough to be worth a state copy
+        self.prefix_cache = None
+        if config.prefix_cache.enabled:
+            self.prefix_cache = PrefixKVCache(
+                max_bytes=config.prefix_cache.max_mb * 1024 * 1024,
+                min_prefix_tokens=config.prefix_cache.min_prefix_tokens,
+                model=model,
+                min_save_tokens=config.prefix_cache.min_save_tokens
+            )
+        
+        # KV snapshots at the end of each chat session's last turn
+        self.session_store = None
+        if config.session.enabled:
+            self.session_store = SessionStore(
+                directory=config.get_sessions_dir(),
+                model_id=f"{self.model_config.filename}:{self.model_config.n_ctx}",
+                ttl_seconds=config.session.ttl_seconds,
+                max_ram_bytes=config.session.max_ram_mb * 1024 * 1024,
+                max_disk_bytes=config.session.max_disk_mb * 1024 * 1024,
+                persist=config.session.persist
+            )
+        
+        # Results of deterministic requests (greedy or fixed seed)
+        self.response_cache = None
+        if config.response_cache.enabled:
+            self.response_cache = ResponseCache(
+                max_entries=config.response_cache.max_entries,
+                max_bytes=config.response_cache.max_mb * 1024 * 1024,
+                ttl_seconds=config.response_cache.ttl_seconds,
+                disk_dir=config.get_response_cache_dir() if config.response_cache.disk_enabled else None,
+                max_disk_entries=config.response_cache.max_disk_entries
+            )
+        
+        # Chat histories are trimmed to what fits next to the completion
+        self.context_manager = ChatContextManager(
+            encode=self.chat_template.encode,
+            window_messages=config.context.window_messages
+        )
+        
+        # Created on the first embed job
+        self.embedder = None
+        
+    def generate(
+        self,
+        prompt: Union[str, List[int]],
+        params: Optional[InferenceParams] = None,
+        guard: Optional[StopGuard] = None
+    ) -> Dict[str, Any]:
+        """Generate text from a prompt.
+        
+        With a ``guard``, generation ends early once the request is cancelled
+        or past its deadline, and the result carries the text generated so far.
+        """
         if params is None:
             params = self.default_params
+        if guard is None:
+            guard = StopGuard(params.deadline)
         
         try:
             logger.info(f"Generating text with prompt length: {len(prompt)}")
             
-            # Prepare generation parameters
-            generation_kwargs = {
-                "prompt": prompt,
-                "max_tokens": params.max_tokens,
-                "temperature": params.temperature,
-                "top_p": params.top_p,
-                "top_k": params.top_k,
-                "repeat_penalty": params.repeat_penalty,
-                "stop": params.stop_sequences,
-                "stream": params.stream,
-                "echo": False  # Don't include prompt in output
-            }
-            
             # Generate text
             if params.stream:
-                return self._generate_stream(generation_kwargs)
-            else:
-                return self._generate_complete(generation_kwargs)
+                return self._generate_stream(prompt, params, guard)
+            
+            start_time = time.perf_counter()
+            timer = StreamTimer(start_time)
+            logprobs = self._logprob_tracker(params)
+            with self._speculation(params) as speculation:
+                if params.session_id:
+                    result = self._generate_session(prompt, params, timer, guard, logprobs)
+                else:
+                    result = self._generate_complete(self._build_generation_kwargs(prompt, params, timer, guard, logprobs))
+            
+            if logprobs is not None:
+                result["cumulative_logprob"] = round(logprobs.total, 4)
+            self._record_stop(result, guard, params)
+            self._record_speculation(result["usage"], speculation, time.perf_counter() - start_time)
+            result["timings"] = timer.report()
+            return result
                 
         except Exception as e:
             logger.error(f"Error during text generation: {e}")
@@ -76,6 +201,82 @@ class InferenceEngine:
                 "usage": {}
             }
     
+    def _build_generation_kwargs(
+        self,
+        prompt,
+        params: InferenceParams,
+        timer: Optional[StreamTimer] = None,
+        guard: Optional[StopGuard] = None,
+        logprobs=None
+    ) -> Dict[str, Any]:
+        """Prepare the keyword arguments for a llama.cpp completion call."""
+        generation_kwargs = {
+            "prompt": prompt,
+            "max_tokens": params.max_tokens,
+            "temperature": params.temperature,
+            "top_p": params.top_p,
+            "top_k": params.top_k,
+            "repeat_penalty": params.repeat_penalty,
+            "stop": params.stop_sequences,
+            "stream": params.stream,
+            "seed": params.seed,
+            "echo": False  # Don't include prompt in output
+        }
+        
+        # Every completion llama.cpp runs with a cache copies the whole state into it
+        if self.prefix_cache is not None:
+            wanted = self.prefix_cache.wants(estimate_tokens(prompt))
+            self.model.set_cache(self.prefix_cache if wanted else None)
+        
+        # Sampling is restricted to tokens the grammar allows
+        if params.json_schema is not None or params.grammar is not None:
+            generation_kwargs["grammar"] = grammar_cache.get(json_schema=params.json_schema, grammar=params.grammar)
+        
+        # Timestamps every sampled token, so complete responses get timings too;
+        # the guard ends generation between two tokens
+        criteria = []
+        if timer is not None:
+            criteria.append(TokenClock(timer))
+        if guard is not None:
+            criteria.append(guard)
+        if criteria:
+            generation_kwargs["stopping_criteria"] = combine_criteria(*criteria)
+        
+        # Sees every logits row; llama.cpp only keeps logprobs itself with logits_all
+        if logprobs is not None:
+            generation_kwargs["logits_processor"] = logprobs
+        
+        return generation_kwargs
+    
+    def _logprob_tracker(self, params: InferenceParams):
+        """A logits processor summing the log-probabilities of the request's tokens, if it wants them."""
+        if not params.logprobs:
+            return None
+        
+        from batch_decoder import LogprobTracker
+        return LogprobTracker()
+    
+    def _resident_prefix(self, prompt_tokens: List[int]) -> int:
+        """Prompt tokens llama.cpp will find in the context and not evaluate again."""
+        # The last prompt token is always evaluated for its logits
+        return min(longest_common_prefix(self.model._input_ids.tolist(), prompt_tokens), max(len(prompt_tokens) - 1, 0))
+    
+    def _record_stop(self, result: Dict[str, Any], guard: Optional[StopGuard], params: InferenceParams):
+        """Mark a result that a cancellation or deadline cut short.
+        
+        ``usage.skipped_tokens`` is how many tokens ``max_tokens`` still
+        allowed; the model may well have stopped earlier, so it is an upper
+        bound of the work saved.
+        """
+        if guard is None or guard.reason is None:
+            return
+        
+        result["finish_reason"] = guard.reason
+        result["usage"]["skipped_tokens"] = max(params.max_tokens - result["usage"].get("completion_tokens", 0), 0)
+        logger.info(
+            f"Generation stopped ({guard.reason}) after {result['usage'].get('completion_tokens', 0)} tokens"
+        )
+    
     def _generate_complete(self, generation_kwargs: Dict[str, Any]) -> Dict[str, Any]:
         """Generate complete text response."""
         try:
@@ -101,37 +302,231 @@ class InferenceEngine:
             logger.error(f"Error in complete generation: {e}")
             raise
     
-    def _generate_stream(self, generation_kwargs: Dict[str, Any]) -> Dict[str, Any]:
-        """Generate streaming text response."""
+    def _generate_session(
+        self,
+        prompt: Union[str, List[int]],
+        params: InferenceParams,
+        timer: Optional[StreamTimer] = None,
+        guard: Optional[StopGuard] = None,
+        logprobs=None
+    ) -> Dict[str, Any]:
+        """Generate a complete response that continues from the session's saved KV state."""
+        prompt_tokens = self.tokenize_prompt(prompt)
+        reused_tokens = self._restore_session(prompt_tokens, params)
+        
+        result = self._generate_complete(self._build_generation_kwargs(prompt_tokens, params, timer, guard, logprobs))
+        
+        self._save_session(params)
+        result["usage"]["session_reused_tokens"] = reused_tokens
+        return result
+    
+    def _restore_session(self, prompt_tokens: List[int], params: InferenceParams) -> int:
+        """Load the KV state saved at the end of the session's previous turn.
+        
+        Returns how many prompt tokens are already in the context and will not
+        be evaluated again.
+        """
+        if self.session_store is None or not params.session_id:
+            return 0
+        
+        resident_tokens = longest_common_prefix(self.model._input_ids.tolist(), prompt_tokens)
+        
+        state = self.session_store.get(params.session_id)
+        if state is None:
+            return resident_tokens
+        
+        saved_tokens = longest_common_prefix(state.input_ids[:state.n_tokens].tolist(), prompt_tokens)
+        if saved_tokens <= resident_tokens:
+            return resident_tokens
+        
+        self.model.load_state(state)
+        logger.info(f"Resumed session {params.session_id} with {saved_tokens} cached prompt tokens")
+        return saved_tokens
+    
+    def _save_session(self, params: InferenceParams):
+        """Snapshot the KV state at the end of this turn."""
+        if self.session_store is None or not params.session_id:
+            return
+        
+        self.session_store.put(params.session_id, self.model.save_state())
+    
+    def _generate_stream(self, prompt: Union[str, List[int]], params: InferenceParams, guard: Optional[StopGuard] = None) -> Dict[str, Any]:
+        """Generate a streamed response and aggregate it into a single result."""
+        text_parts = []
+        final_chunk = {}
+        
+        for chunk in self.stream_generate(prompt, params, guard):
+            text_parts.append(chunk["text"])
+            if chunk["finish_reason"] is not None:
+                final_chunk = chunk
+        
+        return {
+            "success": True,
+            "generated_text": "".join(text_parts),
+            "usage": final_chunk.get("usage", {}),
+            "finish_reason": final_chunk.get("finish_reason", "stop"),
+            "timings": final_chunk.get("timings", {})
+        }
+    
+    def stream_generate(
+        self,
+        prompt: Union[str, List[int]],
+        params: Optional[InferenceParams] = None,
+        guard: Optional[StopGuard] = None
+    ) -> Iterator[Dict[str, Any]]:
+        """Yield generated text chunk by chunk as llama.cpp decodes it.
+        
+        Every chunk carries ``text``, ``token_ids`` and ``finish_reason``
+        (None until the last chunk). The last chunk also carries ``usage`` and
+        ``timings`` with time-to-first-token and inter-token latency.
+        """
+        if params is None:
+            params = self.default_params
+        if guard is None:
+            guard = StopGuard(params.deadline)
+        
+        timer = StreamTimer()
+        coalescer = ChunkCoalescer(params.stream_chunk_tokens, params.stream_chunk_interval_ms)
+        
+        prompt_tokens = self.tokenize_prompt(prompt)
+        reused_tokens = self._restore_session(prompt_tokens, params)
+        logprobs = self._logprob_tracker(params)
+        generation_kwargs = self._build_generation_kwargs(prompt_tokens, params, guard=guard, logprobs=logprobs)
+        generation_kwargs["stream"] = True
+        
+        recorder = TokenRecorder()
+        finish_reason = None
+        start_time = time.perf_counter()
+        
+        with self._speculation(params) as speculation, self._recording(recorder):
+            try:
+                for chunk in self.model(**generation_kwargs):
+                    choice = chunk["choices"][0]
+                    text = choice["text"]
+                    
+                    if text:
+                        now = time.perf_counter()
+                        timer.mark_token(now)
+                        
+                        ready = coalescer.add(text, recorder.take(), now)
+                        if ready is not None:
+                            yield ready
+                    
+                    if choice.get("finish_reason") is not None:
+                        finish_reason = choice["finish_reason"]
+                        
+            except Exception as e:
+                logger.error(f"Error in streaming generation: {e}")
+                raise
+        
+        self._save_session(params)
+        
+        # Of the tokens llama.cpp received, only an end-of-generation token is not kept
+        recorder.finish(
+            keep_pending=not recorder.pending or finish_reason != "stop" or not self._ends_generation(recorder.tokens[-1])
+        )
+        completion_tokens = len(recorder.tokens)
+        
+        final_chunk = coalescer.flush() or {"text": "", "token_ids": [], "finish_reason": None}
+        final_chunk["token_ids"] = final_chunk["token_ids"] + recorder.take()
+        final_chunk["finish_reason"] = finish_reason or "stop"
+        final_chunk["usage"] = {
+            "prompt_tokens": len(prompt_tokens),
+            "completion_tokens": completion_tokens,
+            "total_tokens": len(prompt_tokens) + completion_tokens
+        }
+        if params.session_id:
+            final_chunk["usage"]["session_reused_tokens"] = reused_tokens
+        if logprobs is not None:
+            final_chunk["cumulative_logprob"] = round(logprobs.total, 4)
+        self._record_stop(final_chunk, guard, params)
+        self._record_speculation(final_chunk["usage"], speculation, time.perf_counter() - start_time)
+        final_chunk["timings"] = timer.report()
+        
+        yield final_chunk
+    
+    @contextmanager
+    def _recording(self, recorder: TokenRecorder):
+        """Let a recorder see the tokens the completion loop samples during one request."""
+        self.model.generate = recorder.wrap(self.model.generate)
         try:
-            generated_text = ""
-            tokens_generated = 0
-            
-            for chunk in self.model(**generation_kwargs):
-                if chunk["choices"][0]["text"]:
-                    generated_text += chunk["choices"][0]["text"]
-                    tokens_generated += 1
-            
-            return {
-                "success": True,
-                "generated_text": generated_text,
-                "usage": {
-                    "completion_tokens": tokens_generated,
-                    "total_tokens": tokens_generated  # Approximate
-                },
-                "finish_reason": "stop"
-            }
-            
-        except Exception as e:
-            logger.error(f"Error in streaming generation: {e}")
-            raise
+            yield recorder
+        finally:
+            del self.model.generate
+    
+    def _ends_generation(self, token: int) -> bool:
+        """Whether llama.cpp ends a completion at a token (EOS, EOT, ...) rather than keep it."""
+        # Import here to avoid issues if llama-cpp-python is not installed
+        import llama_cpp
+        return bool(llama_cpp.llama_token_is_eog(self.model._model.model, token))
+    
+    def _resolve_speculative(self, mode) -> str:
+        """Normalize a requested speculative mode to one this engine can run."""
+        if mode is True:
+            mode = config.speculative.mode if config.speculative.mode != "off" else "prompt_lookup"
+        elif mode is False or mode is None:
+            mode = "off"
+        
+        mode = str(mode)
+        if mode not in SPECULATIVE_MODES:
+            return "off"
+        
+        if mode != "off" and not self.supports_speculation:
+            if not self._warned_speculation:
+                logger.warning("Speculative decoding needs a model built with logits_all, running requests without it")
+                self._warned_speculation = True
+            return "off"
+        
+        # Without a draft model, prompt lookup is the closest cheap alternative
+        if mode == "draft" and self.draft_model is None:
+            return "prompt_lookup"
+        return mode
+    
+    @contextmanager
+    def _speculation(self, params: InferenceParams):
+        """Attach a draft source to the model for the duration of one request."""
+        if params.speculative == "off":
+            yield None
+            return
+        
+        if params.speculative == "draft":
+            draft = DraftModelDecoding(self.draft_model, num_pred_tokens=config.speculative.draft_pred_tokens)
+        else:
+            # Import here to avoid issues if llama-cpp-python is not installed
+            from llama_cpp.llama_speculative import LlamaPromptLookupDecoding
+            draft = LlamaPromptLookupDecoding(
+                max_ngram_size=config.speculative.max_ngram_size,
+                num_pred_tokens=config.speculative.num_pred_tokens
+            )
+        
+        tracker = SpeculationTracker(params.speculative, draft)
+        self.model.draft_model = tracker
+        try:
+            yield tracker
+        finally:
+            self.model.draft_model = None
+    
+    def _record_speculation(self, usage: Dict[str, Any], tracker: Optional[SpeculationTracker], seconds: float):
+        """Add a request's acceptance figures to its usage and to the aggregate metrics."""
+        completion_tokens = usage.get("completion_tokens", 0)
+        if tracker is not None:
+            tracker.finish(usage.get("prompt_tokens", 0), completion_tokens)
+        
+        measured_speedup = self.speculative_stats.record(tracker, completion_tokens, seconds)
+        if tracker is not None:
+            usage["speculative"] = {**tracker.report(completion_tokens), "measured_speedup": measured_speedup}
     
     def chat_completion(self, messages: List[Dict[str, str]], params: Optional[InferenceParams] = None) -> Dict[str, Any]:
         """Generate chat completion response."""
         try:
-            # Convert messages to prompt format
-            prompt = self._format_chat_messages(messages)
-            return self.generate(prompt, params)
+            if params is None:
+                params = self.default_params
+            
+            # Render messages to prompt tokens
+            prompt_tokens, context_usage = self.encode_chat(messages, params)
+            result = self.generate(prompt_tokens, params)
+            result["usage"] = {**result["usage"], **context_usage}
+            return result
             
         except Exception as e:
             logger.error(f"Error in chat completion: {e}")
@@ -142,26 +537,158 @@ class InferenceEngine:
                 "usage": {}
             }
     
-    def _format_chat_messages(self, messages: List[Dict[str, str]]) -> str:
-        """Format chat messages into a prompt."""
-        # Basic chat template for Llama models
-        formatted_prompt = ""
+    def stream_chat_completion(self, messages: List[Dict[str, str]], params: Optional[InferenceParams] = None) -> Iterator[Dict[str, Any]]:
+        """Stream a chat completion chunk by chunk."""
+        if params is None:
+            params = self.default_params
+        
+        prompt_tokens, context_usage = self.encode_chat(messages, params)
+        for chunk in self.stream_generate(prompt_tokens, params):
+            if chunk["finish_reason"] is not None:
+                chunk["usage"] = {**chunk["usage"], **context_usage}
+            yield chunk
+    
+    def encode_chat(self, messages: List[Dict[str, str]], params: InferenceParams) -> Tuple[List[int], Dict[str, int]]:
+        """Render a chat history to prompt tokens that fit in the context next to ``max_tokens``.
         
-        for message in messages:
-            role = message.get("role", "user")
-            content = message.get("content", "")
-            
-            if role == "system":
-                formatted_prompt += f"<|im_start|>system\n{content}<|im_end|>\n"
-            elif role == "user":
-                formatted_prompt += f"<|im_start|>user\n{content}<|im_end|>\n"
-            elif role == "assistant":
-                formatted_prompt += f"<|im_start|>assistant\n{content}<|im_end|>\n"
+        Returns the token ids and the usage fields describing what was
+        trimmed. Raises ContextOverflowError when even the last message does
+        not fit.
+        """
+        budget = self.model_config.n_ctx - params.max_tokens
+        if budget <= 0:
+            raise ContextOverflowError(
+                f"max_tokens ({params.max_tokens}) leaves no room for the prompt in a context of {self.model_config.n_ctx}"
+            )
         
-        # Add assistant start token for response
-        formatted_prompt += "<|im_start|>assistant\n"
+        policy = params.context_policy or config.context.policy
+        _, prompt_tokens, context_usage = self.context_manager.fit(messages, budget, policy)
         
-        return formatted_prompt
+        if context_usage["context_trimmed_messages"]:
+            logger.info(
+                f"Trimmed {context_usage['context_trimmed_messages']} messages "
+                f"({context_usage['context_trimmed_tokens']} tokens) to fit {budget} prompt tokens ({policy})"
+            )
+        return prompt_tokens, context_usage
+    
+    def build_prompt(self, prompt: Optional[str] = None, messages: Optional[List[Dict[str, str]]] = None) -> Union[str, List[int]]:
+        """Return the raw prompt, or the chat prompt's token ids when messages are given."""
+        if messages:
+            return self.chat_template.encode(messages).token_ids
+        return prompt
+    
+    def tokenize_prompt(self, prompt: Union[str, List[int]]) -> List[int]:
+        """Token ids of a prompt; chat prompts are already tokenized."""
+        if isinstance(prompt, list):
+            return prompt
+        return self.model.tokenize(prompt.encode("utf-8"), special=True)
+    
+    def supports_batching(self, params: InferenceParams) -> bool:
+        """Check whether a request can be decoded inside the continuous batch."""
+        # Sessions restore a full-context KV snapshot, drafts hook into the
+        # high-level generate loop and grammars are applied by its sampler,
+        # all of which need the whole model
+        return (
+            not params.session_id
+            and params.speculative == "off"
+            and params.json_schema is None
+            and params.grammar is None
+        )
+    
+    def run_request(self, prompt: Union[str, List[int]], params: InferenceParams, guard: Optional[StopGuard] = None) -> Iterator[Dict[str, Any]]:
+        """Run a formatted prompt exclusively, yielding streaming-format chunks.
+        
+        For a tokenized prompt, ``usage.prefill_tokens_saved`` counts the
+        prompt tokens that were still in the context from the previous
+        request, such as an earlier sample of the same prompt.
+        """
+        if params.stream:
+            yield from self.stream_generate(prompt, params, guard)
+            return
+        
+        saved_tokens = self._resident_prefix(prompt) if isinstance(prompt, list) and not params.session_id else 0
+        result = self.generate(prompt, params, guard)
+        if not result["success"]:
+            yield {"text": "", "token_ids": [], "finish_reason": "error", "error": result["error"]}
+            return
+        
+        if saved_tokens:
+            result["usage"]["prefill_tokens_saved"] = saved_tokens
+        chunk = {
+            "text": result["generated_text"],
+            "token_ids": [],
+            "finish_reason": result.get("finish_reason", "stop"),
+            "usage": result["usage"],
+            "timings": result.get("timings", {})
+        }
+        if "cumulative_logprob" in result:
+            chunk["cumulative_logprob"] = result["cumulative_logprob"]
+        yield chunk
+    
+    def embed(
+        self,
+        texts: List[str],
+        pooling: Optional[str] = None,
+        normalize: Optional[bool] = None,
+        encoding: Optional[str] = None
+    ) -> Dict[str, Any]:
+        """Embed many texts in packed batches and return the vectors as base64 buffers.
+        
+        Texts longer than the embedder accepts are truncated;
+        ``usage.truncated_inputs`` counts them.
+        """
+        # Import here to avoid issues if llama-cpp-python or NumPy is not installed
+        from embeddings import LlamaEmbedder, POOLING_MODES, ENCODINGS, encode_vectors, normalize_rows
+        
+        pooling = pooling or config.embedding.pooling
+        normalize = config.embedding.normalize if normalize is None else bool(normalize)
+        encoding = encoding or config.embedding.encoding
+        if pooling not in POOLING_MODES:
+            raise ValueError(f"Unknown pooling '{pooling}', expected one of {', '.join(POOLING_MODES)}")
+        if encoding not in ENCODINGS:
+            raise ValueError(f"Unknown encoding '{encoding}', expected one of {', '.join(ENCODINGS)}")
+        
+        if self.embedder is None:
+            self.embedder = LlamaEmbedder(self.model)
+        
+        start_time = time.perf_counter()
+        limit = self.embedder.max_input_tokens
+        token_lists = [self.tokenize_prompt(text) for text in texts]
+        truncated_inputs = sum(1 for tokens in token_lists if len(tokens) > limit)
+        token_lists = [tokens[:limit] for tokens in token_lists]
+        for index, tokens in enumerate(token_lists):
+            if not tokens:
+                raise ValueError(f"Input {index} has no tokens")
+        tokenized_time = time.perf_counter()
+        
+        vectors = self.embedder.embed(token_lists, pooling)
+        if normalize:
+            normalize_rows(vectors)
+        embedded_time = time.perf_counter()
+        
+        prompt_tokens = sum(len(tokens) for tokens in token_lists)
+        return {
+            "embeddings": encode_vectors(vectors, encoding),
+            "encoding": encoding,
+            "dimensions": int(vectors.shape[1]),
+            "pooling": "model" if self.embedder.native_pooling else pooling,
+            "normalized": normalize,
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": 0,
+                "total_tokens": prompt_tokens,
+                "truncated_inputs": truncated_inputs
+            },
+            "timings": {
+                "tokenize_ms": round((tokenized_time - start_time) * 1000, 3),
+                "embed_ms": round((embedded_time - tokenized_time) * 1000, 3),
+                "encode_ms": round((time.perf_counter() - embedded_time) * 1000, 3)
+            }
+        }
+    
+    def run_embedding(self, texts: List[str], **options) -> Iterator[Dict[str, Any]]:
+        """Run an embed job exclusively, yielding its result as a single streaming-format chunk."""
+        yield {"text": "", "token_ids": [], "finish_reason": "stop", **self.embed(texts, **options)}
     
     def get_model_info(self) -> Dict[str, Any]:
         """Get information about the loaded model."""
@@ -169,9 +696,13 @@ class InferenceEngine:
             # Get basic model information
             info = {
                 "model_loaded": self.model is not None,
-                "context_length": config.model.n_ctx,
-                "gpu_layers": config.model.n_gpu_layers,
-                "batch_size": config.model.n_batch
+                "context_length": self.model_config.n_ctx,
+                "gpu_layers": self.model_config.n_gpu_layers,
+                "batch_size": self.model_config.n_batch,
+                "threads": self.model_config.n_threads,
+                "auto_tune": self.tuning,
+                "chat_template": self.chat_template.origin,
+                "draft_model": self.model_config.draft_filename if self.draft_model is not None else None
             }
             
             # Try to get additional model metadata if available
@@ -184,34 +715,149 @@ class InferenceEngine:
             logger.error(f"Error getting model info: {e}")
             return {"error": str(e)}
     
+    def close(self):
+        """Release the caches tied to this model before it is unloaded."""
+        if self.prefix_cache is not None:
+            self.prefix_cache.clear()
+        if self.session_store is not None:
+            self.session_store.close()
+        if self.response_cache is not None:
+            self.response_cache.close()
+        if self.draft_model is not None:
+            self.draft_model.close()
+            self.draft_model = None
+        if self.embedder is not None:
+            self.embedder.close()
+            self.embedder = None
+    
+    def get_prefix_cache_stats(self) -> Dict[str, Any]:
+        """Get prefix cache hit/miss/saved-token counters."""
+        if self.prefix_cache is None:
+            return {"enabled": False}
+        
+        return {"enabled": True, **self.prefix_cache.get_stats()}
+    
+    def response_cache_key(self, prompt: Union[str, List[int]], params: InferenceParams) -> Optional[str]:
+        """Key for memoizing a request, or None when its output is not reproducible."""
+        if self.response_cache is None or params.session_id or not is_deterministic(params):
+            return None
+        
+        return make_cache_key(prompt, params, self.model_config.filename)
+    
+    def get_cached_response(self, cache_key: Optional[str]) -> Optional[Dict[str, Any]]:
+        """Look up a memoized result."""
+        if cache_key is None:
+            return None
+        
+        return self.response_cache.get(cache_key)
+    
+    def store_cached_response(self, cache_key: Optional[str], result: Dict[str, Any]):
+        """Memoize a finished result."""
+        if cache_key is None or result.get("finish_reason") not in ("stop", "length"):
+            return
+        
+        self.response_cache.put(cache_key, result)
+    
+    def get_response_cache_stats(self) -> Dict[str, Any]:
+        """Get response cache counters."""
+        if self.response_cache is None:
+            return {"enabled": False}
+        
+        return {"enabled": True, **self.response_cache.get_stats()}
+    
+    def get_context_stats(self) -> Dict[str, Any]:
+        """Get token count cache and history trimming counters."""
+        return {
+            "policy": config.context.policy,
+            **self.context_manager.get_stats(),
+            "template": self.chat_template.get_stats()
+        }
+    
+    def get_speculative_stats(self) -> Dict[str, Any]:
+        """Get acceptance and speedup figures of speculative decoding."""
+        return {
+            "default_mode": self.default_params.speculative,
+            "supported": self.supports_speculation,
+            "draft_model": self.model_config.draft_filename if self.draft_model is not None else None,
+            **self.speculative_stats.get_stats()
+        }
+    
+    def get_session_stats(self) -> Dict[str, Any]:
+        """Get chat session store counters."""
+        if self.session_store is None:
+            return {"enabled": False}
+        
+        return {"enabled": True, **self.session_store.get_stats()}
+    
     def validate_params(self, params: Dict[str, Any]) -> InferenceParams:
-        """Validate and convert parameters to InferenceParams."""
-        try:
-            # Extract and validate parameters
-            max_tokens = min(max(int(params.get("max_tokens", self.default_params.max_tokens)), 1), 4096)
-            temperature = max(min(float(params.get("temperature", self.default_params.temperature)), 2.0), 0.0)
-            top_p = max(min(float(params.get("top_p", self.default_params.top_p)), 1.0), 0.0)
-            top_k = max(int(params.get("top_k", self.default_params.top_k)), 1)
-            repeat_penalty = max(float(params.get("repeat_penalty", self.default_params.repeat_penalty)), 0.1)
-            
-            stop_sequences = params.get("stop", self.default_params.stop_sequences)
-            if isinstance(stop_sequences, str):
-                stop_sequences = [stop_sequences]
-            elif not isinstance(stop_sequences, list):
-                stop_sequences = self.default_params.stop_sequences
-            
-            stream = bool(params.get("stream", False))
-            
-            return InferenceParams(
-                max_tokens=max_tokens,
-                temperature=temperature,
-                top_p=top_p,
-                top_k=top_k,
-                repeat_penalty=repeat_penalty,
-                stop_sequences=stop_sequences,
-                stream=stream
-            )
-            
-        except Exception as e:
-            logger.warning(f"Error validating parameters, using defaults: {e}")
-            return self.default_params
+        """Validate and convert parameters to InferenceParams.
+        
+        Raises ValueError naming the offending field rather than falling back
+        to defaults, which would drop the schema, session and deadline a
+        request asked for.
+        """
+        defaults = self.default_params
+        max_tokens = min(max(_int_param(params, "max_tokens", defaults.max_tokens), 1), 4096)
+        temperature = max(min(_float_param(params, "temperature", defaults.temperature), 2.0), 0.0)
+        top_p = max(min(_float_param(params, "top_p", defaults.top_p), 1.0), 0.0)
+        top_k = max(_int_param(params, "top_k", defaults.top_k), 1)
+        repeat_penalty = max(_float_param(params, "repeat_penalty", defaults.repeat_penalty), 0.1)
+        
+        stop_sequences = params.get("stop", defaults.stop_sequences)
+        if isinstance(stop_sequences, str):
+            stop_sequences = [stop_sequences]
+        elif not isinstance(stop_sequences, list) or not all(isinstance(stop, str) for stop in stop_sequences):
+            raise ValueError("'stop' must be a string or a list of strings")
+        
+        stream = bool(params.get("stream", False))
+        stream_chunk_tokens = max(_int_param(params, "stream_chunk_tokens", defaults.stream_chunk_tokens), 1)
+        stream_chunk_interval_ms = max(_int_param(params, "stream_chunk_interval_ms", defaults.stream_chunk_interval_ms), 0)
+        session_id = params.get("session_id")
+        if session_id is not None:
+            session_id = str(session_id)
+        seed = params.get("seed")
+        if seed is not None:
+            seed = _int_param(params, "seed", None)
+        context_policy = params.get("context_policy")
+        if context_policy is not None and context_policy not in CONTEXT_POLICIES:
+            raise ValueError(f"'context_policy' must be one of: {', '.join(CONTEXT_POLICIES)}")
+        speculative = params.get("speculative", defaults.speculative)
+        if not isinstance(speculative, bool) and speculative is not None and speculative not in SPECULATIVE_MODES:
+            raise ValueError(f"'speculative' must be a boolean or one of: {', '.join(SPECULATIVE_MODES)}")
+        speculative = self._resolve_speculative(speculative)
+        json_schema = params.get("json_schema")
+        if json_schema is not None:
+            if not isinstance(json_schema, (str, dict)):
+                raise ValueError("'json_schema' must be an object or a JSON string")
+            json_schema = schema_text(json_schema)
+        grammar = params.get("grammar")
+        if grammar is not None and not isinstance(grammar, str):
+            raise ValueError("'grammar' must be a string")
+        # The deadline counts from now, so time spent queued is part of it; null means no timeout
+        timeout_ms = params.get("timeout_ms", config.inference.timeout_ms)
+        timeout_ms = max(_int_param(params, "timeout_ms", 0) if timeout_ms is not None else 0, 0)
+        deadline = time.perf_counter() + timeout_ms / 1000 if timeout_ms else None
+        priority = params.get("priority")
+        if priority is not None and priority not in PRIORITY_CLASSES:
+            raise ValueError(f"'priority' must be one of: {', '.join(PRIORITY_CLASSES)}")
+        priority = resolve_priority(priority, config.scheduler.default_priority)
+        
+        return InferenceParams(
+            max_tokens=max_tokens,
+            temperature=temperature,
+            top_p=top_p,
+            top_k=top_k,
+            repeat_penalty=repeat_penalty,
+            stop_sequences=stop_sequences,
+            stream=stream,
+            stream_chunk_tokens=stream_chunk_tokens,
+            stream_chunk_interval_ms=stream_chunk_interval_ms,
+            session_id=session_id,
+            seed=seed,
+            context_policy=context_policy,
+            speculative=speculative,
+            json_schema=json_schema,
+            grammar=grammar,
+            deadline=deadline,
+            priority=priority
+        )
@@ -0,0 +1,314 @@
+"""Per-phase latency and throughput metrics with a Prometheus text export."""
+
+import logging
+import math
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Any, Optional, List
+
+from config import config
+from streaming import STOP_REASONS
+
+logger = logging.getLogger(__name__)
+
+QUANTILES = (0.5, 0.95, 0.99)
+
+# Phases recorded per job: (key, Prometheus name, factor to the Prometheus unit, help text)
+PHASES = (
+    ("queue_wait_ms", "queue_wait_seconds", 0.001, "Time jobs waited for the model"),
+    ("tokenize_ms", "tokenize_seconds", 0.001, "Prompt rendering and tokenization"),
+    ("prefill_ms", "prefill_seconds", 0.001, "Prompt evaluation up to the first sampled token"),
+    ("ttft_ms", "time_to_first_token_seconds", 0.001, "Time from job start to the first generated token"),
+    ("decode_tokens_per_second", "decode_tokens_per_second", 1.0, "Generation rate after the first token"),
+    ("postprocess_ms", "postprocess_seconds", 0.001, "Assembling, caching and returning the result"),
+    ("total_ms", "job_duration_seconds", 0.001, "Time from job start to the response")
+)
+
+JOB_STATUSES = ("success", "cached", "error") + STOP_REASONS
+
+
+class RollingHistogram:
+    """The most recent observations of a value, plus all-time count and sum.
+
+    Observing writes one slot of a ring buffer; the window is only sorted
+    when percentiles are read.
+    """
+
+    __slots__ = ("size", "count", "sum", "_values", "_next")
+
+    def __init__(self, size: int = 1024):
+        self.size = size
+        self.count = 0
+        self.sum = 0.0
+        self._values: List[float] = []
+        self._next = 0
+
+    def observe(self, value: float):
+        if len(self._values) < self.size:
+            self._values.append(value)
+        else:
+            self._values[self._next] = value
+            self._next = (self._next + 1) % self.size
+        self.count += 1
+        self.sum += value
+
+    def quantiles(self) -> Dict[float, Optional[float]]:
+        """Nearest-rank percentiles of the window."""
+        ordered = sorted(self._values)
+        if not ordered:
+            return {quantile: None for quantile in QUANTILES}
+        return {
+            quantile: ordered[max(math.ceil(quantile * len(ordered)) - 1, 0)]
+            for quantile in QUANTILES
+        }
+
+    def summary(self) -> Dict[str, Any]:
+        quantiles = self.quantiles()
+        return {
+            "count": self.count,
+            "mean": round(self.sum / self.count, 3) if self.count else None,
+            **{
+                f"p{int(quantile * 100)}": round(value, 3) if value is not None else None
+                for quantile, value in quantiles.items()
+            }
+        }
+
+
+class ModelMetrics:
+    """Histograms and counters of one model."""
+
+    def __init__(self, window: int):
+        self.phases = {key: RollingHistogram(window) for key, _, _, _ in PHASES}
+        self.jobs = {status: 0 for status in JOB_STATUSES}
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        # Estimated model time not spent on cancelled and expired jobs
+        self.gpu_seconds_saved = 0.0
+
+
+class MetricsRegistry:
+    """Collects per-job phase timings for every model of the pool.
+
+    Recording takes one lock and a handful of list writes per job; sorting
+    for the percentiles happens only when a snapshot is read.
+    """
+
+    def __init__(self, window: int = 1024, enabled: bool = True):
+        self.window = window
+        self.enabled = enabled
+        self._models: Dict[str, ModelMetrics] = {}
+        self._lock = threading.Lock()
+
+    def _model(self, model: str) -> ModelMetrics:
+        metrics = self._models.get(model)
+        if metrics is None:
+            metrics = self._models[model] = ModelMetrics(self.window)
+        return metrics
+
+    def record(self, model: str, status: str, phases: Optional[Dict[str, Optional[float]]] = None, usage: Optional[Dict[str, Any]] = None):
+        """Add a finished job; phases that were not measured are None or missing.
+
+        For a job that stopped early, ``usage.skipped_tokens`` is turned into
+        GPU-seconds at the job's own decode rate, or at the model's mean rate
+        when the job decoded too little to measure one.
+        """
+        if not self.enabled:
+            return
+
+        phases = phases or {}
+        with self._lock:
+            metrics = self._model(model)
+            metrics.jobs[status] += 1
+            if usage:
+                metrics.prompt_tokens += usage.get("prompt_tokens", 0)
+                metrics.completion_tokens += usage.get("completion_tokens", 0)
+            for key, value in phases.items():
+                if value is not None:
+                    metrics.phases[key].observe(value)
+
+            skipped_tokens = (usage or {}).get("skipped_tokens")
+            if skipped_tokens:
+                rate = phases.get("decode_tokens_per_second")
+                decode_rates = metrics.phases["decode_tokens_per_second"]
+                if rate is None and decode_rates.count:
+                    rate = decode_rates.sum / decode_rates.count
+                if rate:
+                    metrics.gpu_seconds_saved += skipped_tokens / rate
+
+    def reset(self):
+        """Forget everything recorded so far (e.g. after a benchmark warmup)."""
+        with self._lock:
+            self._models.clear()
+
+    def start_job(self, model: str, start_time: Optional[float] = None) -> "JobTimer":
+        """Start timing a job."""
+        return JobTimer(self, model, start_time)
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Percentiles and totals per model."""
+        with self._lock:
+            return {
+                model: {
+                    "jobs": dict(metrics.jobs),
+                    "prompt_tokens": metrics.prompt_tokens,
+                    "completion_tokens": metrics.completion_tokens,
+                    "gpu_seconds_saved": round(metrics.gpu_seconds_saved, 3),
+                    **{key: histogram.summary() for key, histogram in metrics.phases.items()}
+                }
+                for model, metrics in self._models.items()
+            }
+
+    def prometheus_text(self) -> str:
+        """Render all metrics in the Prometheus text exposition format."""
+        lines = []
+        with self._lock:
+            models = sorted(self._models.items())
+
+            for key, name, factor, help_text in PHASES:
+                metric = f"llm_worker_{name}"
+                lines.append(f"# HELP {metric} {help_text}")
+                lines.append(f"# TYPE {metric} summary")
+                for model, metrics in models:
+                    histogram = metrics.phases[key]
+                    label = f'model="{_escape_label(model)}"'
+                    for quantile, value in histogram.quantiles().items():
+                        if value is not None:
+                            lines.append(f'{metric}{{{label},quantile="{quantile}"}} {_format_value(value * factor)}')
+                    lines.append(f"{metric}_sum{{{label}}} {_format_value(histogram.sum * factor)}")
+                    lines.append(f"{metric}_count{{{label}}} {histogram.count}")
+
+            lines.append("# HELP llm_worker_jobs_total Finished jobs by status")
+            lines.append("# TYPE llm_worker_jobs_total counter")
+            for model, metrics in models:
+                for status, count in metrics.jobs.items():
+                    lines.append(f'llm_worker_jobs_total{{model="{_escape_label(model)}",status="{status}"}} {count}')
+
+            for name, attribute, help_text in (
+                ("prompt_tokens_total", "prompt_tokens", "Prompt tokens of finished jobs"),
+                ("completion_tokens_total", "completion_tokens", "Generated tokens of finished jobs"),
+                ("gpu_seconds_saved_total", "gpu_seconds_saved", "Estimated model time saved by stopping cancelled and expired jobs")
+            ):
+                lines.append(f"# HELP llm_worker_{name} {help_text}")
+                lines.append(f"# TYPE llm_worker_{name} counter")
+                for model, metrics in models:
+                    lines.append(f'llm_worker_{name}{{model="{_escape_label(model)}"}} {getattr(metrics, attribute)}')
+
+        return "\n".join(lines) + "\n"
+
+
+class JobTimer:
+    """Phase boundaries of one job, turned into observations when it finishes.
+
+    The scheduler and the engine report queue wait, prefill and decode time
+    in the ``timings`` of the final chunk; this adds what happens around
+    them in the handler.
+    """
+
+    __slots__ = ("registry", "model", "start_time", "submitted_time")
+
+    def __init__(self, registry: MetricsRegistry, model: str, start_time: Optional[float] = None):
+        self.registry = registry
+        self.model = model
+        self.start_time = start_time if start_time is not None else time.perf_counter()
+        self.submitted_time = None
+
+    def mark_submitted(self, now: Optional[float] = None):
+        """The prompt is tokenized and queued on the scheduler."""
+        self.submitted_time = now if now is not None else time.perf_counter()
+
+    def finish(self, final_chunk: Dict[str, Any], received_time: float):
+        """Record a job whose final chunk arrived at ``received_time``.
+
+        Jobs cut short by a cancellation or their deadline are counted under
+        their finish reason rather than as successes.
+        """
+        now = time.perf_counter()
+        timings = final_chunk.get("timings") or {}
+        usage = final_chunk.get("usage") or {}
+
+        tokenize_ms = None
+        if self.submitted_time is not None:
+            tokenize_ms = (self.submitted_time - self.start_time) * 1000
+
+        queue_wait_ms = timings.get("queue_wait_ms")
+        prefill_ms = timings.get("prefill_ms")
+        ttft_ms = None
+        if None not in (tokenize_ms, queue_wait_ms, prefill_ms):
+            ttft_ms = tokenize_ms + queue_wait_ms + prefill_ms
+
+        decode_tokens_per_second = None
+        decode_time_ms = timings.get("decode_time_ms")
+        completion_tokens = usage.get("completion_tokens", 0)
+        if decode_time_ms and completion_tokens > 1:
+            decode_tokens_per_second = (completion_tokens - 1) / (decode_time_ms / 1000)
+
+        status = final_chunk.get("finish_reason")
+        if status not in STOP_REASONS:
+            status = "success"
+
+        self.registry.record(self.model, status, {
+            "queue_wait_ms": queue_wait_ms,
+            "tokenize_ms": tokenize_ms,
+            "prefill_ms": prefill_ms,
+            "ttft_ms": ttft_ms,
+            "decode_tokens_per_second": decode_tokens_per_second,
+            "postprocess_ms": (now - received_time) * 1000,
+            "total_ms": (now - self.start_time) * 1000
+        }, usage)
+
+    def cached(self):
+        """Record a job answered from the response cache; it generated no tokens."""
+        self.registry.record(self.model, "cached", {
+            "total_ms": (time.perf_counter() - self.start_time) * 1000
+        })
+
+    def fail(self):
+        """Record a job that ended with an error."""
+        self.registry.record(self.model, "error")
+
+    def settle(self, final_chunk: Dict[str, Any]):
+        """Record a job from its final chunk alone, for jobs whose caller has gone away."""
+        if final_chunk["finish_reason"] == "error":
+            self.fail()
+        else:
+            self.finish(final_chunk, time.perf_counter())
+
+
+def _escape_label(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_value(value: float) -> str:
+    return format(value, ".9g")
+
+
+class _MetricsRequestHandler(BaseHTTPRequestHandler):
+    """Serves ``GET /metrics`` for Prometheus scrapers."""
+
+    def do_GET(self):
+        if self.path.split("?", 1)[0] != "/metrics":
+            self.send_error(404)
+            return
+
+        body = metrics.prometheus_text().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # Scrapes would flood the worker log
+
+
+def serve_metrics(port: int) -> ThreadingHTTPServer:
+    """Serve the Prometheus text on ``port`` from a daemon thread."""
+    server = ThreadingHTTPServer(("0.0.0.0", port), _MetricsRequestHandler)
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    logger.info(f"Serving Prometheus metrics on port {port}")
+    return server
+
+
+# Global metrics registry
+metrics = MetricsRegistry(window=config.metrics.window, enabled=config.metrics.enabled)
@@ -2,15 +2,17 @@
 
 import os
 import logging
+import threading
+from dataclasses import replace
 from pathlib import Path
 from typing import Optional
 import time
 
-from huggingface_hub import hf_hub_download, repo_info
-from huggingface_hub.utils import RepositoryNotFoundError, RevisionNotFoundError
-
-from config import config
+from config import config, ModelConfig
 from cache_manager import CacheManager
+from cache_eviction import get_cache_evictor
+from download_lease import DownloadLease
+from downloader import DownloadAborted, ParallelDownloader, read_download_progress
 
 logger = logging.getLogger(__name__)
 
@@ -18,18 +20,37 @@ logger = logging.getLogger(__name__)
 class ModelManager:
     """Manages model downloading, caching, and loading."""
     
-    def __init__(self):
+    def __init__(self, model_config: Optional[ModelConfig] = None):
         self.cache_manager = CacheManager()
-        self.model_config = config.model
+        self.model_config = model_config or config.model
         self.hf_token = config.hf_token
+        self._last_progress_step = -1
+        self._model_ready = False
+        self._manifest = None
         
     def get_model_info(self) -> Optional[dict]:
         """Get model information from Hugging Face Hub."""
+        if self.model_config.download_url:
+            # Explicit source: size and hash come from the server and the config
+            return {
+                "repository_id": self.model_config.repository_id,
+                "filename": self.model_config.filename,
+                "file_size": None,
+                "sha256": self.model_config.sha256,
+                "revision": None,
+                "download_url": self.model_config.download_url
+            }
+        
+        # Import here: the Hub client is slow to import and only needed on a cache miss
+        from huggingface_hub import hf_hub_url, repo_info
+        from huggingface_hub.utils import RepositoryNotFoundError, RevisionNotFoundError
+        
         try:
             info = repo_info(
                 repo_id=self.model_config.repository_id,
                 token=self.hf_token,
-                repo_type="model"
+                repo_type="model",
+                files_metadata=True
             )
             
             # Find the specific file we need
@@ -43,12 +64,20 @@ class ModelManager:
                 logger.error(f"File {self.model_config.filename} not found in repository")
                 return None
             
+            # For LFS files the Hub publishes the SHA-256 of the content
+            sha256 = target_file.lfs.sha256 if target_file.lfs else self.model_config.sha256
+            
             return {
                 "repository_id": self.model_config.repository_id,
                 "filename": self.model_config.filename,
                 "file_size": target_file.size,
-                "last_modified": target_file.last_modified,
-                "download_url": f"https://huggingface.co/{self.model_config.repository_id}/resolve/main/{self.model_config.filename}"
+                "sha256": sha256,
+                "revision": info.sha,
+                "download_url": hf_hub_url(
+                    repo_id=self.model_config.repository_id,
+                    filename=self.model_config.filename,
+                    revision=info.sha
+                )
             }
             
         except (RepositoryNotFoundError, RevisionNotFoundError) as e:
@@ -58,22 +87,15 @@ class ModelManager:
             logger.error(f"Error getting model info: {e}")
             return None
     
-    def download_model(self) -> Optional[str]:
-        """Download model file to cache if not already present."""
-        filename = self.model_config.filename
+    def download_model(self, model_info: Optional[dict] = None, abort: Optional[threading.Event] = None) -> Optional[str]:
+        """Download model file to cache and record its manifest.
         
-        # Check if already cached and valid
-        if self.cache_manager.is_cached(filename):
-            logger.info(f"Model {filename} already cached")
-            if self.cache_manager.validate_cached_file(filename):
-                logger.info(f"Cached model {filename} is valid")
-                return str(self.cache_manager.get_cache_path(filename))
-            else:
-                logger.warning(f"Cached model {filename} is invalid, removing...")
-                self.cache_manager.remove_cached_file(filename)
+        Setting ``abort`` (e.g. a lost download lease) stops the download and returns None.
+        """
+        filename = self.model_config.filename
         
         # Get model info for validation
-        model_info = self.get_model_info()
+        model_info = model_info or self.get_model_info()
         if not model_info:
             logger.error("Could not get model information")
             return None
@@ -83,47 +105,188 @@ class ModelManager:
         try:
             start_time = time.time()
             
-            # Download to cache directory
-            downloaded_path = hf_hub_download(
-                repo_id=self.model_config.repository_id,
-                filename=filename,
-                cache_dir=str(self.cache_manager.cache_dir.parent),
-                local_dir=str(self.cache_manager.cache_dir),
-                local_dir_use_symlinks=False,
-                token=self.hf_token
+            headers = {"Authorization": f"Bearer {self.hf_token}"} if self.hf_token else {}
+            downloader = ParallelDownloader(
+                url=model_info["download_url"],
+                dest_path=str(self.cache_manager.get_cache_path(filename)),
+                expected_size=model_info["file_size"],
+                expected_sha256=model_info["sha256"],
+                headers=headers,
+                workers=self.model_config.download_workers,
+                chunk_size=self.model_config.download_chunk_mb * 1024 * 1024,
+                abort=abort
+            )
+            # The manifest goes down before the rename, so a worker that finds the file never has to hash it
+            def publish_manifest(part_path: str, sha256: str):
+                try:
+                    self.cache_manager.write_manifest(
+                        filename,
+                        sha256=sha256,
+                        revision=model_info["revision"],
+                        repository_id=self.model_config.repository_id,
+                        source_path=part_path
+                    )
+                except Exception as e:
+                    logger.error(f"Downloaded model {filename} is not a valid GGUF file: {e}")
+                    raise
+            
+            downloaded_path = downloader.download(
+                progress_callback=self._log_download_progress,
+                before_publish=publish_manifest
             )
             
             download_time = time.time() - start_time
             logger.info(f"Model downloaded successfully in {download_time:.2f} seconds")
             
-            # Validate downloaded file
-            if self.cache_manager.validate_cached_file(filename, model_info['file_size']):
-                logger.info(f"Downloaded model {filename} validated successfully")
-                return downloaded_path
-            else:
-                logger.error(f"Downloaded model {filename} validation failed")
-                self.cache_manager.remove_cached_file(filename)
-                return None
+            # The new file may have pushed the volume over its budget
+            evictor = get_cache_evictor()
+            evictor.touch(filename)
+            evictor.trigger()
+            
+            return downloaded_path
                 
+        except DownloadAborted as e:
+            logger.warning(f"Stopped downloading {filename}: {e}")
+            return None
         except Exception as e:
             logger.error(f"Error downloading model: {e}")
             return None
     
+    def _log_download_progress(self, downloaded: int, total: int):
+        """Log download progress roughly every 5%."""
+        step = max(total // 20, 1)
+        if downloaded // step != self._last_progress_step:
+            self._last_progress_step = downloaded // step
+            logger.info(f"Download progress: {downloaded / (1024**3):.2f}/{total / (1024**3):.2f} GB")
+    
     def ensure_model_available(self) -> bool:
-        """Ensure model is available in cache, download if necessary."""
+        """Ensure model is available in cache, download if necessary.
+        
+        A cached file whose size and mtime match its manifest is trusted
+        without reading it. The full hash only runs when the manifest is stale
+        or missing, and the Hub is only contacted when there is nothing local
+        to compare the hash against or the file has to be downloaded.
+        """
+        if self._model_ready:
+            return True
+        
         filename = self.model_config.filename
+        repository_id = self.model_config.repository_id
+        model_info = None
+        
+        manifest_state = self.cache_manager.check_manifest(filename, repository_id)
+        if manifest_state == "valid":
+            logger.info(f"Model {filename} matches its manifest")
+            self._model_ready = True
+            return True
         
-        # Check if model is already cached and valid
         if self.cache_manager.is_cached(filename):
-            if self.cache_manager.validate_cached_file(filename):
-                logger.info(f"Model {filename} is available and valid")
-                return True
+            manifest = self.cache_manager.load_manifest(filename)
+            if manifest_state == "stale" and manifest.get("repository_id") in (None, repository_id):
+                expected_sha256 = manifest.get("sha256")
+                revision = manifest.get("revision")
+            elif self.model_config.sha256:
+                expected_sha256 = self.model_config.sha256
+                revision = None
             else:
-                logger.warning(f"Cached model {filename} is invalid")
+                model_info = self.get_model_info()
+                expected_sha256 = model_info["sha256"] if model_info else None
+                revision = model_info["revision"] if model_info else None
+            
+            if self._verify_cached_file(filename, expected_sha256, revision):
+                self._model_ready = True
+                return True
+            
+            logger.warning(f"Cached model {filename} is invalid, removing...")
+            self.cache_manager.remove_cached_file(filename)
         
-        # Download model
-        downloaded_path = self.download_model()
-        return downloaded_path is not None
+        # Download model, unless another worker on the volume already is
+        downloaded_path = self._download_coordinated(model_info)
+        self._model_ready = downloaded_path is not None
+        return self._model_ready
+    
+    def _download_coordinated(self, model_info: Optional[dict]) -> Optional[str]:
+        """Download the model while holding its lease, or wait for the worker that holds it.
+        
+        Workers scaled up together all find a cold cache at once; one of them
+        downloads and the others follow its progress and use the file as soon
+        as it is published with its manifest. When the holder fails or dies,
+        a waiting worker takes over and resumes from the partial download.
+        """
+        filename = self.model_config.filename
+        repository_id = self.model_config.repository_id
+        cache_path = str(self.cache_manager.get_cache_path(filename))
+        lease = DownloadLease(
+            str(self.cache_manager.cache_dir),
+            filename,
+            stale_seconds=config.cache.download_lease_seconds
+        )
+        
+        while True:
+            if lease.try_acquire():
+                try:
+                    # The previous holder may have published the file just before releasing
+                    if self.cache_manager.check_manifest(filename, repository_id) == "valid":
+                        logger.info(f"Model {filename} was downloaded by another worker")
+                        return cache_path
+                    downloaded_path = self.download_model(model_info, abort=lease.lost)
+                    # A worker that took the lease over resumes the download; wait for it instead
+                    if downloaded_path is not None or not lease.lost.is_set():
+                        return downloaded_path
+                finally:
+                    lease.release()
+                
+                logger.warning(f"Another worker took over the download of {filename}, waiting for it")
+                continue
+            
+            logger.info(f"Worker {lease.holder() or 'unknown'} is downloading {filename}, waiting for it")
+            lease.wait(
+                config.cache.download_poll_seconds,
+                progress_callback=lambda: self._log_shared_download_progress(cache_path)
+            )
+            
+            if self.cache_manager.check_manifest(filename, repository_id) == "valid":
+                logger.info(f"Model {filename} was downloaded by another worker")
+                return cache_path
+            
+            logger.warning(f"The download of {filename} by another worker did not finish, retrying")
+    
+    def _log_shared_download_progress(self, cache_path: str):
+        """Log the progress of a download run by another worker."""
+        progress = read_download_progress(cache_path)
+        if progress is not None:
+            self._log_download_progress(*progress)
+    
+    def _verify_cached_file(self, filename: str, expected_sha256: Optional[str], revision: Optional[str]) -> bool:
+        """Hash a cached file without a usable manifest and write a fresh one."""
+        logger.info(f"Model {filename} has no valid manifest, verifying its hash...")
+        start_time = time.time()
+        
+        sha256 = self.cache_manager.calculate_file_hash(filename, workers=self.model_config.download_workers)
+        if sha256 is None:
+            return False
+        
+        logger.info(f"Hashed {filename} in {time.time() - start_time:.2f} seconds")
+        
+        if expected_sha256 is None:
+            # Offline and nothing to compare against: keep the file, trust on first use
+            logger.warning(f"No reference hash for {filename}, recording the local one")
+        elif sha256 != expected_sha256.lower():
+            logger.warning(f"SHA-256 mismatch for {filename}: expected {expected_sha256}, got {sha256}")
+            return False
+        
+        try:
+            self.cache_manager.write_manifest(
+                filename,
+                sha256=sha256,
+                revision=revision,
+                repository_id=self.model_config.repository_id
+            )
+        except Exception as e:
+            logger.warning(f"Cached model {filename} is not a valid GGUF file: {e}")
+            return False
+        
+        return True
     
     def get_model_path(self) -> Optional[str]:
         """Get the path to the model file."""
@@ -132,9 +295,13 @@ class ModelManager:
         
         return str(self.cache_manager.get_cache_path(self.model_config.filename))
     
-    def load_model(self):
-        """Load the model using llama-cpp-python."""
-        model_path = self.get_model_path()
+    def load_model(self, model_path: Optional[str] = None, logits_all: Optional[bool] = None):
+        """Load the model using llama-cpp-python.
+        
+        ``model_path`` overrides the cached file, e.g. with a staged local copy.
+        ``logits_all`` defaults to whether speculative requests may run on it.
+        """
+        model_path = model_path or self.get_model_path()
         if not model_path:
             raise RuntimeError("Model not available")
         
@@ -150,6 +317,10 @@ class ModelManager:
                 n_gpu_layers=self.model_config.n_gpu_layers,
                 n_ctx=self.model_config.n_ctx,
                 n_batch=self.model_config.n_batch,
+                n_threads=self.model_config.n_threads,
+                use_mmap=self.model_config.use_mmap,
+                use_mlock=self.model_config.use_mlock,
+                logits_all=self.speculation_enabled() if logits_all is None else logits_all,
                 verbose=False
             )
             
@@ -165,19 +336,70 @@ class ModelManager:
             logger.error(f"Error loading model: {e}")
             raise
     
+    def speculation_enabled(self) -> bool:
+        """Whether the model is built so speculative requests can run on it.
+        
+        llama-cpp-python verifies drafted tokens against the logits of every
+        evaluated position, which llama.cpp only keeps with ``logits_all``.
+        That also computes logits for every prompt token, so it is only
+        switched on when SPECULATIVE_MODE or a draft model asks for it.
+        """
+        return config.speculative.mode != "off" or bool(self.model_config.draft_filename)
+    
+    def get_draft_config(self) -> Optional[ModelConfig]:
+        """Configuration of the draft model for speculative decoding, if one is set."""
+        if not self.model_config.draft_filename:
+            return None
+        
+        return replace(
+            self.model_config,
+            repository_id=self.model_config.draft_repository_id or self.model_config.repository_id,
+            filename=self.model_config.draft_filename,
+            download_url=self.model_config.draft_download_url,
+            sha256=None,
+            n_gpu_layers=self.model_config.draft_n_gpu_layers,
+            staging_dir=None,
+            draft_filename=None
+        )
+    
+    def load_draft_model(self):
+        """Download the draft model if needed and load it."""
+        draft_config = self.get_draft_config()
+        if draft_config is None:
+            return None
+        
+        draft_manager = ModelManager(draft_config)
+        if not draft_manager.ensure_model_available():
+            raise RuntimeError(f"Draft model {draft_config.filename} is not available")
+        
+        # Drafts are sampled greedily from the last position only
+        return draft_manager.load_model(logits_all=False)
+    
     def get_cache_status(self) -> dict:
-        """Get cache status information."""
+        """Get cache status information.
+        
+        Served from the evictor's in-memory snapshot of the cache, which is
+        updated on downloads and evictions and re-read in the background, so
+        health checks do not scan the volume. ``cache_info.age_seconds`` tells
+        how old the snapshot is.
+        """
         filename = self.model_config.filename
+        evictor = get_cache_evictor()
+        file_info = evictor.get_file_info(filename)
         
         status = {
             "model_filename": filename,
-            "is_cached": self.cache_manager.is_cached(filename),
+            "is_cached": file_info is not None,
             "cache_path": str(self.cache_manager.get_cache_path(filename)),
-            "cache_info": self.cache_manager.get_cache_info()
+            "cache_info": evictor.get_cache_info()
         }
         
-        if status["is_cached"]:
-            status["file_size"] = self.cache_manager.get_file_size(filename)
-            status["is_valid"] = self.cache_manager.validate_cached_file(filename)
+        if file_info is not None:
+            status["file_size"] = file_info["size"]
+            # Verified against its manifest or hash when this worker started
+            status["is_valid"] = self._model_ready
+            if self._manifest is None and self._model_ready:
+                self._manifest = self.cache_manager.load_manifest(filename)
+            status["manifest"] = self._manifest
         
         return status
@@ -0,0 +1,449 @@
+"""Pool of loaded models with per-request selection and memory-budgeted eviction."""
+
+import asyncio
+import gc
+import importlib
+import logging
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Dict, Any, Optional, List, Iterator, Tuple
+
+from cache_eviction import get_cache_evictor
+from config import config, ModelConfig, ModelPoolConfig, SchedulerConfig
+from model_manager import ModelManager
+from model_staging import ModelStager, prefetch_model
+from inference_engine import InferenceEngine
+from scheduler import RequestScheduler
+from runtime_tuner import RuntimeTuner, TuningDecision
+from startup_profiler import StartupProfiler
+
+logger = logging.getLogger(__name__)
+
+
+class UnknownModelError(ValueError):
+    """Raised when a job names a model that is not in the registry."""
+
+
+def estimate_memory(model_config: ModelConfig, manifest: Optional[Dict[str, Any]]) -> Tuple[int, int]:
+    """Rough (VRAM, RAM) footprint of a model: its weights plus an f16 KV cache.
+
+    Offloaded layers are counted against VRAM, the rest against RAM. The KV
+    estimate ignores grouped-query attention, so it errs on the large side.
+    """
+    if not manifest:
+        return 0, 0
+
+    size = manifest.get("size", 0)
+    gguf = manifest.get("gguf") or {}
+    n_layers = gguf.get("block_count") or 0
+    n_embd = gguf.get("embedding_length") or 0
+    kv_bytes = 2 * n_layers * model_config.n_ctx * n_embd * 2
+
+    if n_layers:
+        offloaded = n_layers if model_config.n_gpu_layers < 0 else min(model_config.n_gpu_layers, n_layers)
+        fraction = offloaded / n_layers
+    else:
+        fraction = 1.0 if model_config.n_gpu_layers != 0 else 0.0
+
+    total = size + kv_bytes
+    vram = int(total * fraction)
+    return vram, total - vram
+
+
+class PooledModel:
+    """A resident model with its engine and scheduler."""
+
+    def __init__(self, name: str, manager: ModelManager, engine: InferenceEngine, scheduler: RequestScheduler,
+                 model_path: str, vram_bytes: int, ram_bytes: int, load_time: float, load_profile: StartupProfiler):
+        self.name = name
+        self.manager = manager
+        self.model_path = model_path
+        self.engine = engine
+        self.scheduler = scheduler
+        self.vram_bytes = vram_bytes
+        self.ram_bytes = ram_bytes
+        self.load_time = load_time
+        self.load_profile = load_profile
+        self.loaded_at = time.time()
+        self.last_used = self.loaded_at
+        self.in_flight = 0
+        # Readers such as the health check that keep the model from being unloaded
+        self.borrowers = 0
+        # Files on the volume this model holds an in-use lease on
+        self.cache_files: List[str] = []
+
+
+class ModelPool:
+    """Keeps registered models loaded within a VRAM/RAM budget.
+
+    Each resident model has its own engine and scheduler thread, so jobs for
+    different models run side by side. Models are loaded one at a time on a
+    background thread; jobs for a model that is not resident wait for its
+    load without holding up jobs for models that are. To make room, the least
+    recently used models without jobs in flight are unloaded.
+    """
+
+    def __init__(
+        self,
+        models: Optional[Dict[str, ModelConfig]] = None,
+        pool_config: Optional[ModelPoolConfig] = None,
+        tuner: Optional[RuntimeTuner] = None
+    ):
+        self.models = models or config.models
+        self.config = pool_config or config.pool
+        self.tuner = tuner or RuntimeTuner()
+
+        self._resident: "OrderedDict[str, PooledModel]" = OrderedDict()
+        self._loading: Dict[str, Future] = {}
+        self._cond = threading.Condition()
+        self._loader = ThreadPoolExecutor(max_workers=1, thread_name_prefix="model-loader")
+        self._stager = ModelStager()
+        self._evictor = get_cache_evictor()
+        self._evictor.start()
+
+        self.stats = {
+            "loads": 0,
+            "load_failures": 0,
+            "evictions": 0
+        }
+
+    def has_model(self, name: str) -> bool:
+        """Check whether a model name is registered."""
+        return name in self.models
+
+    def get_resident(self, name: str) -> Optional[PooledModel]:
+        """Return a loaded model without waiting or counting it as used."""
+        with self._cond:
+            return self._resident.get(name)
+
+    @contextmanager
+    def borrow(self, name: str) -> Iterator[Optional[PooledModel]]:
+        """A resident model that stays loaded until the block ends, or None.
+
+        Unlike ``acquire`` it neither loads the model nor counts as a job, so
+        status readers do not change what the pool or the backpressure sees.
+        """
+        with self._cond:
+            entry = self._resident.get(name)
+            if entry is not None:
+                entry.borrowers += 1
+        try:
+            yield entry
+        finally:
+            if entry is not None:
+                with self._cond:
+                    entry.borrowers -= 1
+                    self._cond.notify_all()
+
+    def load(self, name: str, profiler: Optional[StartupProfiler] = None) -> PooledModel:
+        """Load a model and wait for it (used at startup)."""
+        with self._cond:
+            future = self._request_load(name, profiler)
+        future.result()
+        return self.get_resident(name)
+
+    def adopt(self, name: str, model, model_path: str = "", scheduler_config: Optional[SchedulerConfig] = None) -> PooledModel:
+        """Make an already constructed model resident under a registered name.
+
+        Used by the benchmark to serve a stub model or a model file outside
+        the cache; nothing is downloaded and the memory budget is not checked.
+        """
+        model_config = self.models[name]
+        profiler = StartupProfiler()
+        start_time = time.time()
+
+        with profiler.phase("init_engine"):
+            engine = InferenceEngine(model, model_config)
+
+        with profiler.phase("start_scheduler"):
+            scheduler = RequestScheduler(engine, scheduler_config)
+            scheduler.start()
+
+        entry = PooledModel(
+            name, ModelManager(model_config), engine, scheduler, model_path, 0, 0, time.time() - start_time, profiler
+        )
+        with self._cond:
+            self._resident[name] = entry
+            self.stats["loads"] += 1
+            self._cond.notify_all()
+        return entry
+
+    async def acquire(self, name: str) -> PooledModel:
+        """Return a resident model, loading it in the background if needed.
+
+        Every acquire must be paired with ``release`` once the job is done;
+        models with jobs in flight are never evicted.
+        """
+        while True:
+            with self._cond:
+                entry = self._resident.get(name)
+                if entry is not None:
+                    entry.in_flight += 1
+                    entry.last_used = time.time()
+                    self._resident.move_to_end(name)
+                    return entry
+                future = self._request_load(name)
+
+            # The model may be evicted again before we get it, hence the loop
+            await asyncio.wrap_future(future)
+
+    def release(self, entry: PooledModel):
+        """Mark a job on a model as finished."""
+        with self._cond:
+            entry.in_flight -= 1
+            self._cond.notify_all()
+
+    def get_load(self) -> Tuple[int, float]:
+        """Jobs in flight on all models, and the longest expected queue wait among them."""
+        with self._cond:
+            in_flight = sum(entry.in_flight for entry in self._resident.values())
+            schedulers = [entry.scheduler for entry in self._resident.values()]
+
+        # A model unloaded meanwhile has no scheduler left
+        expected_wait = max((scheduler.expected_wait_seconds() for scheduler in schedulers if scheduler is not None), default=0.0)
+        return in_flight, expected_wait
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get pool counters and the state of every registered model."""
+        with self._cond:
+            models = {}
+            for name, model_config in self.models.items():
+                entry = self._resident.get(name)
+                info = {
+                    "filename": model_config.filename,
+                    "resident": entry is not None,
+                    "loading": name in self._loading
+                }
+                if entry is not None:
+                    info.update({
+                        "model_path": entry.model_path,
+                        "in_flight": entry.in_flight,
+                        "vram_bytes": entry.vram_bytes,
+                        "ram_bytes": entry.ram_bytes,
+                        "load_time": round(entry.load_time, 3),
+                        "load_phases": entry.load_profile.report()["phases"],
+                        "idle_seconds": round(time.time() - entry.last_used, 1),
+                        "scheduler": entry.scheduler.get_stats()
+                    })
+                models[name] = info
+
+            vram_used, ram_used = self._used_memory()
+            return {
+                **self.stats,
+                "default_model": config.model_name,
+                "max_models": self.config.max_models,
+                "vram_budget_bytes": self.config.vram_budget_mb * 1024 * 1024,
+                "ram_budget_bytes": self.config.ram_budget_mb * 1024 * 1024,
+                "vram_used_bytes": vram_used,
+                "ram_used_bytes": ram_used,
+                "staging": self._stager.get_stats(),
+                "models": models
+            }
+
+    def _request_load(self, name: str, profiler: Optional[StartupProfiler] = None) -> Future:
+        """Start loading a model unless that is already happening (caller holds the lock)."""
+        if name not in self.models:
+            raise UnknownModelError(
+                f"Unknown model '{name}'. Available models: {', '.join(sorted(self.models))}"
+            )
+
+        if name in self._resident:
+            future = Future()
+            future.set_result(None)
+            return future
+
+        future = self._loading.get(name)
+        if future is None:
+            future = self._loader.submit(self._load, name, profiler)
+            self._loading[name] = future
+        return future
+
+    def _load(self, name: str, profiler: Optional[StartupProfiler] = None):
+        """Download if needed, make room, and load a model (loader thread).
+
+        Independent steps overlap: ``llama_cpp`` is imported while the cache
+        is validated, and the page cache is warmed (or the model staged to
+        local disk) while the model is constructed. Every step is recorded as
+        a phase.
+        """
+        model_config = self.models[name]
+        profiler = profiler or StartupProfiler()
+        start_time = time.time()
+        cache_files = []
+
+        try:
+            llama_import = profiler.background("import_llama_cpp", importlib.import_module, "llama_cpp")
+
+            manager = ModelManager(model_config)
+            with profiler.phase("ensure_model"):
+                if not manager.ensure_model_available():
+                    raise RuntimeError(f"Model '{name}' is not available")
+
+            # Other workers sharing the volume must not evict the file while it is loaded
+            self._evictor.acquire(model_config.filename)
+            cache_files.append(model_config.filename)
+
+            with profiler.phase("read_manifest"):
+                manifest = manager.cache_manager.load_manifest(model_config.filename)
+                vram_bytes, ram_bytes = estimate_memory(model_config, manifest)
+
+            with profiler.phase("resolve_model_path"):
+                model_path = self._stager.resolve(
+                    str(manager.cache_manager.get_cache_path(model_config.filename)),
+                    model_config,
+                    manifest,
+                    profiler
+                )
+
+            # A running copy already streams the file through the page cache
+            if model_config.prefetch_weights and not self._stager.is_copying(model_config):
+                profiler.background(
+                    "prefetch_weights",
+                    prefetch_model,
+                    model_path,
+                    model_config.n_gpu_layers,
+                    model_config.download_workers
+                )
+
+            with profiler.phase("make_room"):
+                self._make_room(name, vram_bytes, ram_bytes)
+
+            # Tuned against the memory left after making room; the tuned estimates are what the model holds
+            tuning = None
+            if model_config.auto_tune:
+                with profiler.phase("auto_tune"):
+                    tuning = self._tune(name, model_config, model_path)
+                model_config = tuning.apply(model_config)
+                manager.model_config = model_config
+                vram_bytes, ram_bytes = tuning.estimated_vram_bytes, tuning.estimated_ram_bytes
+
+            with profiler.phase("wait_import_llama_cpp"):
+                profiler.wait(llama_import)
+
+            logger.info(f"Loading model '{name}' (~{vram_bytes / 1024**3:.1f} GB VRAM, ~{ram_bytes / 1024**3:.1f} GB RAM)")
+            with profiler.phase("construct_llama"):
+                model = manager.load_model(model_path)
+
+            draft_model = None
+            if model_config.draft_filename:
+                try:
+                    with profiler.phase("load_draft_model"):
+                        draft_model = manager.load_draft_model()
+                    self._evictor.acquire(model_config.draft_filename)
+                    cache_files.append(model_config.draft_filename)
+                except Exception as e:
+                    # Speculation falls back to prompt lookup without a draft model
+                    logger.warning(f"Draft model for '{name}' not loaded: {e}")
+
+            with profiler.phase("init_engine"):
+                engine = InferenceEngine(model, model_config, draft_model, tuning.report() if tuning else None)
+
+            with profiler.phase("start_scheduler"):
+                scheduler = RequestScheduler(engine)
+                scheduler.start()
+
+            entry = PooledModel(
+                name, manager, engine, scheduler, model_path, vram_bytes, ram_bytes, time.time() - start_time, profiler
+            )
+            entry.cache_files = cache_files
+            with self._cond:
+                self._resident[name] = entry
+                self.stats["loads"] += 1
+                self._cond.notify_all()
+
+            logger.info(f"Model '{name}' resident after {entry.load_time:.2f} seconds")
+
+        except Exception as e:
+            logger.error(f"Failed to load model '{name}': {e}")
+            self.stats["load_failures"] += 1
+            for filename in cache_files:
+                self._evictor.release(filename)
+            raise
+
+        finally:
+            with self._cond:
+                self._loading.pop(name, None)
+
+    def _tune(self, name: str, model_config: ModelConfig, model_path: str) -> TuningDecision:
+        """Pick a model's runtime settings within the hardware and what the pool budget leaves."""
+        with self._cond:
+            vram_used, ram_used = self._used_memory()
+        vram_budget = self.config.vram_budget_mb * 1024 * 1024
+        ram_budget = self.config.ram_budget_mb * 1024 * 1024
+
+        decision = self.tuner.tune_file(
+            model_config,
+            model_path,
+            vram_limit=vram_budget - vram_used if vram_budget else None,
+            ram_limit=ram_budget - ram_used if ram_budget else None
+        )
+        logger.info(
+            f"Auto-tuned model '{name}': n_gpu_layers={decision.n_gpu_layers}, n_ctx={decision.n_ctx}, "
+            f"n_batch={decision.n_batch}, n_threads={decision.n_threads} ({decision.reason}; "
+            f"~{decision.estimated_vram_bytes / 1024**3:.1f} GB VRAM, ~{decision.estimated_ram_bytes / 1024**3:.1f} GB RAM)"
+        )
+        return decision
+
+    def _used_memory(self) -> Tuple[int, int]:
+        """Estimated memory held by resident models (caller holds the lock)."""
+        vram = sum(entry.vram_bytes for entry in self._resident.values())
+        ram = sum(entry.ram_bytes for entry in self._resident.values())
+        return vram, ram
+
+    def _fits(self, vram_bytes: int, ram_bytes: int) -> bool:
+        """Check whether one more model fits next to the resident ones (caller holds the lock)."""
+        vram_used, ram_used = self._used_memory()
+        vram_budget = self.config.vram_budget_mb * 1024 * 1024
+        ram_budget = self.config.ram_budget_mb * 1024 * 1024
+        return (
+            len(self._resident) < self.config.max_models
+            and (not vram_budget or vram_used + vram_bytes <= vram_budget)
+            and (not ram_budget or ram_used + ram_bytes <= ram_budget)
+        )
+
+    def _make_room(self, name: str, vram_bytes: int, ram_bytes: int):
+        """Unload idle models, least recently used first, until the new one fits."""
+        vram_budget = self.config.vram_budget_mb * 1024 * 1024
+        ram_budget = self.config.ram_budget_mb * 1024 * 1024
+        if (vram_budget and vram_bytes > vram_budget) or (ram_budget and ram_bytes > ram_budget):
+            raise RuntimeError(f"Model '{name}' does not fit in the pool budget even when it is empty")
+
+        while True:
+            with self._cond:
+                if self._fits(vram_bytes, ram_bytes):
+                    return
+
+                victim = next(
+                    (entry for entry in self._resident.values() if entry.in_flight == 0 and entry.borrowers == 0), None
+                )
+                if victim is None:
+                    # Every resident model is busy; wait for a job to finish
+                    self._cond.wait(1.0)
+                    continue
+
+                del self._resident[victim.name]
+
+            self._unload(victim)
+            self.stats["evictions"] += 1
+
+    def _unload(self, entry: PooledModel):
+        """Stop a model's scheduler and free the model."""
+        logger.info(f"Unloading model '{entry.name}' (idle for {time.time() - entry.last_used:.0f}s)")
+        entry.scheduler.stop()
+        entry.engine.close()
+
+        close = getattr(entry.engine.model, "close", None)
+        if callable(close):
+            close()
+
+        entry.engine = None
+        entry.scheduler = None
+        gc.collect()
+
+        # Unused files become eviction candidates, most recently used last
+        for filename in entry.cache_files:
+            self._evictor.touch(filename)
+            self._evictor.release(filename)
@@ -0,0 +1,237 @@
+"""Staging of model files from the network volume onto local disk."""
+
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, Any, List, Optional, Tuple
+
+from config import ModelConfig
+from cache_manager import warm_page_cache
+from gguf_reader import GGUFInfo, read_gguf_info
+from startup_profiler import StartupProfiler
+
+logger = logging.getLogger(__name__)
+
+STAGED_MARKER_SUFFIX = ".staged.json"
+COPY_CHUNK_SIZE = 64 * 1024 * 1024
+
+
+def prefetch_ranges(info: GGUFInfo, n_gpu_layers: int) -> List[Tuple[int, int]]:
+    """Byte ranges of the weights in the order they are needed.
+
+    Tensors that stay on the CPU are read on every token, so they come first.
+    The offloaded ones follow in file order, which is the order llama.cpp
+    uploads them in. llama.cpp offloads the last ``n_gpu_layers`` blocks, and
+    the output layer only when more layers than blocks are requested.
+    """
+    n_layers = info.arch_value("block_count") or 0
+    offloaded = n_layers if n_gpu_layers < 0 else min(n_gpu_layers, n_layers)
+    first_gpu_layer = n_layers - offloaded
+    output_on_gpu = n_gpu_layers < 0 or n_gpu_layers > n_layers
+
+    def on_cpu(name: str) -> bool:
+        if name.startswith("blk."):
+            return int(name.split(".")[1]) < first_gpu_layer
+        if name.startswith("output"):
+            return not output_on_gpu
+        return True  # Token embeddings are always looked up on the CPU
+
+    tensors = sorted(info.tensors, key=lambda tensor: tensor.offset)
+    ordered = [t for t in tensors if on_cpu(t.name)] + [t for t in tensors if not on_cpu(t.name)]
+
+    ranges: List[Tuple[int, int]] = []
+    for tensor in ordered:
+        if ranges and ranges[-1][0] + ranges[-1][1] == tensor.offset:
+            ranges[-1] = (ranges[-1][0], ranges[-1][1] + tensor.size)
+        else:
+            ranges.append((tensor.offset, tensor.size))
+    return ranges
+
+
+def prefetch_model(path: str, n_gpu_layers: int, workers: int = 4) -> int:
+    """Warm the page cache with a model's weights, most urgently needed first."""
+    info = read_gguf_info(path)
+    return warm_page_cache(path, workers=workers, ranges=prefetch_ranges(info, n_gpu_layers))
+
+
+class ModelStager:
+    """Copies model files onto local disk in the background.
+
+    Page faults against the network volume dominate load time and the first
+    tokens, so a model with a ``staging_dir`` is copied there with large
+    parallel reads. Until the copy is complete the model is loaded from the
+    volume (unless ``staging_wait`` is set); later loads use the local copy.
+    A ``.staged.json`` marker ties each copy to the manifest it was made from.
+    """
+
+    def __init__(self, workers: int = 8, chunk_size: int = COPY_CHUNK_SIZE):
+        self.workers = workers
+        self.chunk_size = chunk_size
+        self._copies: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+
+        self.stats = {
+            "copies_completed": 0,
+            "copies_failed": 0,
+            "bytes_copied": 0,
+            "local_loads": 0,
+            "volume_loads": 0
+        }
+
+    def resolve(
+        self,
+        source_path: str,
+        model_config: ModelConfig,
+        manifest: Optional[Dict[str, Any]],
+        profiler: Optional[StartupProfiler] = None
+    ) -> str:
+        """Return the path to load a model from, starting a copy if there is none yet."""
+        if not model_config.staging_dir or not manifest:
+            return source_path
+
+        staged_path = Path(model_config.staging_dir) / model_config.filename
+        if self.is_staged(staged_path, manifest):
+            self.stats["local_loads"] += 1
+            return str(staged_path)
+
+        future = self._start_copy(source_path, staged_path, manifest, profiler)
+        if model_config.staging_wait:
+            try:
+                profiler.wait(future) if profiler is not None else future.result()
+                self.stats["local_loads"] += 1
+                return str(staged_path)
+            except Exception:
+                pass  # Logged by the copy, fall back to the volume
+
+        logger.info(f"Loading {model_config.filename} from the volume while it is staged to {staged_path}")
+        self.stats["volume_loads"] += 1
+        return source_path
+
+    def is_copying(self, model_config: ModelConfig) -> bool:
+        """Check whether a copy of this model is in progress."""
+        if not model_config.staging_dir:
+            return False
+        staged_path = str(Path(model_config.staging_dir) / model_config.filename)
+        with self._lock:
+            future = self._copies.get(staged_path)
+            return future is not None and not future.done()
+
+    @staticmethod
+    def is_staged(staged_path: Path, manifest: Dict[str, Any]) -> bool:
+        """Check a local copy against the manifest of the volume copy."""
+        marker_path = staged_path.with_name(staged_path.name + STAGED_MARKER_SUFFIX)
+        try:
+            with open(marker_path, "r") as f:
+                marker = json.load(f)
+            size = staged_path.stat().st_size
+        except (OSError, ValueError):
+            return False
+
+        return size == manifest.get("size") and marker.get("sha256") == manifest.get("sha256")
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get staging counters."""
+        with self._lock:
+            in_progress = [path for path, future in self._copies.items() if not future.done()]
+        return {**self.stats, "in_progress": in_progress}
+
+    def _start_copy(
+        self,
+        source_path: str,
+        staged_path: Path,
+        manifest: Dict[str, Any],
+        profiler: Optional[StartupProfiler]
+    ) -> Future:
+        with self._lock:
+            future = self._copies.get(str(staged_path))
+            if future is None or future.done():
+                profiler = profiler or StartupProfiler()
+                future = profiler.background("stage_model", self._copy, source_path, staged_path, manifest)
+                self._copies[str(staged_path)] = future
+            return future
+
+    def _copy(self, source_path: str, staged_path: Path, manifest: Dict[str, Any]) -> str:
+        """Copy with parallel positioned reads and writes, then publish atomically."""
+        size = manifest["size"]
+        part_path = staged_path.with_name(staged_path.name + ".part")
+        marker_path = staged_path.with_name(staged_path.name + STAGED_MARKER_SUFFIX)
+        start_time = time.time()
+
+        try:
+            staged_path.parent.mkdir(parents=True, exist_ok=True)
+            marker_path.unlink(missing_ok=True)
+            self._make_space(staged_path, size)
+
+            source_fd = os.open(source_path, os.O_RDONLY)
+            target_fd = os.open(part_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+            try:
+                os.ftruncate(target_fd, size)
+                if hasattr(os, "posix_fadvise"):
+                    os.posix_fadvise(source_fd, 0, size, os.POSIX_FADV_SEQUENTIAL)
+
+                def copy_chunk(offset: int) -> int:
+                    buffer = bytearray(min(self.chunk_size, size - offset))
+                    read = os.preadv(source_fd, [buffer], offset)
+                    if read != len(buffer):
+                        raise IOError(f"Short read at offset {offset}: {read}/{len(buffer)} bytes")
+                    written = os.pwrite(target_fd, buffer, offset)
+                    if written != read:
+                        raise IOError(f"Short write at offset {offset}: {written}/{read} bytes")
+                    return written
+
+                with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="stage") as pool:
+                    copied = sum(pool.map(copy_chunk, range(0, size, self.chunk_size)))
+
+                os.fsync(target_fd)
+            finally:
+                os.close(source_fd)
+                os.close(target_fd)
+
+            os.replace(part_path, staged_path)
+            with open(marker_path, "w") as f:
+                json.dump({"sha256": manifest.get("sha256"), "size": size, "staged_at": time.time()}, f)
+
+        except Exception as e:
+            logger.error(f"Staging {staged_path.name} failed: {e}")
+            part_path.unlink(missing_ok=True)
+            self.stats["copies_failed"] += 1
+            raise
+
+        elapsed = time.time() - start_time
+        self.stats["copies_completed"] += 1
+        self.stats["bytes_copied"] += copied
+        logger.info(
+            f"Staged {staged_path.name} in {elapsed:.1f}s ({copied / max(elapsed, 1e-6) / 1024**2:.0f} MB/s); "
+            f"the local copy is used from the next load on"
+        )
+        return str(staged_path)
+
+    def _make_space(self, staged_path: Path, size: int):
+        """Remove the oldest other staged models until the copy fits."""
+        free = shutil.disk_usage(staged_path.parent).free
+        if staged_path.exists():
+            free += staged_path.stat().st_size
+
+        others = sorted(
+            (marker.stat().st_mtime, marker)
+            for marker in staged_path.parent.glob(f"*{STAGED_MARKER_SUFFIX}")
+            if marker.name != staged_path.name + STAGED_MARKER_SUFFIX
+        )
+        for _, marker in others:
+            if free >= size:
+                break
+            model_path = marker.with_name(marker.name[:-len(STAGED_MARKER_SUFFIX)])
+            # A model that is still mapped keeps its pages until it is unloaded
+            if model_path.exists():
+                free += model_path.stat().st_size
+                model_path.unlink()
+            marker.unlink(missing_ok=True)
+            logger.info(f"Removed staged copy {model_path.name} to make space")
+
+        if free < size:
+            raise IOError(f"Not enough space in {staged_path.parent}: need {size} bytes, {free} free")
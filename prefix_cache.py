@@ -0,0 +1,268 @@
+"""Token-prefix KV state cache for llama.cpp."""
+
+import logging
+import threading
+from collections import OrderedDict
+from typing import Dict, Any, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class _RadixNode:
+    """Node of a radix tree over token ids."""
+
+    __slots__ = ("label", "children", "keys")
+
+    def __init__(self, label: Tuple[int, ...] = ()):
+        self.label = label
+        self.children: Dict[int, "_RadixNode"] = {}
+        self.keys = set()  # Cached keys stored in this node's subtree
+
+
+class TokenRadixIndex:
+    """Radix tree that finds the stored key sharing the longest prefix with a query."""
+
+    def __init__(self):
+        self.root = _RadixNode()
+
+    def insert(self, key: Tuple[int, ...]):
+        """Add a key to the index."""
+        node = self.root
+        node.keys.add(key)
+        position = 0
+
+        while position < len(key):
+            child = node.children.get(key[position])
+            if child is None:
+                child = _RadixNode(key[position:])
+                node.children[key[position]] = child
+                child.keys.add(key)
+                return
+
+            common = _common_prefix_length(child.label, key, position)
+            if common < len(child.label):
+                # Split the edge so the shared part becomes its own node
+                middle = _RadixNode(child.label[:common])
+                middle.keys = set(child.keys)
+                child.label = child.label[common:]
+                middle.children[child.label[0]] = child
+                node.children[key[position]] = middle
+                child = middle
+
+            child.keys.add(key)
+            node = child
+            position += common
+
+    def remove(self, key: Tuple[int, ...]):
+        """Remove a key and prune branches that no longer lead to any key."""
+        node = self.root
+        node.keys.discard(key)
+        position = 0
+
+        while position < len(key):
+            child = node.children.get(key[position])
+            if child is None:
+                return
+
+            child.keys.discard(key)
+            if not child.keys:
+                del node.children[key[position]]
+                return
+
+            node = child
+            position += len(child.label)
+
+    def longest_match(self, query: Sequence[int]) -> Tuple[int, set]:
+        """Return the longest shared prefix length and the keys that share it."""
+        node = self.root
+        position = 0
+
+        while position < len(query):
+            child = node.children.get(query[position])
+            if child is None:
+                break
+
+            common = _common_prefix_length(child.label, query, position)
+            position += common
+            node = child
+            if common < len(child.label):
+                break
+
+        return position, node.keys
+
+
+def _common_prefix_length(label: Tuple[int, ...], tokens: Sequence[int], offset: int) -> int:
+    """Count how many tokens of ``label`` match ``tokens`` starting at ``offset``."""
+    limit = min(len(label), len(tokens) - offset)
+    length = 0
+    while length < limit and label[length] == tokens[offset + length]:
+        length += 1
+    return length
+
+
+def longest_common_prefix(a: Sequence[int], b: Sequence[int]) -> int:
+    """Length of the shared prefix of two token sequences."""
+    length = 0
+    for x, y in zip(a, b):
+        if x != y:
+            break
+        length += 1
+    return length
+
+
+def state_size(state) -> int:
+    """Approximate host memory held by a saved llama.cpp state."""
+    size = int(getattr(state, "llama_state_size", 0) or 0)
+    for name in ("input_ids", "scores"):
+        array = getattr(state, name, None)
+        if array is not None:
+            size += int(getattr(array, "nbytes", 0))
+    return size
+
+
+class PrefixKVCache:
+    """KV state cache keyed by token sequence, with longest-prefix lookup.
+
+    It implements the cache protocol of ``llama_cpp.Llama`` (``set_cache``):
+    on every completion llama.cpp asks for the state matching the prompt,
+    restores it when it covers more of the prompt than what is already in the
+    context, evaluates only the remaining suffix, and stores the final state
+    again. Entries are evicted least-recently-used first once the memory
+    budget is exceeded.
+
+    Storing means llama.cpp copies the whole KV cache and its logits buffer
+    first, so the cache is only attached to prompts of ``min_save_tokens``
+    or more (``wants``); ``stored_bytes`` counts what those copies cost.
+    """
+
+    def __init__(self, max_bytes: int, min_prefix_tokens: int = 32, model=None, min_save_tokens: int = 0):
+        self.max_bytes = max_bytes
+        self.min_prefix_tokens = min_prefix_tokens
+        self.min_save_tokens = max(min_save_tokens, min_prefix_tokens)
+        self.model = model
+        self._index = TokenRadixIndex()
+        self._entries: "OrderedDict[Tuple[int, ...], Any]" = OrderedDict()
+        self._sizes: Dict[Tuple[int, ...], int] = {}
+        self._lock = threading.Lock()
+
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.saved_tokens = 0
+        self.evictions = 0
+        self.stores = 0
+        self.stored_bytes = 0
+        self.skipped_prompts = 0
+
+    def wants(self, prompt_tokens: int) -> bool:
+        """Whether a prompt is long enough to be worth saving and looking up."""
+        if prompt_tokens >= self.min_save_tokens:
+            return True
+
+        with self._lock:
+            self.skipped_prompts += 1
+        return False
+
+    def __bool__(self) -> bool:
+        # llama.cpp checks ``if self.cache:`` before using it
+        return True
+
+    def _find(self, tokens: Sequence[int]) -> Tuple[Optional[Tuple[int, ...]], int]:
+        """Find the most recently used entry sharing the longest prefix (caller holds the lock)."""
+        match_length, keys = self._index.longest_match(tokens)
+        if match_length < self.min_prefix_tokens or not keys:
+            return None, match_length
+
+        for key in reversed(self._entries):
+            if key in keys:
+                return key, match_length
+
+        return None, match_length
+
+    def __contains__(self, tokens: Sequence[int]) -> bool:
+        with self._lock:
+            key, _ = self._find(tokens)
+            return key is not None
+
+    def __getitem__(self, tokens: Sequence[int]):
+        with self._lock:
+            key, _ = self._find(tokens)
+            if key is None:
+                self.misses += 1
+                raise KeyError("No cached prefix for prompt")
+
+            self.hits += 1
+            state = self._entries[key]
+            self._entries.move_to_end(key)
+
+            # llama.cpp only loads the state when it covers more of the prompt than its context already holds
+            cached = longest_common_prefix(state.input_ids[:state.n_tokens].tolist(), tokens)
+            resident = self._resident_prefix(tokens)
+            if cached > resident:
+                self.saved_tokens += cached - resident
+            return state
+
+    def __setitem__(self, tokens: Sequence[int], state):
+        key = tuple(tokens)
+        size = state_size(state)
+
+        with self._lock:
+            self.stores += 1
+            self.stored_bytes += size
+
+        if size > self.max_bytes:
+            logger.debug(f"KV state of {size} bytes exceeds prefix cache budget, not caching")
+            return
+
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+
+            self._entries[key] = state
+            self._sizes[key] = size
+            self._index.insert(key)
+            self.current_bytes += size
+
+            while self.current_bytes > self.max_bytes and len(self._entries) > 1:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self.evictions += 1
+
+    def _remove(self, key: Tuple[int, ...]):
+        """Drop an entry (caller holds the lock)."""
+        del self._entries[key]
+        self.current_bytes -= self._sizes.pop(key)
+        self._index.remove(key)
+
+    def _resident_prefix(self, tokens: Sequence[int]) -> int:
+        """Prefix of the prompt already held in the model's live context."""
+        if self.model is None:
+            return 0
+
+        return longest_common_prefix(self.model._input_ids.tolist(), tokens)
+
+    def clear(self):
+        """Drop every cached state."""
+        with self._lock:
+            self._entries.clear()
+            self._sizes.clear()
+            self._index = TokenRadixIndex()
+            self.current_bytes = 0
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get cache counters."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "size_bytes": self.current_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "saved_tokens": self.saved_tokens,
+                "evictions": self.evictions,
+                "stores": self.stores,
+                "stored_bytes": self.stored_bytes,
+                "skipped_prompts": self.skipped_prompts
+            }
@@ -0,0 +1,263 @@
+"""Memoization of deterministic generation results."""
+
+import hashlib
+import json
+import logging
+import os
+import queue
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, Any, List, Optional, Union
+
+logger = logging.getLogger(__name__)
+
+
+def is_deterministic(params) -> bool:
+    """Greedy decoding or a fixed seed always produces the same output."""
+    return params.temperature == 0.0 or params.seed is not None
+
+
+def normalize_params(params) -> Dict[str, Any]:
+    """Reduce inference parameters to the ones that influence the output."""
+    normalized = {
+        "max_tokens": int(params.max_tokens),
+        "repeat_penalty": round(float(params.repeat_penalty), 6),
+        "stop": sorted(params.stop_sequences or [])
+    }
+
+    # Only present when set, so keys of unconstrained requests stay the same
+    if params.json_schema is not None:
+        normalized["json_schema"] = params.json_schema
+    if params.grammar is not None:
+        normalized["grammar"] = params.grammar
+
+    if params.temperature == 0.0:
+        # Greedy decoding ignores the sampler settings and the seed
+        normalized["temperature"] = 0.0
+    else:
+        normalized.update({
+            "temperature": round(float(params.temperature), 6),
+            "top_p": round(float(params.top_p), 6),
+            "top_k": int(params.top_k),
+            "seed": int(params.seed)
+        })
+
+    return normalized
+
+
+def make_cache_key(prompt: Union[str, List[int]], params, model_id: str) -> str:
+    """Canonical hash of the formatted prompt, model and normalized parameters."""
+    payload = json.dumps(
+        {"model": model_id, "prompt": prompt, "params": normalize_params(params)},
+        sort_keys=True,
+        separators=(",", ":"),
+        ensure_ascii=False
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """LRU cache of generation results with TTL and an optional volume tier."""
+
+    def __init__(
+        self,
+        max_entries: int = 1024,
+        max_bytes: int = 64 * 1024 * 1024,
+        ttl_seconds: int = 3600,
+        disk_dir: Optional[str] = None,
+        max_disk_entries: int = 100000
+    ):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.disk_dir = Path(disk_dir) if disk_dir else None
+        self.max_disk_entries = max_disk_entries
+
+        self._entries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._writes = None
+        self._writer = None
+
+        self.stats = {
+            "hits": 0,
+            "disk_hits": 0,
+            "misses": 0,
+            "stores": 0,
+            "evictions": 0,
+            "expired": 0,
+            "lookup_time_us_total": 0.0
+        }
+
+        if self.disk_dir is not None:
+            self.disk_dir.mkdir(parents=True, exist_ok=True)
+            self._writes = queue.Queue()
+            self._writer = threading.Thread(target=self._write_loop, name="response-cache-writer", daemon=True)
+            self._writer.start()
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """Return a cached result, or None."""
+        start = time.perf_counter()
+        now = time.time()
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry["expires_at"] < now:
+                self._drop(key)
+                self.stats["expired"] += 1
+                entry = None
+
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.stats["hits"] += 1
+                self.stats["lookup_time_us_total"] += (time.perf_counter() - start) * 1e6
+                return entry["result"]
+
+        result = self._read_disk(key, now) if self.disk_dir is not None else None
+
+        with self._lock:
+            if result is None:
+                self.stats["misses"] += 1
+            else:
+                self.stats["disk_hits"] += 1
+            self.stats["lookup_time_us_total"] += (time.perf_counter() - start) * 1e6
+
+        if result is not None:
+            self._put_memory(key, result, now)
+
+        return result
+
+    def put(self, key: str, result: Dict[str, Any]):
+        """Store a result."""
+        now = time.time()
+        self._put_memory(key, result, now)
+        self.stats["stores"] += 1
+
+        if self._writes is not None:
+            self._writes.put((key, result, now + self.ttl_seconds))
+
+    def close(self):
+        """Finish pending writes and stop the writer thread."""
+        if self._writer is not None:
+            self._writes.put(None)
+            self._writer.join()
+            self._writer = None
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get cache counters."""
+        with self._lock:
+            lookups = self.stats["hits"] + self.stats["disk_hits"] + self.stats["misses"]
+            stats = {k: v for k, v in self.stats.items() if k != "lookup_time_us_total"}
+            stats.update({
+                "entries": len(self._entries),
+                "size_bytes": self._bytes,
+                "hit_rate": round((self.stats["hits"] + self.stats["disk_hits"]) / lookups, 4) if lookups else 0.0,
+                "avg_lookup_us": round(self.stats["lookup_time_us_total"] / lookups, 2) if lookups else 0.0,
+                "disk_tier": self.disk_dir is not None
+            })
+            return stats
+
+    def _put_memory(self, key: str, result: Dict[str, Any], now: float):
+        size = len(json.dumps(result))
+
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+
+            if size > self.max_bytes:
+                return
+
+            self._entries[key] = {"result": result, "size": size, "expires_at": now + self.ttl_seconds}
+            self._bytes += size
+
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                self._drop(next(iter(self._entries)))
+                self.stats["evictions"] += 1
+
+    def _drop(self, key: str):
+        """Remove an in-memory entry (caller holds the lock)."""
+        entry = self._entries.pop(key)
+        self._bytes -= entry["size"]
+
+    def _disk_path(self, key: str) -> Path:
+        return self.disk_dir / key[:2] / f"{key}.json"
+
+    def _read_disk(self, key: str, now: float) -> Optional[Dict[str, Any]]:
+        path = self._disk_path(key)
+
+        try:
+            with open(path, "r") as f:
+                entry = json.load(f)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.warning(f"Error reading cached response {key}: {e}")
+            return None
+
+        if entry.get("expires_at", 0) < now:
+            path.unlink(missing_ok=True)
+            self.stats["expired"] += 1
+            return None
+
+        return entry["result"]
+
+    def _sweep_disk(self):
+        """Delete expired results, then the oldest ones above the entry limit.
+
+        Only file metadata is read: a result is written when it is stored, so
+        its mtime plus the TTL is its expiry. Reads still check ``expires_at``.
+        """
+        now = time.time()
+        files = []
+
+        for path in self.disk_dir.glob("*/*.json"):
+            try:
+                modified = path.stat().st_mtime
+            except FileNotFoundError:
+                continue
+
+            if now - modified > self.ttl_seconds:
+                path.unlink(missing_ok=True)
+                continue
+            files.append((modified, path))
+
+        # Leftovers of writers that died between writing and renaming
+        for path in self.disk_dir.glob("*/*.tmp"):
+            try:
+                if now - path.stat().st_mtime > self.ttl_seconds:
+                    path.unlink(missing_ok=True)
+            except FileNotFoundError:
+                continue
+
+        excess = len(files) - self.max_disk_entries
+        for _, path in sorted(files)[:max(excess, 0)]:
+            path.unlink(missing_ok=True)
+
+    def _write_loop(self):
+        """Persist results to the volume off the request path."""
+        writes = 0
+        while True:
+            item = self._writes.get()
+            if item is None:
+                return
+            key, result, expires_at = item
+            writes += 1
+            if writes % 256 == 0:
+                try:
+                    self._sweep_disk()
+                except Exception as e:
+                    logger.error(f"Error sweeping response cache: {e}")
+
+            path = self._disk_path(key)
+            try:
+                path.parent.mkdir(parents=True, exist_ok=True)
+                # Workers on the volume store the same key for the same deterministic request
+                temp_path = path.with_name(f"{path.name}.{uuid.uuid4().hex}.tmp")
+                with open(temp_path, "w") as f:
+                    json.dump({"expires_at": expires_at, "result": result}, f)
+                os.replace(temp_path, path)
+            except Exception as e:
+                logger.error(f"Error persisting cached response {key}: {e}")
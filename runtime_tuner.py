@@ -0,0 +1,358 @@
+"""Choice of offload, context, batch and thread settings from the model and the hardware."""
+
+import logging
+import math
+import os
+import subprocess
+from dataclasses import dataclass, field, replace
+from typing import Dict, Any, Optional, List, Tuple
+
+from config import config, ModelConfig, TuningConfig
+from gguf_reader import GGUFInfo, read_gguf_info
+
+logger = logging.getLogger(__name__)
+
+MB = 1024 * 1024
+BATCH_SIZES = (2048, 1024, 512, 256, 128)
+CONTEXT_STEP = 256
+
+
+@dataclass
+class HardwareInfo:
+    """Resources available to the worker; None where they could not be determined."""
+    vram_free_bytes: Optional[int] = None  # Summed over all GPUs; 0 means no GPU
+    vram_total_bytes: Optional[int] = None
+    gpu_count: int = 0
+    ram_available_bytes: Optional[int] = None
+    cpu_cores: int = 1
+
+
+class HardwareProbe:
+    """Reads free VRAM from ``nvidia-smi``, RAM from ``/proc/meminfo`` and CPU cores from the cgroup.
+
+    The tuner only calls ``probe``, so tests and benchmarks can pass any
+    object with that method instead.
+    """
+
+    def __init__(self, nvidia_smi: str = "nvidia-smi", timeout: float = 10.0):
+        self.nvidia_smi = nvidia_smi
+        self.timeout = timeout
+
+    def probe(self) -> HardwareInfo:
+        free, total, count = self._gpu_memory()
+        return HardwareInfo(
+            vram_free_bytes=free,
+            vram_total_bytes=total,
+            gpu_count=count,
+            ram_available_bytes=self._available_ram(),
+            cpu_cores=self._cpu_cores()
+        )
+
+    def _gpu_memory(self) -> Tuple[Optional[int], Optional[int], int]:
+        """Free and total VRAM of every visible GPU, in bytes."""
+        try:
+            output = subprocess.run(
+                [self.nvidia_smi, "--query-gpu=memory.free,memory.total", "--format=csv,noheader,nounits"],
+                capture_output=True,
+                text=True,
+                timeout=self.timeout,
+                check=True
+            ).stdout
+        except FileNotFoundError:
+            return 0, 0, 0  # No NVIDIA driver: CPU only
+        except Exception as e:
+            logger.warning(f"Could not query GPU memory: {e}")
+            return None, None, 0
+
+        free = total = count = 0
+        for line in output.strip().splitlines():
+            free_mb, total_mb = (int(value.strip()) for value in line.split(","))
+            free += free_mb * MB
+            total += total_mb * MB
+            count += 1
+        return free, total, count
+
+    def _available_ram(self) -> Optional[int]:
+        """MemAvailable, capped by the container's cgroup memory limit."""
+        available = None
+        try:
+            with open("/proc/meminfo") as f:
+                for line in f:
+                    if line.startswith("MemAvailable:"):
+                        available = int(line.split()[1]) * 1024
+                        break
+        except OSError:
+            return None
+
+        try:
+            with open("/sys/fs/cgroup/memory.max") as f:
+                limit = f.read().strip()
+            with open("/sys/fs/cgroup/memory.current") as f:
+                used = int(f.read().strip())
+            if limit != "max" and available is not None:
+                available = min(available, int(limit) - used)
+        except (OSError, ValueError):
+            pass
+
+        return available
+
+    def _cpu_cores(self) -> int:
+        """Cores this process may run on, capped by the cgroup CPU quota."""
+        cores = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else (os.cpu_count() or 1)
+        try:
+            with open("/sys/fs/cgroup/cpu.max") as f:
+                quota, period = f.read().split()
+            if quota != "max":
+                cores = min(cores, max(math.ceil(int(quota) / int(period)), 1))
+        except (OSError, ValueError):
+            pass
+        return cores
+
+
+@dataclass
+class ModelProfile:
+    """What the tuner needs to know about a model, read from its GGUF header."""
+    n_layers: int
+    layer_bytes: List[int]  # Weights of each repeating block
+    input_bytes: int  # Token embeddings, always kept on the CPU
+    output_bytes: int  # Output norm and head, offloaded with the last layer
+    trained_ctx: int
+    n_embd: int
+    n_embd_kv: int  # Width of the K and V rows, smaller than n_embd with grouped-query attention
+    n_head: int
+    n_vocab: int
+
+    @classmethod
+    def from_gguf(cls, info: GGUFInfo) -> "ModelProfile":
+        n_layers = int(info.arch_value("block_count") or 0)
+        layer_bytes = [0] * n_layers
+        input_bytes = output_bytes = 0
+        n_vocab = 0
+
+        for tensor in info.tensors:
+            if tensor.name.startswith("blk."):
+                index = int(tensor.name.split(".")[1])
+                if index < n_layers:
+                    layer_bytes[index] += tensor.size
+            elif tensor.name.startswith("output"):
+                output_bytes += tensor.size
+            else:
+                input_bytes += tensor.size
+            if tensor.name == "token_embd.weight" and len(tensor.shape) == 2:
+                n_vocab = tensor.shape[1]
+
+        n_embd = int(info.arch_value("embedding_length") or 0)
+        n_head = _largest(info.arch_value("attention.head_count")) or 1
+        n_head_kv = _largest(info.arch_value("attention.head_count_kv")) or n_head
+
+        return cls(
+            n_layers=n_layers,
+            layer_bytes=layer_bytes,
+            input_bytes=input_bytes,
+            output_bytes=output_bytes,
+            trained_ctx=int(info.arch_value("context_length") or 0),
+            n_embd=n_embd,
+            n_embd_kv=n_embd * n_head_kv // n_head,
+            n_head=n_head,
+            n_vocab=n_vocab
+        )
+
+    def kv_bytes(self, n_ctx: int, n_layers: int) -> int:
+        """f16 K and V cache of ``n_layers`` layers."""
+        return 2 * n_ctx * self.n_embd_kv * 2 * n_layers
+
+    def compute_bytes(self, n_ctx: int, n_batch: int) -> int:
+        """Rough size of llama.cpp's compute buffer: logits, activations and one layer's attention scores."""
+        return n_batch * 4 * (self.n_vocab + 4 * self.n_embd + self.n_head * n_ctx)
+
+    def gpu_bytes(self, n_gpu_layers: int, n_ctx: int, n_batch: int) -> int:
+        """VRAM used with the last ``n_gpu_layers`` blocks offloaded, their KV cache included."""
+        if n_gpu_layers <= 0:
+            return 0
+        offloaded = min(n_gpu_layers, self.n_layers)
+        weights = sum(self.layer_bytes[self.n_layers - offloaded:])
+        if n_gpu_layers > self.n_layers:
+            weights += self.output_bytes
+        return weights + self.kv_bytes(n_ctx, offloaded) + self.compute_bytes(n_ctx, n_batch)
+
+    def cpu_bytes(self, n_gpu_layers: int, n_ctx: int, n_batch: int, count_weights: bool) -> int:
+        """Host RAM used by what is not offloaded. Mapped weights are only counted with ``count_weights``."""
+        on_cpu = self.n_layers - min(max(n_gpu_layers, 0), self.n_layers)
+        total = self.kv_bytes(n_ctx, on_cpu)
+        if count_weights:
+            total += sum(self.layer_bytes[:on_cpu]) + self.input_bytes
+            if n_gpu_layers <= self.n_layers:
+                total += self.output_bytes
+        if n_gpu_layers <= 0:
+            total += self.compute_bytes(n_ctx, n_batch)
+        return total
+
+
+def _largest(value) -> int:
+    """Per-layer values (lists) are reduced to their largest entry."""
+    if isinstance(value, list):
+        return max(value) if value else 0
+    return int(value or 0)
+
+
+@dataclass
+class TuningDecision:
+    """Settings chosen for one model and the figures they were chosen from."""
+    n_gpu_layers: int
+    n_ctx: int
+    n_batch: int
+    n_threads: int
+    reason: str
+    estimated_vram_bytes: int = 0
+    estimated_ram_bytes: int = 0
+    hardware: Dict[str, Any] = field(default_factory=dict)
+
+    def apply(self, model_config: ModelConfig) -> ModelConfig:
+        return replace(
+            model_config,
+            n_gpu_layers=self.n_gpu_layers,
+            n_ctx=self.n_ctx,
+            n_batch=self.n_batch,
+            n_threads=self.n_threads
+        )
+
+    def report(self) -> Dict[str, Any]:
+        return {
+            "n_gpu_layers": self.n_gpu_layers,
+            "n_ctx": self.n_ctx,
+            "n_batch": self.n_batch,
+            "n_threads": self.n_threads,
+            "reason": self.reason,
+            "estimated_vram_bytes": self.estimated_vram_bytes,
+            "estimated_ram_bytes": self.estimated_ram_bytes,
+            "hardware": self.hardware
+        }
+
+
+class RuntimeTuner:
+    """Picks the largest offload, context, batch and thread settings that fit the hardware.
+
+    Offloading every layer comes first: the context shrinks (down to
+    ``min_ctx``) before layers are left on the CPU. Whatever VRAM is left
+    then goes to a larger batch. Memory figures are estimates, which is what
+    the reserves are for.
+    """
+
+    def __init__(self, probe=None, tuning_config: Optional[TuningConfig] = None):
+        self.probe = probe or HardwareProbe()
+        self.config = tuning_config or config.tuning
+
+    def tune_file(
+        self,
+        model_config: ModelConfig,
+        path: str,
+        vram_limit: Optional[int] = None,
+        ram_limit: Optional[int] = None
+    ) -> TuningDecision:
+        """Tune for a GGUF file; the limits further cap what the probe reports (e.g. pool budgets)."""
+        profile = ModelProfile.from_gguf(read_gguf_info(path))
+        return self.tune(model_config, profile, self.probe.probe(), vram_limit, ram_limit)
+
+    def tune(
+        self,
+        model_config: ModelConfig,
+        profile: ModelProfile,
+        hardware: HardwareInfo,
+        vram_limit: Optional[int] = None,
+        ram_limit: Optional[int] = None
+    ) -> TuningDecision:
+        max_ctx = min(profile.trained_ctx or self.config.max_ctx, self.config.max_ctx)
+        min_ctx = min(self.config.min_ctx, max_ctx)
+        contexts = _halvings(max_ctx, min_ctx)
+
+        vram = _budget(hardware.vram_free_bytes, vram_limit, self.config.vram_reserve_mb * MB)
+        ram = _budget(hardware.ram_available_bytes, ram_limit, self.config.ram_reserve_mb * MB)
+        count_weights = not model_config.use_mmap or model_config.use_mlock
+
+        def fits_ram(n_gpu_layers: int, n_ctx: int, n_batch: int) -> bool:
+            return ram is None or profile.cpu_bytes(n_gpu_layers, n_ctx, n_batch, count_weights) <= ram
+
+        def fits_vram(n_gpu_layers: int, n_ctx: int, n_batch: int) -> bool:
+            return profile.gpu_bytes(n_gpu_layers, n_ctx, n_batch) <= vram
+
+        batch = 512
+        full = profile.n_layers + 1  # Every block plus the output layer
+
+        if hardware.vram_free_bytes is None:
+            # Without VRAM figures the configured GPU settings are kept, within the trained context
+            n_gpu_layers = full if model_config.n_gpu_layers < 0 else model_config.n_gpu_layers
+            n_ctx = min(model_config.n_ctx, profile.trained_ctx or model_config.n_ctx)
+            batch = min(model_config.n_batch, n_ctx)
+            reason = "VRAM unknown, configured offload kept"
+        else:
+            if not vram or not profile.n_layers:
+                n_gpu_layers = 0
+                n_ctx = next((n for n in contexts if fits_ram(0, n, batch)), min_ctx)
+                reason = "no usable GPU, running on the CPU"
+            else:
+                n_ctx = next((n for n in contexts if fits_vram(full, n, batch) and fits_ram(full, n, batch)), None)
+                if n_ctx is not None:
+                    n_gpu_layers = full
+                    reason = "all layers offloaded"
+                else:
+                    n_ctx = min_ctx
+                    n_gpu_layers = next(
+                        (layers for layers in range(profile.n_layers, 0, -1)
+                         if fits_vram(layers, n_ctx, batch) and fits_ram(layers, n_ctx, batch)),
+                        0
+                    )
+                    reason = f"{n_gpu_layers} of {profile.n_layers} layers fit in VRAM"
+
+            # Leftover memory goes to the batch size, within the context
+            batch = next(
+                (size for size in BATCH_SIZES
+                 if size <= n_ctx
+                 and (n_gpu_layers == 0 or fits_vram(n_gpu_layers, n_ctx, size))
+                 and fits_ram(n_gpu_layers, n_ctx, size)),
+                min(BATCH_SIZES[-1], n_ctx)
+            )
+
+        # Layers on the CPU use every core but one, leaving it to the handler; offloaded ones barely need the CPU
+        if n_gpu_layers >= full:
+            n_threads = min(hardware.cpu_cores, 4)
+        else:
+            n_threads = max(hardware.cpu_cores - 1, 1)
+
+        return TuningDecision(
+            n_gpu_layers=n_gpu_layers,
+            n_ctx=n_ctx,
+            n_batch=batch,
+            n_threads=n_threads,
+            reason=reason,
+            estimated_vram_bytes=profile.gpu_bytes(n_gpu_layers, n_ctx, batch),
+            estimated_ram_bytes=profile.cpu_bytes(n_gpu_layers, n_ctx, batch, count_weights),
+            hardware={
+                "vram_free_bytes": hardware.vram_free_bytes,
+                "vram_total_bytes": hardware.vram_total_bytes,
+                "gpu_count": hardware.gpu_count,
+                "ram_available_bytes": hardware.ram_available_bytes,
+                "cpu_cores": hardware.cpu_cores,
+                "trained_ctx": profile.trained_ctx,
+                "n_layers": profile.n_layers
+            }
+        )
+
+
+def _budget(available: Optional[int], limit: Optional[int], reserve: int) -> Optional[int]:
+    """Bytes the tuner may plan with, or None when nothing is known."""
+    if available is None:
+        return None if limit is None else max(limit - reserve, 0)
+    if limit is not None:
+        available = min(available, limit)
+    return max(available - reserve, 0)
+
+
+def _halvings(largest: int, smallest: int) -> List[int]:
+    """Context sizes to try, largest first, on ``CONTEXT_STEP`` boundaries."""
+    sizes = []
+    size = max(largest // CONTEXT_STEP * CONTEXT_STEP, smallest)
+    while size > smallest:
+        sizes.append(size)
+        size = max(size // 2 // CONTEXT_STEP * CONTEXT_STEP, smallest)
+    sizes.append(smallest)
+    return sizes
@@ -0,0 +1,695 @@
+"""Request scheduling and continuous batching in front of the inference engine."""
+
+import asyncio
+import logging
+import queue
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Dict, Any, Optional, List, Iterator, Callable, Tuple, Union
+
+from admission import CostModel, estimate_tokens, priority_score, resolve_priority
+from config import config, SchedulerConfig
+from prefix_cache import longest_common_prefix
+from streaming import ChunkCoalescer, StreamTimer, StopSequenceFilter, StopGuard, STOP_REASONS
+
+logger = logging.getLogger(__name__)
+
+_END = object()
+
+
+class RequestHandle:
+    """Delivers chunks produced on the scheduler thread to the caller.
+
+    Async callers iterate with ``async for``; synchronous callers (tests,
+    benchmarks) iterate normally. Every item uses the streaming chunk format
+    of ``InferenceEngine.stream_generate``.
+    """
+
+    def __init__(self, loop: Optional[asyncio.AbstractEventLoop] = None):
+        self._loop = loop
+        if loop is not None:
+            self._queue = asyncio.Queue()
+        else:
+            self._queue = queue.Queue()
+        self.cancelled = False
+        self._on_final: Optional[Callable[[Dict[str, Any]], None]] = None
+
+    def push(self, item: Dict[str, Any]):
+        """Send an item to the consumer (called from the scheduler thread)."""
+        if self._on_final is not None and item is not _END and item["finish_reason"] is not None:
+            self._on_final(item)
+
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._queue.put_nowait, item)
+        else:
+            self._queue.put(item)
+
+    def close(self):
+        """Signal the consumer that no more items will follow."""
+        self.push(_END)
+
+    def cancel(self, on_final: Optional[Callable[[Dict[str, Any]], None]] = None):
+        """Ask the scheduler to stop working on this request.
+
+        Nobody reads the handle after its consumer went away; ``on_final`` is
+        called on the scheduler thread with the final chunk instead, so the
+        partial result can still be accounted for.
+        """
+        self._on_final = on_final
+        self.cancelled = True
+
+    def __iter__(self):
+        while True:
+            item = self._queue.get()
+            if item is _END:
+                return
+            yield item
+
+    async def __aiter__(self):
+        while True:
+            item = await self._queue.get()
+            if item is _END:
+                return
+            yield item
+
+
+@dataclass
+class ScheduledRequest:
+    """A generation request waiting for, or holding, model time."""
+    handle: RequestHandle
+    params: Any
+    prompt: Union[str, List[int]]
+    prompt_tokens: Optional[List[int]] = None
+    run_exclusive: Optional[Callable[[], Iterator[Dict[str, Any]]]] = None
+    submitted_at: float = field(default_factory=time.perf_counter)
+    priority: str = "normal"
+    cost_seconds: float = 0.0  # Expected model time when it was queued
+    guard: Optional[StopGuard] = None
+    # Request of the same batch job whose KV cells cover the first tokens of this prompt
+    shared_prefix: Optional[Tuple["ScheduledRequest", int]] = None
+    sequence: Optional["BatchSequence"] = None
+
+    def __post_init__(self):
+        if self.guard is None:
+            self.guard = StopGuard(getattr(self.params, "deadline", None), lambda: self.handle.cancelled)
+
+    @property
+    def batchable(self) -> bool:
+        return self.run_exclusive is None
+
+    def stopped_chunk(self, reason: str) -> Dict[str, Any]:
+        """Final chunk of a request that stopped before it got any model time."""
+        return {
+            "text": "",
+            "token_ids": [],
+            "finish_reason": reason,
+            "usage": {
+                "prompt_tokens": 0,
+                "completion_tokens": 0,
+                "total_tokens": 0,
+                "skipped_tokens": getattr(self.params, "max_tokens", 0)
+            },
+            "timings": {"queue_wait_ms": round((time.perf_counter() - self.submitted_at) * 1000, 3)}
+        }
+
+
+class BatchSequence:
+    """Decode state of one request inside the continuous batch."""
+
+    def __init__(self, request: ScheduledRequest, seq_id: int, backend):
+        from batch_decoder import TokenSampler, IncrementalDetokenizer
+
+        params = request.params
+        self.request = request
+        self.seq_id = seq_id
+        self.prompt_tokens = request.prompt_tokens
+        self.max_tokens = min(params.max_tokens, backend.n_ctx - len(self.prompt_tokens))
+        self.reserved_tokens = len(self.prompt_tokens) + self.max_tokens
+        self.n_prefilled = 0
+        self.n_past = 0
+        self.generated: List[int] = []
+        self.pending_token: Optional[int] = None
+        self.finish_reason: Optional[str] = None
+        self.retired = False
+        self.prefill_tokens_saved = 0
+        # Summed only when the request is ranked by it
+        self.cumulative_logprob = 0.0 if getattr(params, "logprobs", False) else None
+
+        self.sampler = TokenSampler(
+            temperature=params.temperature,
+            top_k=params.top_k,
+            top_p=params.top_p,
+            repeat_penalty=params.repeat_penalty,
+            seed=getattr(params, "seed", None)
+        )
+        self.detokenizer = IncrementalDetokenizer(backend, self.prompt_tokens)
+        self.stop_filter = StopSequenceFilter(params.stop_sequences)
+        # Admitted now; the timer reports how long the request was queued
+        self.timer = StreamTimer(request.submitted_at)
+        self.timer.mark_started()
+        self.coalescer = ChunkCoalescer(params.stream_chunk_tokens, params.stream_chunk_interval_ms)
+
+    @property
+    def history(self) -> List[int]:
+        """Recent context used for the repeat penalty."""
+        return self.prompt_tokens[-self.sampler.penalty_last_n:] + self.generated[-self.sampler.penalty_last_n:]
+
+    @property
+    def prefilling(self) -> bool:
+        return self.n_prefilled < len(self.prompt_tokens)
+
+    def accept_token(self, token: int, backend, logprobs=None) -> bool:
+        """Record a sampled token and push its text. Returns True when the sequence is done."""
+        if backend.is_eog(token):
+            self.finish_reason = "stop"
+            return True
+
+        if logprobs is not None:
+            self.cumulative_logprob += float(logprobs[token])
+        self.generated.append(token)
+        now = time.perf_counter()
+        self.timer.mark_token(now)
+
+        text = self.stop_filter.feed(self.detokenizer.add(token))
+        ready = self.coalescer.add(text, [token], now)
+        if ready is not None:
+            self.request.handle.push(ready)
+
+        if self.stop_filter.stopped:
+            self.finish_reason = "stop"
+            return True
+
+        if len(self.generated) >= self.max_tokens:
+            self.finish_reason = "length"
+            return True
+
+        self.pending_token = token
+        return False
+
+    def final_chunk(self) -> Dict[str, Any]:
+        """Build the last chunk with usage and timings."""
+        if not self.stop_filter.stopped:
+            tail = self.stop_filter.feed(self.detokenizer.flush()) + self.stop_filter.flush()
+            if tail:
+                self.coalescer.add(tail, [])
+
+        chunk = self.coalescer.flush() or {"text": "", "token_ids": [], "finish_reason": None}
+        chunk["finish_reason"] = self.finish_reason or "stop"
+        chunk["usage"] = {
+            "prompt_tokens": len(self.prompt_tokens),
+            "completion_tokens": len(self.generated),
+            "total_tokens": len(self.prompt_tokens) + len(self.generated)
+        }
+        if self.finish_reason in STOP_REASONS:
+            chunk["usage"]["skipped_tokens"] = self.max_tokens - len(self.generated)
+        if self.prefill_tokens_saved:
+            chunk["usage"]["prefill_tokens_saved"] = self.prefill_tokens_saved
+        if self.cumulative_logprob is not None:
+            chunk["cumulative_logprob"] = round(self.cumulative_logprob, 4)
+        chunk["timings"] = self.timer.report()
+        return chunk
+
+
+class RequestScheduler:
+    """Owns the model on a single thread and interleaves requests on it.
+
+    Requests that only need plain sampling decode together as parallel
+    llama.cpp sequences: new requests are admitted between decode steps and
+    finished ones are retired immediately. Everything else runs exclusively
+    once the batch has drained. With ``parallel_sequences == 1`` every request
+    runs exclusively, one after the other.
+
+    Queued requests are taken in arrival order (``fifo``) or, by default,
+    shortest expected job first (``sjf``): the cost model turns prompt tokens
+    and ``max_tokens`` into expected seconds, and priority classes and the
+    time already waited shift that rank.
+    """
+
+    def __init__(self, inference_engine, scheduler_config: Optional[SchedulerConfig] = None):
+        self.engine = inference_engine
+        self.config = scheduler_config or config.scheduler
+        self.backend = None
+
+        self._pending = deque()
+        self._active: List[BatchSequence] = []
+        self._free_seq_ids = list(range(1, self.config.parallel_sequences + 1))
+        self._reserved_tokens = 0
+        self._prefill_budget = None
+        self._batch_mode = False
+        self._exclusive: Optional[ScheduledRequest] = None
+        self._exclusive_started = 0.0
+        self.cost_model = CostModel(self.config.prefill_tokens_per_second, self.config.decode_tokens_per_second)
+        self._cond = threading.Condition()
+        self._thread = None
+        self._running = False
+
+        self.stats = {
+            "requests_completed": 0,
+            "batched_requests": 0,
+            "exclusive_requests": 0,
+            "decode_steps": 0,
+            "tokens_generated": 0,
+            "batch_jobs": 0,
+            "shared_prefix_tokens": 0,
+            "stopped_requests": 0,
+            "reordered_requests": 0
+        }
+
+    def start(self):
+        """Start the scheduler thread."""
+        if self.config.parallel_sequences > 1:
+            from batch_decoder import LlamaBatchBackend
+            self.backend = LlamaBatchBackend(self.engine.model)
+            self._prefill_budget = self.backend.n_batch
+
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name="request-scheduler", daemon=True)
+        self._thread.start()
+        logger.info(
+            f"Request scheduler started (max_concurrency={self.config.max_concurrency}, "
+            f"parallel_sequences={self.config.parallel_sequences}, policy={self.config.policy})"
+        )
+
+    def stop(self):
+        """Stop the scheduler thread once current work is done."""
+        with self._cond:
+            self._running = False
+            self._cond.notify_all()
+
+        if self._thread is not None:
+            self._thread.join()
+
+        if self.backend is not None:
+            self.backend.close()
+
+    def submit(
+        self,
+        params,
+        prompt: Optional[str] = None,
+        messages: Optional[List[Dict[str, str]]] = None,
+        loop: Optional[asyncio.AbstractEventLoop] = None
+    ) -> RequestHandle:
+        """Queue a generation request and return the handle its chunks arrive on."""
+        request = self._make_request(params, self.engine.build_prompt(prompt=prompt, messages=messages), loop)
+
+        with self._cond:
+            self._pending.append(request)
+            self._cond.notify()
+
+        return request.handle
+
+    def submit_exclusive(
+        self,
+        run: Callable[[], Iterator[Dict[str, Any]]],
+        loop: Optional[asyncio.AbstractEventLoop] = None,
+        prompt_tokens: int = 0,
+        priority: Optional[str] = None
+    ) -> RequestHandle:
+        """Queue work that needs the whole model, such as an embed job.
+
+        ``run`` is called on the scheduler thread and yields chunks in the
+        streaming format. ``prompt_tokens`` is the (estimated) number of
+        tokens it evaluates, which is all its cost consists of.
+        """
+        request = ScheduledRequest(
+            handle=RequestHandle(loop),
+            params=None,
+            prompt="",
+            run_exclusive=run,
+            priority=resolve_priority(priority, self.config.default_priority),
+            cost_seconds=self.cost_model.estimate(prompt_tokens, 0)
+        )
+
+        with self._cond:
+            self._pending.append(request)
+            self._cond.notify()
+
+        return request.handle
+
+    def submit_batch(
+        self,
+        requests: List[Tuple[Any, Union[str, List[int]]]],
+        loop: Optional[asyncio.AbstractEventLoop] = None
+    ) -> List[RequestHandle]:
+        """Queue the (params, formatted prompt) items of a batch job together.
+
+        Items are queued sorted by prompt tokens, so items with a common
+        prefix run next to each other. In the continuous batch, an item
+        sharing at least ``min_shared_prefix`` tokens with the first item of
+        its group copies those KV cells instead of prefilling them again; run
+        exclusively, llama.cpp reuses the prefix left in its context by the
+        previous item. Handles are returned in the original order.
+        """
+        if not requests:
+            return []
+
+        # Sorting needs tokens; the prompts then do not have to be tokenized again
+        scheduled = [
+            self._make_request(params, self.engine.tokenize_prompt(prompt), loop)
+            for params, prompt in requests
+        ]
+        ordered = sorted(scheduled, key=lambda request: request.prompt)
+
+        leader = None
+        for request in ordered:
+            if not request.batchable:
+                continue
+            if leader is not None:
+                shared = min(
+                    longest_common_prefix(leader.prompt_tokens, request.prompt_tokens),
+                    len(request.prompt_tokens) - 1  # The last prompt token must be evaluated for its logits
+                )
+                if shared >= self.config.min_shared_prefix:
+                    request.shared_prefix = (leader, shared)
+                    continue
+            leader = request
+
+        with self._cond:
+            self._pending.extend(ordered)
+            self.stats["batch_jobs"] += 1
+            self._cond.notify()
+
+        return [request.handle for request in scheduled]
+
+    def submit_samples(
+        self,
+        params_list: List[Any],
+        prompt: Union[str, List[int]],
+        loop: Optional[asyncio.AbstractEventLoop] = None
+    ) -> List[RequestHandle]:
+        """Queue several samples of one formatted prompt that share its prefill.
+
+        In the continuous batch the first sample prefills the prompt and the
+        others copy its KV cells, evaluating only the last prompt token for
+        their own logits. Run exclusively, the samples are queued next to
+        each other and llama.cpp finds the prompt still in its context.
+        """
+        prompt_tokens = self.engine.tokenize_prompt(prompt)
+        scheduled = [self._make_request(params, prompt_tokens, loop) for params in params_list]
+
+        leader = scheduled[0]
+        for request in scheduled[1:]:
+            if len(prompt_tokens) > 1:
+                request.shared_prefix = (leader, len(prompt_tokens) - 1)
+
+        with self._cond:
+            self._pending.extend(scheduled)
+            self._cond.notify()
+
+        return [request.handle for request in scheduled]
+
+    def _make_request(self, params, formatted_prompt: Union[str, List[int]], loop: Optional[asyncio.AbstractEventLoop]) -> ScheduledRequest:
+        """Wrap a formatted prompt, deciding whether it can join the continuous batch."""
+        request = ScheduledRequest(
+            handle=RequestHandle(loop),
+            params=params,
+            prompt=formatted_prompt,
+            priority=resolve_priority(getattr(params, "priority", None), self.config.default_priority)
+        )
+
+        if self.backend is not None and self.engine.supports_batching(params):
+            request.prompt_tokens = self.engine.tokenize_prompt(formatted_prompt)
+            if len(request.prompt_tokens) >= self.backend.n_ctx:
+                request.prompt_tokens = None
+
+        if request.prompt_tokens is None:
+            request.run_exclusive = lambda: self.engine.run_request(formatted_prompt, params, request.guard)
+
+        prompt_tokens = len(request.prompt_tokens) if request.prompt_tokens is not None else estimate_tokens(formatted_prompt)
+        request.cost_seconds = self.cost_model.estimate(prompt_tokens, params.max_tokens)
+        return request
+
+    def _next_pending(self) -> ScheduledRequest:
+        """The queued request that should get model time next (caller holds the lock)."""
+        if self.config.policy == "fifo" or len(self._pending) == 1:
+            return self._pending[0]
+
+        now = time.perf_counter()
+
+        def rank(indexed: Tuple[int, ScheduledRequest]) -> Tuple[float, int]:
+            index, request = indexed
+            # Items sharing a prompt prefix keep the rank of the item they share it with
+            anchor = request.shared_prefix[0] if request.shared_prefix is not None else request
+            score = priority_score(
+                anchor.cost_seconds,
+                request.priority,
+                now - request.submitted_at,
+                self.config.priority_step_seconds,
+                self.config.aging
+            )
+            return score, index
+
+        index, request = min(enumerate(self._pending), key=rank)
+        if index:
+            self.stats["reordered_requests"] += 1
+        return request
+
+    def expected_wait_seconds(self) -> float:
+        """How long a request queued now is expected to wait for model time.
+
+        The expected remaining time of everything queued and running, spread
+        over the parallel sequences that work through it.
+        """
+        with self._cond:
+            total = sum(request.cost_seconds for request in self._pending)
+            for sequence in self._active:
+                total += self.cost_model.remaining(
+                    len(sequence.prompt_tokens) - sequence.n_prefilled, sequence.max_tokens, len(sequence.generated)
+                )
+            if self._exclusive is not None:
+                total += max(self._exclusive.cost_seconds - (time.perf_counter() - self._exclusive_started), 0.0)
+        return total / self.config.parallel_sequences
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get scheduler counters."""
+        with self._cond:
+            return {
+                **self.stats,
+                "pending_requests": len(self._pending),
+                "active_sequences": len(self._active),
+                "reserved_kv_tokens": self._reserved_tokens,
+                "parallel_sequences": self.config.parallel_sequences,
+                "policy": self.config.policy,
+                "expected_wait_seconds": round(self.expected_wait_seconds(), 3),
+                "cost_model": self.cost_model.get_stats()
+            }
+
+    def _run(self):
+        """Scheduler loop: admit, run exclusive work or take one decode step."""
+        idle_wait = self.config.idle_wait_ms / 1000.0
+
+        while True:
+            exclusive = None
+            with self._cond:
+                while self._running and not self._pending and not self._active:
+                    self._cond.wait(idle_wait)
+
+                if not self._running and not self._pending and not self._active:
+                    return
+
+                head = self._next_pending() if self._pending else None
+                if head is not None and not head.batchable and not self._active:
+                    self._pending.remove(head)
+                    exclusive = self._exclusive = head
+                    self._exclusive_started = time.perf_counter()
+                else:
+                    self._admit_batchable()
+
+            if exclusive is not None:
+                self._run_exclusive(exclusive)
+            elif self._active:
+                self._step()
+
+    def _admit_batchable(self):
+        """Move queued batchable requests into free sequences (caller holds the lock).
+
+        Admission stops at the first request that cannot be admitted, so an
+        exclusive or a large request is not overtaken forever.
+        """
+        while self._pending and self._free_seq_ids:
+            request = self._next_pending()
+            if not request.batchable:
+                break
+
+            reason = request.guard.check()
+            if reason is not None:
+                self._pending.remove(request)
+                request.handle.push(request.stopped_chunk(reason))
+                request.handle.close()
+                self.stats["stopped_requests"] += 1
+                continue
+
+            needed = min(len(request.prompt_tokens) + request.params.max_tokens, self.backend.n_ctx)
+            if self._reserved_tokens + needed > self.backend.n_ctx:
+                break
+
+            if not self._batch_mode:
+                self.backend.clear()
+                self._batch_mode = True
+
+            self._pending.remove(request)
+            sequence = BatchSequence(request, self._free_seq_ids.pop(0), self.backend)
+            request.sequence = sequence
+            self._reserved_tokens += sequence.reserved_tokens
+            self._active.append(sequence)
+            self.stats["batched_requests"] += 1
+
+    def _run_exclusive(self, request: ScheduledRequest):
+        """Run a request that needs the whole model."""
+        if self._batch_mode:
+            self.backend.clear()
+            self._batch_mode = False
+
+        reason = request.guard.check()
+        if reason is not None:
+            request.handle.push(request.stopped_chunk(reason))
+            request.handle.close()
+            self.stats["stopped_requests"] += 1
+            return
+
+        self.stats["exclusive_requests"] += 1
+        queue_wait_ms = round((time.perf_counter() - request.submitted_at) * 1000, 3)
+        try:
+            for chunk in request.run_exclusive():
+                if chunk["finish_reason"] is not None:
+                    if "timings" in chunk:
+                        chunk["timings"]["queue_wait_ms"] = queue_wait_ms
+                    if chunk["finish_reason"] != "error":
+                        self.cost_model.observe(chunk, getattr(request.params, "max_tokens", None))
+                if chunk["finish_reason"] in STOP_REASONS:
+                    self.stats["stopped_requests"] += 1
+                request.handle.push(chunk)
+        except Exception as e:
+            logger.error(f"Error running request: {e}")
+            request.handle.push({"text": "", "token_ids": [], "finish_reason": "error", "error": str(e)})
+        finally:
+            request.handle.close()
+            self.stats["requests_completed"] += 1
+            with self._cond:
+                self._exclusive = None
+
+    def _step(self):
+        """Evaluate one batch: a token for every decoding sequence plus prefill chunks."""
+        from batch_decoder import BatchEntry, KVCacheFullError, log_softmax
+
+        # Cancelled and expired requests leave the batch before it is built, prefilling or not
+        for sequence in list(self._active):
+            reason = sequence.request.guard.check()
+            if reason is not None:
+                sequence.finish_reason = reason
+                self.stats["stopped_requests"] += 1
+                self._retire(sequence, sequence.final_chunk())
+        if not self._active:
+            return
+
+        entries = []
+        sampling = []
+
+        for sequence in self._active:
+            if not sequence.prefilling and sequence.pending_token is not None:
+                entries.append(BatchEntry(sequence.pending_token, sequence.n_past, sequence.seq_id, True))
+                sampling.append(sequence)
+
+        budget = min(self._prefill_budget, self.backend.n_batch - len(entries))
+        prefill_progress = []
+        for sequence in self._active:
+            if budget <= 0:
+                break
+            if not sequence.prefilling:
+                continue
+            if sequence.request.shared_prefix is not None and not self._share_prefix(sequence):
+                continue  # The group's first item has not evaluated the shared tokens yet
+
+            start = sequence.n_prefilled
+            end = min(len(sequence.prompt_tokens), start + budget)
+            for pos in range(start, end):
+                last = pos == len(sequence.prompt_tokens) - 1
+                entries.append(BatchEntry(sequence.prompt_tokens[pos], pos, sequence.seq_id, last))
+            if end == len(sequence.prompt_tokens):
+                sampling.append(sequence)
+            prefill_progress.append((sequence, end))
+            budget -= end - start
+
+        if not entries:
+            return
+
+        try:
+            rows = self.backend.decode(entries)
+        except KVCacheFullError:
+            if self._prefill_budget > 1 and prefill_progress:
+                self._prefill_budget = max(self._prefill_budget // 2, 1)
+                self.backend.defragment()
+                logger.warning(f"KV cache fragmented, prefill budget reduced to {self._prefill_budget}")
+                return
+            self._fail_active("KV cache full")
+            return
+        except Exception as e:
+            logger.error(f"Error in batched decode: {e}")
+            self._fail_active(str(e))
+            return
+
+        self._prefill_budget = min(self._prefill_budget * 2, self.backend.n_batch)
+        self.stats["decode_steps"] += 1
+
+        for sequence, end in prefill_progress:
+            sequence.n_prefilled = end
+            sequence.n_past = end
+
+        finished = []
+        for sequence, row in zip(sampling, rows):
+            if sequence.pending_token is not None:
+                sequence.n_past += 1
+                sequence.pending_token = None
+
+            # The sampler applies its penalties to the row in place
+            logprobs = log_softmax(row) if sequence.cumulative_logprob is not None else None
+            token = sequence.sampler.sample(row, sequence.history)
+            done = sequence.accept_token(token, self.backend, logprobs)
+            self.stats["tokens_generated"] += 1
+
+            if done:
+                finished.append(sequence)
+
+        for sequence in finished:
+            self._retire(sequence, sequence.final_chunk())
+
+    def _share_prefix(self, sequence: BatchSequence) -> bool:
+        """Copy the KV cells of a shared prompt prefix. Returns False while they are not ready."""
+        leader, shared = sequence.request.shared_prefix
+        source = leader.sequence
+
+        if source is not None and not source.retired:
+            if source.n_prefilled < shared:
+                return False
+            self.backend.copy_sequence(source.seq_id, sequence.seq_id, shared)
+            sequence.n_prefilled = shared
+            sequence.n_past = shared
+            sequence.prefill_tokens_saved = shared
+            self.stats["shared_prefix_tokens"] += shared
+
+        # Without a source (cancelled or already finished) the prefix is prefilled as usual
+        sequence.request.shared_prefix = None
+        return True
+
+    def _retire(self, sequence: BatchSequence, final_chunk: Dict[str, Any]):
+        """Remove a sequence from the batch and release its KV cells."""
+        self.backend.remove_sequence(sequence.seq_id)
+        sequence.retired = True
+
+        with self._cond:
+            self._active.remove(sequence)
+            self._free_seq_ids.append(sequence.seq_id)
+            self._reserved_tokens -= sequence.reserved_tokens
+
+        if final_chunk["finish_reason"] != "error":
+            self.cost_model.observe(final_chunk, sequence.max_tokens)
+        sequence.request.handle.push(final_chunk)
+        sequence.request.handle.close()
+        self.stats["requests_completed"] += 1
+
+    def _fail_active(self, error: str):
+        """Abort every sequence in the batch after an unrecoverable decode error."""
+        for sequence in list(self._active):
+            self._retire(sequence, {"text": "", "token_ids": [], "finish_reason": "error", "error": error})
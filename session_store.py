@@ -0,0 +1,294 @@
+"""Chat session KV snapshots kept in RAM and persisted to the network volume."""
+
+import io
+import json
+import logging
+import os
+import re
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, Any
+
+from prefix_cache import state_size
+
+logger = logging.getLogger(__name__)
+
+SESSION_ID_PATTERN = re.compile(r"^[A-Za-z0-9_.-]{1,128}$")
+
+
+def is_valid_session_id(session_id: str) -> bool:
+    """Session ids become file names, so only allow a safe character set."""
+    return bool(SESSION_ID_PATTERN.match(session_id)) and session_id not in (".", "..")
+
+
+class SessionStore:
+    """Keeps the KV state at the end of each session's last turn.
+
+    Snapshots live in RAM first (bounded by ``max_ram_bytes``, LRU) and are
+    written behind to ``directory`` on the network volume so that the next
+    turn can resume on any worker. Sessions idle for longer than
+    ``ttl_seconds`` are dropped from both tiers, and the volume tier is kept
+    under ``max_disk_bytes`` by removing the least recently used snapshots.
+    Only the latest unwritten snapshot of a session is kept for the writer, so
+    a slow volume holds back at most one state per session.
+    A snapshot and its metadata share one file, so a worker on another host
+    never pairs a new KV state with the metadata of an older one.
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        model_id: str,
+        ttl_seconds: int = 3600,
+        max_ram_bytes: int = 1024 * 1024 * 1024,
+        max_disk_bytes: int = 10 * 1024 * 1024 * 1024,
+        persist: bool = True
+    ):
+        self.directory = Path(directory)
+        self.model_id = model_id
+        self.ttl_seconds = ttl_seconds
+        self.max_ram_bytes = max_ram_bytes
+        self.max_disk_bytes = max_disk_bytes
+        self.persist = persist
+
+        self._ram: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._ram_bytes = 0
+        self._lock = threading.Lock()
+        self._pending: "OrderedDict[str, Any]" = OrderedDict()
+        self._pending_ready = threading.Condition(self._lock)
+        self._closing = False
+        self._writer = None
+
+        self.stats = {
+            "ram_hits": 0,
+            "disk_hits": 0,
+            "misses": 0,
+            "expired": 0,
+            "ram_evictions": 0,
+            "disk_evictions": 0,
+            "disk_writes": 0,
+            "writes_coalesced": 0
+        }
+
+        if self.persist:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            self._writer = threading.Thread(target=self._write_loop, name="session-writer", daemon=True)
+            self._writer.start()
+
+    def get(self, session_id: str):
+        """Return the saved state for a session, or None if there is none."""
+        now = time.time()
+
+        with self._lock:
+            entry = self._ram.get(session_id)
+            if entry is not None:
+                if now - entry["last_used"] > self.ttl_seconds:
+                    self._drop_ram(session_id)
+                    entry = None
+                    self.stats["expired"] += 1
+                else:
+                    entry["last_used"] = now
+                    self._ram.move_to_end(session_id)
+                    self.stats["ram_hits"] += 1
+                    return entry["state"]
+
+        if not self.persist:
+            self._count("misses")
+            return None
+
+        state = self._load_from_disk(session_id, now)
+        if state is None:
+            self._count("misses")
+            return None
+
+        self._count("disk_hits")
+        self._put_ram(session_id, state, now)
+        return state
+
+    def put(self, session_id: str, state):
+        """Save the state at the end of a turn and schedule it for the volume."""
+        now = time.time()
+        self._put_ram(session_id, state, now)
+
+        if self.persist:
+            with self._pending_ready:
+                # A snapshot still waiting for the writer is superseded by this one
+                if session_id in self._pending:
+                    self.stats["writes_coalesced"] += 1
+                self._pending[session_id] = state
+                self._pending_ready.notify()
+
+    def delete(self, session_id: str):
+        """Forget a session in both tiers."""
+        with self._lock:
+            if session_id in self._ram:
+                self._drop_ram(session_id)
+            self._pending.pop(session_id, None)
+
+        if self.persist:
+            self._remove_files(session_id)
+
+    def close(self):
+        """Finish pending writes and stop the writer thread."""
+        if self._writer is not None:
+            with self._pending_ready:
+                self._closing = True
+                self._pending_ready.notify()
+            self._writer.join()
+            self._writer = None
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get session store counters."""
+        with self._lock:
+            return {
+                **self.stats,
+                "ram_sessions": len(self._ram),
+                "ram_bytes": self._ram_bytes,
+                "pending_writes": len(self._pending)
+            }
+
+    def _count(self, name: str, amount: int = 1):
+        with self._lock:
+            self.stats[name] += amount
+
+    def _put_ram(self, session_id: str, state, now: float):
+        size = state_size(state)
+
+        with self._lock:
+            if session_id in self._ram:
+                self._drop_ram(session_id)
+
+            if size > self.max_ram_bytes:
+                return
+
+            self._ram[session_id] = {"state": state, "size": size, "last_used": now}
+            self._ram_bytes += size
+
+            while self._ram_bytes > self.max_ram_bytes:
+                oldest = next(iter(self._ram))
+                self._drop_ram(oldest)
+                self.stats["ram_evictions"] += 1
+
+    def _drop_ram(self, session_id: str):
+        """Remove a RAM entry (caller holds the lock)."""
+        entry = self._ram.pop(session_id)
+        self._ram_bytes -= entry["size"]
+
+    def _remove_files(self, session_id: str):
+        self._path(session_id).unlink(missing_ok=True)
+
+    def _path(self, session_id: str) -> Path:
+        return self.directory / f"{session_id}.npz"
+
+    def _write_loop(self):
+        """Write snapshots to the volume off the request path."""
+        while True:
+            with self._pending_ready:
+                while not self._pending and not self._closing:
+                    self._pending_ready.wait()
+                if not self._pending:
+                    return
+                session_id, state = self._pending.popitem(last=False)
+            try:
+                self._write_to_disk(session_id, state)
+                self._count("disk_writes")
+                self._enforce_disk_budget()
+            except Exception as e:
+                logger.error(f"Error persisting session {session_id}: {e}")
+
+    def _write_to_disk(self, session_id: str, state):
+        import numpy as np
+
+        path = self._path(session_id)
+
+        meta = {
+            "model_id": self.model_id,
+            "n_tokens": int(state.n_tokens),
+            "llama_state_size": int(state.llama_state_size),
+            "saved_at": time.time()
+        }
+
+        buffer = io.BytesIO()
+        np.savez(
+            buffer,
+            input_ids=np.asarray(state.input_ids),
+            scores=np.asarray(state.scores),
+            llama_state=np.frombuffer(bytes(state.llama_state), dtype=np.uint8),
+            meta=np.array(json.dumps(meta))
+        )
+
+        # One rename replaces state and metadata together, so readers never see a partial snapshot;
+        # the temporary name is unique since workers on other hosts may write the same session
+        temp_path = path.with_name(f"{path.name}.{uuid.uuid4().hex}.tmp")
+        with open(temp_path, "wb") as f:
+            f.write(buffer.getvalue())
+        os.replace(temp_path, path)
+
+    def _load_from_disk(self, session_id: str, now: float):
+        path = self._path(session_id)
+
+        try:
+            if not path.exists():
+                return None
+
+            if now - path.stat().st_mtime > self.ttl_seconds:
+                self._count("expired")
+                self.delete(session_id)
+                return None
+
+            # Import here to avoid issues if llama-cpp-python is not installed
+            import numpy as np
+            from llama_cpp import LlamaState
+
+            with np.load(path) as data:
+                meta = json.loads(str(data["meta"]))
+                if meta.get("model_id") != self.model_id:
+                    logger.warning(f"Session {session_id} was saved for another model, ignoring it")
+                    return None
+
+                state = LlamaState(
+                    input_ids=data["input_ids"],
+                    scores=data["scores"],
+                    n_tokens=meta["n_tokens"],
+                    llama_state=data["llama_state"].tobytes(),
+                    llama_state_size=meta["llama_state_size"]
+                )
+
+            # Touch the snapshot so TTL and LRU follow the last use
+            os.utime(path, None)
+            return state
+
+        except Exception as e:
+            logger.error(f"Error loading session {session_id} from volume: {e}")
+            return None
+
+    def _enforce_disk_budget(self):
+        """Delete expired snapshots, then the least recently used ones over budget."""
+        now = time.time()
+        snapshots = []
+
+        for path in self.directory.glob("*.npz"):
+            session_id = path.stem
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            last_used, size = stat.st_mtime, stat.st_size
+
+            if now - last_used > self.ttl_seconds:
+                self._remove_files(session_id)
+                self._count("expired")
+                continue
+
+            snapshots.append((last_used, session_id, size))
+
+        total = sum(size for _, _, size in snapshots)
+        for _, session_id, size in sorted(snapshots):
+            if total <= self.max_disk_bytes:
+                break
+            self._remove_files(session_id)
+            total -= size
+            self._count("disk_evictions")
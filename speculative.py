@@ -0,0 +1,157 @@
+"""Speculative decoding drafts for llama-cpp-python and their acceptance accounting."""
+
+import logging
+import threading
+from typing import Dict, Any, Optional
+
+from prefix_cache import longest_common_prefix
+
+logger = logging.getLogger(__name__)
+
+SPECULATIVE_MODES = ("off", "prompt_lookup", "draft")
+
+
+class DraftModelDecoding:
+    """Drafts tokens greedily with a small model that shares the target's vocabulary.
+
+    Implements the ``LlamaDraftModel`` call protocol: it receives the
+    target's token history and returns the tokens it expects to follow. The
+    draft model keeps its own KV cache, so only the tokens that are new since
+    the previous call are evaluated.
+    """
+
+    def __init__(self, model, num_pred_tokens: int = 4):
+        self.model = model
+        self.num_pred_tokens = num_pred_tokens
+
+    def __call__(self, input_ids, /, **kwargs):
+        # Import here to keep numpy off the startup path
+        import numpy as np
+
+        tokens = input_ids.tolist()
+        if len(tokens) + self.num_pred_tokens >= self.model.n_ctx():
+            return np.array([], dtype=np.intc)
+
+        # Keep the matching prefix, but always evaluate the last token for its logits
+        reused = min(longest_common_prefix(self.model._input_ids.tolist(), tokens), len(tokens) - 1)
+        self.model.n_tokens = reused
+        self.model._ctx.kv_cache_seq_rm(-1, reused, -1)
+        self.model.eval(tokens[reused:])
+
+        drafted = []
+        for _ in range(self.num_pred_tokens):
+            token = self.model.sample(top_k=1, temp=0.0)
+            if self.model.token_eos() == token:
+                break
+            drafted.append(token)
+            self.model.eval([token])
+
+        return np.array(drafted, dtype=np.intc)
+
+
+class SpeculationTracker:
+    """Wraps a draft model for one request and counts drafted and accepted tokens.
+
+    llama-cpp-python asks the draft model for tokens once per target forward
+    pass, passing the context including the token that was just sampled. Of
+    the ``k`` tokens drafted at context length ``n``, ``m - n - 1`` were
+    accepted when the next call comes at length ``m``.
+    """
+
+    def __init__(self, mode: str, draft):
+        self.mode = mode
+        self.draft = draft
+        self.steps = 0
+        self.drafted_tokens = 0
+        self.accepted_tokens = 0
+        self._last_call = None
+
+    def __call__(self, input_ids, /, **kwargs):
+        self._settle(len(input_ids))
+        drafted = self.draft(input_ids, **kwargs)
+        self.steps += 1
+        self.drafted_tokens += len(drafted)
+        self._last_call = (len(input_ids), len(drafted))
+        return drafted
+
+    def _settle(self, length: int):
+        """Attribute the tokens that appeared since the previous draft to it."""
+        if self._last_call is None:
+            return
+        previous_length, drafted = self._last_call
+        self.accepted_tokens += max(0, min(drafted, length - previous_length - 1))
+        self._last_call = None
+
+    def finish(self, prompt_tokens: int, completion_tokens: int):
+        """Account for the last draft once generation is over."""
+        self._settle(prompt_tokens + completion_tokens + 1)
+
+    def report(self, completion_tokens: int) -> Dict[str, Any]:
+        """Per-request acceptance figures."""
+        return {
+            "mode": self.mode,
+            "drafted_tokens": self.drafted_tokens,
+            "accepted_tokens": self.accepted_tokens,
+            "acceptance_rate": round(self.accepted_tokens / self.drafted_tokens, 4) if self.drafted_tokens else 0.0,
+            "target_steps": self.steps,
+            # Tokens produced per forward pass of the target model; 1.0 without speculation
+            "estimated_speedup": round(completion_tokens / self.steps, 3) if self.steps else 1.0
+        }
+
+
+class SpeculativeStats:
+    """Aggregate acceptance figures and decode rates with and without speculation."""
+
+    def __init__(self, min_tokens: int = 16, smoothing: float = 0.1):
+        self.min_tokens = min_tokens
+        self.smoothing = smoothing
+        self._lock = threading.Lock()
+        self._rates: Dict[str, Optional[float]] = {"off": None, "speculative": None}
+
+        self.stats = {
+            "requests": 0,
+            "drafted_tokens": 0,
+            "accepted_tokens": 0,
+            "target_steps": 0,
+            "completion_tokens": 0
+        }
+
+    def record(self, tracker: Optional[SpeculationTracker], completion_tokens: int, seconds: float) -> Optional[float]:
+        """Add a finished exclusive request; returns its speedup over plain decoding if known."""
+        kind = "speculative" if tracker is not None else "off"
+
+        with self._lock:
+            if tracker is not None:
+                self.stats["requests"] += 1
+                self.stats["drafted_tokens"] += tracker.drafted_tokens
+                self.stats["accepted_tokens"] += tracker.accepted_tokens
+                self.stats["target_steps"] += tracker.steps
+                self.stats["completion_tokens"] += completion_tokens
+
+            if completion_tokens < self.min_tokens or seconds <= 0:
+                return None
+
+            rate = completion_tokens / seconds
+            previous = self._rates[kind]
+            self._rates[kind] = rate if previous is None else previous + self.smoothing * (rate - previous)
+
+            baseline = self._rates["off"]
+            if tracker is None or baseline is None:
+                return None
+            return round(rate / baseline, 3)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Totals, acceptance rate and the measured speedup of speculative requests."""
+        with self._lock:
+            plain = self._rates["off"]
+            speculative = self._rates["speculative"]
+            drafted = self.stats["drafted_tokens"]
+            steps = self.stats["target_steps"]
+            return {
+                **self.stats,
+                "acceptance_rate": round(self.stats["accepted_tokens"] / drafted, 4) if drafted else 0.0,
+                "estimated_speedup": round(self.stats["completion_tokens"] / steps, 3) if steps else None,
+                "plain_tokens_per_second": round(plain, 2) if plain is not None else None,
+                "speculative_tokens_per_second": round(speculative, 2) if speculative is not None else None,
+                "measured_speedup": round(speculative / plain, 3) if plain and speculative is not None else None
+            }
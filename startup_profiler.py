@@ -0,0 +1,144 @@
+"""Timing of startup phases, including work that runs in the background."""
+
+import logging
+import os
+import threading
+import time
+from concurrent.futures import Future, wait
+from contextlib import contextmanager
+from typing import Dict, Any, List, Optional, Callable
+
+logger = logging.getLogger(__name__)
+
+
+def process_age_seconds() -> Optional[float]:
+    """Seconds since this process was started (Linux only)."""
+    try:
+        with open("/proc/self/stat", "r") as f:
+            # The command name may contain spaces, so split after its closing parenthesis
+            fields = f.read().rsplit(")", 1)[1].split()
+        with open("/proc/uptime", "r") as f:
+            uptime = float(f.read().split()[0])
+        return uptime - int(fields[19]) / os.sysconf("SC_CLK_TCK")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+class StartupProfiler:
+    """Records named phases relative to the moment the profiler was created.
+
+    Phases run either inline (``phase``) or on their own thread
+    (``background``), so the report shows which work overlapped and how much
+    wall time that saved compared to running everything in sequence:
+    ``overlap_saved_ms`` is the time background phases ran minus the time
+    startup spent blocked on them in ``wait`` or ``wait_for_background``.
+    """
+
+    def __init__(self):
+        self.origin = time.perf_counter()
+        self.process_age_at_start = process_age_seconds()
+        self.finished_at: Optional[float] = None
+        self._phases: List[Dict[str, Any]] = []
+        self._background: List[Future] = []
+        self._waited = 0.0
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def phase(self, name: str, background: bool = False):
+        """Time the enclosed block as a phase."""
+        start = time.perf_counter()
+        error = None
+        try:
+            yield
+        except BaseException as e:
+            error = str(e) or type(e).__name__
+            raise
+        finally:
+            self._record(name, start, time.perf_counter(), background, error)
+
+    def background(self, name: str, func: Callable, *args, **kwargs) -> Future:
+        """Run ``func`` as a phase on a daemon thread and return its future."""
+        future = Future()
+
+        def run():
+            try:
+                with self.phase(name, background=True):
+                    result = func(*args, **kwargs)
+                future.set_result(result)
+            except BaseException as e:
+                future.set_exception(e)
+
+        with self._lock:
+            self._background.append(future)
+
+        threading.Thread(target=run, name=f"startup-{name}", daemon=True).start()
+        return future
+
+    def wait(self, future: Future):
+        """Return the result of a background phase; time spent blocked on it is not overlap."""
+        start = time.perf_counter()
+        try:
+            return future.result()
+        finally:
+            with self._lock:
+                if future in self._background:
+                    self._waited += time.perf_counter() - start
+
+    def wait_for_background(self, timeout: Optional[float] = None):
+        """Wait until every background phase has finished, successfully or not."""
+        with self._lock:
+            futures = list(self._background)
+        start = time.perf_counter()
+        wait(futures, timeout=timeout)
+        with self._lock:
+            self._waited += time.perf_counter() - start
+
+    def finish(self):
+        """Mark the end of startup."""
+        self.finished_at = time.perf_counter()
+
+    def _record(self, name: str, start: float, end: float, background: bool, error: Optional[str]):
+        phase = {
+            "name": name,
+            "start_ms": round((start - self.origin) * 1000, 1),
+            "duration_ms": round((end - start) * 1000, 1),
+            "background": background
+        }
+        if error is not None:
+            phase["error"] = error
+
+        with self._lock:
+            self._phases.append(phase)
+
+    def report(self) -> Dict[str, Any]:
+        """Timing breakdown of everything recorded so far."""
+        with self._lock:
+            phases = sorted(self._phases, key=lambda phase: phase["start_ms"])
+            waited_ms = self._waited * 1000
+
+        end = self.finished_at or time.perf_counter()
+        wall_ms = round((end - self.origin) * 1000, 1)
+        background_ms = sum(phase["duration_ms"] for phase in phases if phase["background"])
+
+        return {
+            "process_age_at_start_ms": (
+                round(self.process_age_at_start * 1000, 1) if self.process_age_at_start is not None else None
+            ),
+            "wall_time_ms": wall_ms,
+            "background_time_ms": round(background_ms, 1),
+            "background_wait_ms": round(waited_ms, 1),
+            "overlap_saved_ms": round(max(background_ms - waited_ms, 0.0), 1),
+            "finished": self.finished_at is not None,
+            "phases": phases
+        }
+
+    def log_report(self):
+        """Log the phases from slowest to fastest."""
+        report = self.report()
+        logger.info(
+            f"Startup took {report['wall_time_ms']:.0f} ms, "
+            f"{report['overlap_saved_ms']:.0f} ms saved by background phases"
+        )
+        for phase in sorted(report["phases"], key=lambda phase: -phase["duration_ms"]):
+            suffix = " (background)" if phase["background"] else ""
+            logger.info(f"  {phase['name']}: {phase['duration_ms']:.0f} ms at +{phase['start_ms']:.0f} ms{suffix}")
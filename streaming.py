@@ -0,0 +1,265 @@
+"""Streaming helpers: chunk coalescing, token latency tracking and stopping criteria."""
+
+import time
+from typing import Dict, Any, Optional, List, Callable
+
+# Finish reasons of requests stopped before the model was done with them
+STOP_REASONS = ("cancelled", "deadline")
+
+
+class StreamTimer:
+    """Tracks time-to-first-token and inter-token latency for one stream."""
+
+    def __init__(self, start_time: Optional[float] = None):
+        self.start_time = start_time if start_time is not None else time.perf_counter()
+        self.started_time = None
+        self.first_token_time = None
+        self.last_token_time = None
+        self.intervals: List[float] = []
+
+    def mark_started(self, now: Optional[float] = None):
+        """Record when the model started working on a request that was queued at ``start_time``."""
+        self.started_time = now if now is not None else time.perf_counter()
+
+    def mark_token(self, now: Optional[float] = None):
+        """Record the arrival of a decoded token (or token group)."""
+        if now is None:
+            now = time.perf_counter()
+
+        if self.first_token_time is None:
+            self.first_token_time = now
+        else:
+            self.intervals.append(now - self.last_token_time)
+
+        self.last_token_time = now
+
+    def report(self) -> Dict[str, Any]:
+        """Build the timing summary attached to the final stream chunk."""
+        end_time = self.last_token_time or time.perf_counter()
+
+        report = {
+            "ttft_ms": None,
+            "inter_token_latency_ms": None,
+            "total_time_ms": round((end_time - self.start_time) * 1000, 3)
+        }
+
+        if self.started_time is not None:
+            report["queue_wait_ms"] = round((self.started_time - self.start_time) * 1000, 3)
+
+        if self.first_token_time is not None:
+            report["ttft_ms"] = round((self.first_token_time - self.start_time) * 1000, 3)
+            # Prompt evaluation and the first sample, without the time spent queued
+            report["prefill_ms"] = round((self.first_token_time - (self.started_time or self.start_time)) * 1000, 3)
+            report["decode_time_ms"] = round((self.last_token_time - self.first_token_time) * 1000, 3)
+
+        if self.intervals:
+            ordered = sorted(self.intervals)
+            report["inter_token_latency_ms"] = {
+                "mean": round(sum(ordered) / len(ordered) * 1000, 3),
+                "p50": round(ordered[len(ordered) // 2] * 1000, 3),
+                "p95": round(ordered[min(int(len(ordered) * 0.95), len(ordered) - 1)] * 1000, 3),
+                "max": round(ordered[-1] * 1000, 3)
+            }
+
+        return report
+
+
+class TokenClock:
+    """llama-cpp-python stopping criterion that only timestamps sampled tokens.
+
+    Passed as ``stopping_criteria`` it gives non-streamed completions the
+    same timings as streamed ones. llama-cpp-python may check the criteria
+    more than once per token, so a token is only counted when the context
+    has grown since the previous call.
+    """
+
+    def __init__(self, timer: StreamTimer):
+        self.timer = timer
+        self._length = -1
+
+    def __call__(self, input_ids, logits) -> bool:
+        length = len(input_ids)
+        if length > self._length:
+            self._length = length
+            self.timer.mark_token()
+        return False
+
+
+class StopGuard:
+    """llama-cpp-python stopping criterion that ends a request when it is cancelled or past its deadline.
+
+    llama-cpp-python checks its criteria after every sampled token and
+    returns the text generated so far, so the model is free again one decode
+    step after the request stopped mattering. ``reason`` keeps the first
+    reason found; the scheduler checks the same guard between batched decode
+    steps.
+    """
+
+    def __init__(self, deadline: Optional[float] = None, is_cancelled: Optional[Callable[[], bool]] = None):
+        self.deadline = deadline  # time.perf_counter() value
+        self.is_cancelled = is_cancelled
+        self.reason: Optional[str] = None
+
+    def check(self) -> Optional[str]:
+        """Return "cancelled" or "deadline" once the request should stop, None before."""
+        if self.reason is None:
+            if self.is_cancelled is not None and self.is_cancelled():
+                self.reason = "cancelled"
+            elif self.deadline is not None and time.perf_counter() >= self.deadline:
+                self.reason = "deadline"
+        return self.reason
+
+    def __call__(self, input_ids, logits) -> bool:
+        return self.check() is not None
+
+
+def combine_criteria(*criteria: Callable) -> Callable:
+    """One stopping criterion from several; every one of them sees every call."""
+    def combined(input_ids, logits) -> bool:
+        results = [criterion(input_ids, logits) for criterion in criteria]
+        return any(results)
+    return combined
+
+
+class TokenRecorder:
+    """Records the token ids llama-cpp-python's completion loop samples.
+
+    Stream chunks carry text only, and stopping criteria and logits
+    processors see a token once it has been evaluated, one step after it was
+    sampled. ``wrap`` puts a recorder around ``Llama.generate``, which the
+    completion loop iterates, so every token is seen as the loop receives
+    it. The loop keeps a token once it asks for the next one; the token it
+    received last is held back (``pending``) until ``finish`` says whether
+    the loop kept it, because an end-of-generation token is dropped.
+    """
+
+    def __init__(self):
+        self.tokens: List[int] = []
+        self.pending = False
+        self.closed = False
+        self._taken = 0
+
+    def wrap(self, generate: Callable) -> Callable:
+        """A ``generate`` that records what the wrapped one yields."""
+        def recording_generate(*args, **kwargs):
+            try:
+                for token in generate(*args, **kwargs):
+                    self.tokens.append(token)
+                    self.pending = True
+                    yield token
+                    self.pending = False
+            finally:
+                self.closed = True
+        return recording_generate
+
+    def take(self) -> List[int]:
+        """Tokens recorded since the last call.
+
+        While generation runs the newest token belongs to the text the loop
+        is yielding; once it stopped, a pending token waits for ``finish``.
+        """
+        end = len(self.tokens) - 1 if self.closed and self.pending else len(self.tokens)
+        taken = self.tokens[self._taken:end]
+        self._taken = max(self._taken, end)
+        return taken
+
+    def finish(self, keep_pending: bool):
+        """Settle the token the loop received last, once generation is over."""
+        if self.pending and not keep_pending:
+            self.tokens.pop()
+        self.pending = False
+
+
+class ChunkCoalescer:
+    """Groups decoded deltas into larger chunks before they are sent to the client.
+
+    A chunk is flushed once it holds ``chunk_tokens`` tokens or once
+    ``chunk_interval_ms`` has passed since the first delta it contains.
+    """
+
+    def __init__(self, chunk_tokens: int = 1, chunk_interval_ms: int = 0):
+        self.chunk_tokens = max(int(chunk_tokens), 1)
+        self.chunk_interval = max(int(chunk_interval_ms), 0) / 1000.0
+        self._text_parts: List[str] = []
+        self._token_ids: List[int] = []
+        self._started_at = None
+
+    def add(self, text: str, token_ids: List[int], now: Optional[float] = None) -> Optional[Dict[str, Any]]:
+        """Add a delta and return a chunk if one is ready to be sent."""
+        if now is None:
+            now = time.perf_counter()
+
+        if self._started_at is None:
+            self._started_at = now
+
+        self._text_parts.append(text)
+        self._token_ids.extend(token_ids)
+
+        if len(self._token_ids) >= self.chunk_tokens:
+            return self.flush()
+
+        if self.chunk_interval and now - self._started_at >= self.chunk_interval:
+            return self.flush()
+
+        return None
+
+    def flush(self) -> Optional[Dict[str, Any]]:
+        """Return whatever is buffered as a chunk, or None if nothing is pending."""
+        if not self._text_parts and not self._token_ids:
+            return None
+
+        chunk = {
+            "text": "".join(self._text_parts),
+            "token_ids": self._token_ids,
+            "finish_reason": None
+        }
+
+        self._text_parts = []
+        self._token_ids = []
+        self._started_at = None
+
+        return chunk
+
+
+class StopSequenceFilter:
+    """Cuts decoded text at the first stop sequence.
+
+    Text that could still turn out to be the beginning of a stop sequence is
+    held back until the next delta proves otherwise.
+    """
+
+    def __init__(self, stop_sequences: Optional[List[str]] = None):
+        self.stop_sequences = [stop for stop in (stop_sequences or []) if stop]
+        self.stopped = False
+        self._pending = ""
+
+    def feed(self, text: str) -> str:
+        """Add decoded text and return the part that is safe to emit."""
+        buffer = self._pending + text
+
+        first_match = None
+        for stop in self.stop_sequences:
+            index = buffer.find(stop)
+            if index != -1 and (first_match is None or index < first_match):
+                first_match = index
+
+        if first_match is not None:
+            self.stopped = True
+            self._pending = ""
+            return buffer[:first_match]
+
+        hold = 0
+        for stop in self.stop_sequences:
+            for length in range(min(len(stop) - 1, len(buffer)), hold, -1):
+                if buffer.endswith(stop[:length]):
+                    hold = length
+                    break
+
+        self._pending = buffer[len(buffer) - hold:] if hold else ""
+        return buffer[:len(buffer) - hold]
+
+    def flush(self) -> str:
+        """Release any held-back text once generation has ended."""
+        pending = self._pending
+        self._pending = ""
+        return pending
@@ -0,0 +1,6 @@
+"""The worker modules live at the repository root, next to handler.py."""
+
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
@@ -0,0 +1,28 @@
+import json
+
+import pytest
+
+import benchmark
+
+
+@pytest.mark.parametrize("mode", [[], ["--chat"], ["--stream"], ["--target", "engine"]])
+def test_fake_model_workload_runs_without_errors(mode, tmp_path):
+    """The stub model drives the whole job path, so this catches crashes in any request flavour."""
+    output = tmp_path / "report.json"
+    argv = [
+        "--requests", "4",
+        "--warmup", "1",
+        "--prompt-tokens", "16-64",
+        "--max-tokens", "8",
+        "--fake-tokens-per-second", "5000",
+        "--output", str(output),
+        *mode
+    ]
+
+    assert benchmark.main(argv) == 0
+
+    with open(output) as f:
+        report = json.load(f)
+    assert report["requests"] == 4
+    assert report["errors"] == 0
+    assert report["throughput"]["completion_tokens_per_second"] > 0
@@ -0,0 +1,30 @@
+import json
+import time
+
+from download_lease import DownloadLease
+
+
+def test_holder_notices_when_its_lease_is_taken_over(tmp_path):
+    lease = DownloadLease(str(tmp_path), "model.gguf", stale_seconds=1, worker_id="slow-worker")
+    assert lease.try_acquire()
+    assert not lease.lost.is_set()
+
+    # Another worker decided the lease was stale and replaced it
+    with open(lease.path, "w") as f:
+        json.dump({"worker_id": "other-worker", "acquired_at": time.time()}, f)
+
+    assert lease.lost.wait(timeout=5)
+    lease.release()
+    assert lease.holder() == "other-worker"
+
+
+def test_second_worker_waits_for_a_live_lease(tmp_path):
+    first = DownloadLease(str(tmp_path), "model.gguf", stale_seconds=60, worker_id="first")
+    second = DownloadLease(str(tmp_path), "model.gguf", stale_seconds=60, worker_id="second")
+
+    assert first.try_acquire()
+    assert not second.try_acquire()
+
+    first.release()
+    assert second.try_acquire()
+    second.release()
@@ -0,0 +1,159 @@
+import hashlib
+import json
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from downloader import DownloadAborted, DownloadError, ParallelDownloader
+
+CHUNK_SIZE = 64 * 1024
+
+
+class RangeServer(ThreadingHTTPServer):
+    """Serves one payload with range support and records the ranges asked for."""
+
+    daemon_threads = True
+
+    def __init__(self, payload: bytes):
+        super().__init__(("127.0.0.1", 0), RangeHandler)
+        self.payload = payload
+        self.ranges = []
+        self.failing_offsets = set()
+        self.lock = threading.Lock()
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}/model.gguf"
+
+
+class RangeHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        payload = self.server.payload
+        byte_range = self.headers.get("Range")
+        if byte_range is None:
+            self.send_response(200)
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+            return
+
+        start, end = (int(value) for value in byte_range.split("=", 1)[1].split("-"))
+        with self.server.lock:
+            self.server.ranges.append((start, end))
+            failing = start in self.server.failing_offsets
+
+        if failing:
+            self.send_error(500)
+            return
+
+        body = payload[start:end + 1]
+        self.send_response(206)
+        self.send_header("Content-Range", f"bytes {start}-{end}/{len(payload)}")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def payload() -> bytes:
+    # Not a multiple of the chunk size, so the last range is short
+    return os.urandom(10 * CHUNK_SIZE + 1234)
+
+
+@pytest.fixture
+def server(payload):
+    server = RangeServer(payload)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def make_downloader(server, dest, sha256: str) -> ParallelDownloader:
+    return ParallelDownloader(
+        url=server.url,
+        dest_path=str(dest),
+        expected_size=len(server.payload),
+        expected_sha256=sha256,
+        workers=3,
+        chunk_size=CHUNK_SIZE,
+        max_retries=0
+    )
+
+
+def test_download_is_verified_before_it_is_renamed_into_place(server, payload, tmp_path):
+    dest = tmp_path / "model.gguf"
+    sha256 = hashlib.sha256(payload).hexdigest()
+    seen = {}
+
+    def before_publish(part_path: str, digest: str):
+        seen.update(digest=digest, dest_exists=dest.exists(), part=open(part_path, "rb").read())
+
+    downloader = make_downloader(server, dest, sha256)
+    assert downloader.download(before_publish=before_publish) == str(dest)
+
+    assert seen == {"digest": sha256, "dest_exists": False, "part": payload}
+    assert dest.read_bytes() == payload
+    assert downloader.sha256 == sha256
+    assert not os.path.exists(downloader.part_path)
+    assert not os.path.exists(downloader.map_path)
+
+
+def test_interrupted_download_resumes_from_the_range_map(server, payload, tmp_path):
+    dest = tmp_path / "model.gguf"
+    sha256 = hashlib.sha256(payload).hexdigest()
+    server.failing_offsets = {7 * CHUNK_SIZE}
+
+    downloader = make_downloader(server, dest, sha256)
+    with pytest.raises(DownloadError):
+        downloader.download()
+
+    assert not dest.exists()
+    with open(downloader.map_path) as f:
+        done = set(json.load(f)["done"])
+    assert done and 7 not in done
+
+    server.failing_offsets = set()
+    server.ranges.clear()
+    make_downloader(server, dest, sha256).download()
+
+    assert dest.read_bytes() == payload
+    # The probe asks for bytes 0-0; every other request is a chunk
+    fetched = {start // CHUNK_SIZE for start, end in server.ranges if end > 0}
+    assert 7 in fetched
+    assert not fetched & done
+
+
+def test_sha256_mismatch_discards_the_download(server, tmp_path):
+    dest = tmp_path / "model.gguf"
+    published = []
+
+    downloader = make_downloader(server, dest, "0" * 64)
+    with pytest.raises(DownloadError, match="SHA-256 mismatch"):
+        downloader.download(before_publish=lambda part_path, digest: published.append(part_path))
+
+    assert published == []
+    assert not dest.exists()
+    assert not os.path.exists(downloader.part_path)
+    assert not os.path.exists(downloader.map_path)
+
+
+def test_abort_stops_without_touching_the_partial_files(server, payload, tmp_path):
+    dest = tmp_path / "model.gguf"
+    abort = threading.Event()
+
+    downloader = make_downloader(server, dest, hashlib.sha256(payload).hexdigest())
+    downloader.abort = abort
+    with pytest.raises(DownloadAborted):
+        downloader.download(progress_callback=lambda downloaded, total: abort.set())
+
+    # Whoever aborted us owns the .part file and its range map now
+    assert not dest.exists()
+    assert os.path.exists(downloader.part_path)
+    assert not os.path.exists(downloader.map_path)
@@ -0,0 +1,38 @@
+from types import SimpleNamespace
+
+import numpy as np
+
+from prefix_cache import PrefixKVCache
+
+
+def make_state(tokens):
+    return SimpleNamespace(
+        input_ids=np.array(tokens, dtype=np.intc),
+        scores=np.zeros((len(tokens), 4), dtype=np.single),
+        n_tokens=len(tokens),
+        llama_state=b"",
+        llama_state_size=16
+    )
+
+
+def test_saved_tokens_count_only_what_the_resident_context_lacks():
+    model = SimpleNamespace(_input_ids=np.zeros(0, dtype=np.intc))
+    cache = PrefixKVCache(max_bytes=1 << 20, min_prefix_tokens=4, model=model)
+    preamble = list(range(100, 140))
+    cache[preamble + [1, 2]] = make_state(preamble + [1, 2])
+    prompt = preamble + [3, 4]
+
+    # Cold context: llama.cpp loads the state and skips the 40 shared tokens
+    cache[prompt]
+    assert cache.saved_tokens == 40
+
+    # The context already holds the preamble, so the state is not loaded
+    model._input_ids = np.array(preamble + [5], dtype=np.intc)
+    cache[prompt]
+    assert cache.saved_tokens == 40
+
+    # Only part of it is resident: the state adds the rest
+    model._input_ids = np.array(preamble[:30], dtype=np.intc)
+    cache[prompt]
+    assert cache.saved_tokens == 50
+    assert cache.hits == 3
@@ -0,0 +1,80 @@
+import threading
+
+import numpy as np
+import pytest
+
+llama_cpp = pytest.importorskip("llama_cpp")
+
+from session_store import SessionStore
+
+
+def make_state(n_tokens: int = 4, fill: int = 7):
+    return llama_cpp.LlamaState(
+        input_ids=np.arange(n_tokens, dtype=np.intc),
+        scores=np.full((n_tokens, 8), 0.5, dtype=np.single),
+        n_tokens=n_tokens,
+        llama_state=bytes([fill]) * 64,
+        llama_state_size=64
+    )
+
+
+def test_session_round_trips_through_the_volume(tmp_path):
+    writer = SessionStore(str(tmp_path), model_id="model-a")
+    writer.put("chat-1", make_state())
+    writer.close()
+
+    # A fresh store has nothing in RAM, so this reads the snapshot back from disk
+    reader = SessionStore(str(tmp_path), model_id="model-a")
+    state = reader.get("chat-1")
+    reader.close()
+
+    assert state is not None
+    assert reader.get_stats()["disk_hits"] == 1
+    assert state.n_tokens == 4
+    assert state.llama_state == bytes([7]) * 64
+    assert state.llama_state_size == 64
+    np.testing.assert_array_equal(state.input_ids, np.arange(4, dtype=np.intc))
+    np.testing.assert_array_equal(state.scores, np.full((4, 8), 0.5, dtype=np.single))
+
+
+def test_snapshot_of_another_model_is_ignored(tmp_path):
+    writer = SessionStore(str(tmp_path), model_id="model-a")
+    writer.put("chat-1", make_state())
+    writer.close()
+
+    reader = SessionStore(str(tmp_path), model_id="model-b")
+    assert reader.get("chat-1") is None
+    reader.close()
+
+
+def test_pending_writes_keep_only_the_latest_state_per_session(tmp_path, monkeypatch):
+    store = SessionStore(str(tmp_path), model_id="model-a")
+    writing, release = threading.Event(), threading.Event()
+    write_to_disk = store._write_to_disk
+
+    def slow_write(session_id, state):
+        writing.set()
+        release.wait(timeout=5)
+        write_to_disk(session_id, state)
+
+    monkeypatch.setattr(store, "_write_to_disk", slow_write)
+
+    # The writer is busy with the first snapshot while the volume is slow
+    store.put("chat-1", make_state(fill=1))
+    assert writing.wait(timeout=5)
+    for fill in (2, 3, 4):
+        store.put("chat-1", make_state(fill=fill))
+    store.put("chat-2", make_state(fill=5))
+
+    stats = store.get_stats()
+    assert stats["pending_writes"] == 2
+    assert stats["writes_coalesced"] == 2
+
+    release.set()
+    store.close()
+    assert store.get_stats()["disk_writes"] == 3
+
+    reader = SessionStore(str(tmp_path), model_id="model-a")
+    assert reader.get("chat-1").llama_state == bytes([4]) * 64
+    assert reader.get("chat-2").llama_state == bytes([5]) * 64
+    reader.close()